@@ -0,0 +1,168 @@
+import os
+import bisect
+from datetime import date
+
+import numpy as np
+
+from player import NO_LIST
+from utils import read_json_file, write_json_file_atomic
+
+
+class ScoreArchive:
+    '''
+    Columnar archive of old score history, one season (calendar year) per set
+    of files. A season is stored as packed date ordinal, event code, score and
+    score list id arrays, sorted by player and date so each player's scores are one slice,
+    and the arrays are memory-mapped so reading a player's history only
+    touches that slice.
+
+    manifest.json lists each season's files, players and slice offsets.
+    Every change to the archive is a new generation: new season files are
+    written first and the manifest is swapped in last, so a crash leaves the
+    previous generation intact.
+    '''
+    COLUMNS = [("date", np.int32), ("event", np.int8), ("score", np.int32), ("list", np.int32)]
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = read_json_file(self._path("manifest.json")) or {"generation": 0, "events": [], "seasons": {}, "archived": {}}
+        self._columns = {}
+
+    def _path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    @property
+    def generation(self):
+        return self.manifest["generation"]
+
+    def archived_before(self, generation):
+        # ISO date the given generation archived everything before
+        return self.manifest["archived"][str(generation)]
+
+    def _season_columns(self, season):
+        # Memory-maps the season's arrays, nothing is read until they're sliced
+        if season not in self._columns:
+            prefix = self._path(self.manifest["seasons"][season]["prefix"])
+            columns = []
+            for name, dtype in ScoreArchive.COLUMNS:
+                filepath = f"{prefix}.{name}.npy"
+                # Seasons archived before list ids were kept have no list column
+                columns.append(np.load(filepath, mmap_mode="r") if os.path.exists(filepath) else np.full(len(columns[0]), NO_LIST, dtype=dtype))
+            self._columns[season] = columns
+        return self._columns[season]
+
+    def _slices(self, player):
+        # Yields (season, start, end) of the player's rows, oldest season first
+        for season in sorted(self.manifest["seasons"]):
+            season_info = self.manifest["seasons"][season]
+            idx = bisect.bisect_left(season_info["players"], player)
+            if idx < len(season_info["players"]) and season_info["players"][idx] == player:
+                yield season, season_info["offsets"][idx], season_info["offsets"][idx + 1]
+
+    def _rows(self, season, start, end, with_lists=False):
+        dates, events, scores, lists = self._season_columns(season)
+        event_names = self.manifest["events"]
+        rows = [
+            (date.fromordinal(day).isoformat(), event_names[event], score)
+            for day, event, score in zip(dates[start:end].tolist(), events[start:end].tolist(), scores[start:end].tolist())
+        ]
+        if with_lists:
+            rows = [row + (list_id,) for row, list_id in zip(rows, lists[start:end].tolist())]
+        return rows
+
+    def count(self, player):
+        return sum(end - start for _, start, end in self._slices(player))
+
+    def iter_scores(self, player, with_lists=False):
+        '''
+        Yields the player's archived (date, event, score) history, oldest first,
+        with the score list id as a fourth field if with_lists
+        '''
+        for season, start, end in self._slices(player):
+            yield from self._rows(season, start, end, with_lists)
+
+    def page(self, player, start, count):
+        '''
+        Returns the player's archived rows start through start+count-1 counting
+        from the newest one, newest first. Only those rows are read.
+        '''
+        rows = []
+        for season, first, last in reversed(list(self._slices(player))):
+            if start >= last - first:
+                start -= last - first
+                continue
+            end = last - start
+            begin = max(end - (count - len(rows)), first)
+            rows += reversed(self._rows(season, begin, end))
+            start = 0
+            if len(rows) == count:
+                break
+        return rows
+
+    def _write_column(self, filepath, array):
+        tmp_filepath = f"{filepath}.tmp"
+        with open(tmp_filepath, "wb") as f:
+            np.save(f, array)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filepath, filepath)
+
+    def add(self, scores, before, generation):
+        '''
+        Archives scores, {player: [(date, event, score, list id), ...]} of scores
+        shot before the ISO date before, as the given generation
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = {
+            "generation": generation,
+            "events": list(self.manifest["events"]),
+            "seasons": dict(self.manifest["seasons"]),
+            "archived": dict(self.manifest["archived"], **{str(generation): before})
+        }
+        event_codes = {event: code for code, event in enumerate(manifest["events"])}
+
+        by_season = {}
+        for player, player_scores in scores.items():
+            for day, event, score, list_id in player_scores:
+                if event not in event_codes:
+                    event_codes[event] = len(manifest["events"])
+                    manifest["events"].append(event)
+                by_season.setdefault(day[:4], []).append((player, date.fromisoformat(day).toordinal(), event_codes[event], int(score), list_id))
+
+        replaced = []
+        for season, rows in by_season.items():
+            players, dates, events, season_scores, lists = [], [], [], [], []
+            if season in manifest["seasons"]:
+                # Existing rows are merged with the new ones and the season is rewritten
+                season_info = manifest["seasons"][season]
+                old_dates, old_events, old_scores, old_lists = self._season_columns(season)
+                for player, start, end in zip(season_info["players"], season_info["offsets"], season_info["offsets"][1:]):
+                    players += [player] * (end - start)
+                dates, events, season_scores, lists = old_dates.tolist(), old_events.tolist(), old_scores.tolist(), old_lists.tolist()
+                replaced.append(season_info["prefix"])
+            for player, day, event, score, list_id in rows:
+                players.append(player)
+                dates.append(day)
+                events.append(event)
+                season_scores.append(score)
+                lists.append(list_id)
+
+            player_ids = sorted(set(players))
+            player_idx = np.searchsorted(np.array(player_ids, dtype=object), np.array(players, dtype=object))
+            # lexsort is stable, so rows from the same day keep the order they were recorded in
+            order = np.lexsort((np.array(dates), player_idx))
+            offsets = np.searchsorted(player_idx[order], np.arange(len(player_ids) + 1))
+
+            prefix = f"{season}.g{generation}"
+            for (name, dtype), column in zip(ScoreArchive.COLUMNS, [dates, events, season_scores, lists]):
+                self._write_column(self._path(f"{prefix}.{name}.npy"), np.array(column, dtype=dtype)[order])
+            manifest["seasons"][season] = {"prefix": prefix, "players": player_ids, "offsets": offsets.tolist()}
+
+        write_json_file_atomic(manifest, self._path("manifest.json"))
+        self.manifest = manifest
+        for prefix in replaced:
+            season = prefix.split(".")[0]
+            self._columns.pop(season, None)
+            for name, _ in ScoreArchive.COLUMNS:
+                if os.path.exists(self._path(f"{prefix}.{name}.npy")):
+                    os.remove(self._path(f"{prefix}.{name}.npy"))
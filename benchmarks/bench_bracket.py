@@ -0,0 +1,66 @@
+'''
+Compares the matplotlib and Pillow bracket renderers across bracket sizes.
+Prints one JSON object per (renderer, size).
+
+    python -m benchmarks.bench_bracket [sizes...]
+'''
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import statistics
+
+from elo_system import ELO_System
+from graphics import generate_bracket_image
+
+
+def make_bracket(num_players, seed=0):
+    random.seed(seed)
+    elo_system = ELO_System({}, {})
+    elo_system.start_tournament([(f"<@U{i}>", f"player{i}") for i in range(num_players)])
+
+    # Play out the first round so there are scores and advanced players to draw
+    for round_players in elo_system.tournaments["default"].bracket[:-1]:
+        for lower, upper in zip(round_players[::2], round_players[1::2]):
+            if lower and upper and lower["score"] is None:
+                elo_system.challenge_match(lower["id"], random.randint(0, 10), upper["id"], random.randint(11, 20))
+        break
+    return elo_system.get_tournament_bracket()
+
+
+def time_renderer(bracket, renderer, repeat):
+    timings = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        filepath = os.path.join(tmp_dir, "bracket.png")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            generate_bracket_image(bracket, filepath, renderer)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main(sizes):
+    # Import cost is measured separately from per-render cost
+    start = time.perf_counter()
+    from graphics import _pyplot
+    _pyplot()
+    print(json.dumps({"benchmark": "matplotlib_import", "seconds": time.perf_counter() - start}))
+
+    for num_players in sizes:
+        bracket = make_bracket(num_players)
+        for renderer in ["matplotlib", "pillow"]:
+            repeat = 3 if renderer == "matplotlib" else 10
+            timings = time_renderer(bracket, renderer, repeat)
+            print(json.dumps({
+                "benchmark": "bracket_render",
+                "renderer": renderer,
+                "players": num_players,
+                "median_seconds": statistics.median(timings),
+                "min_seconds": min(timings)
+            }))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [8, 16, 32, 64, 128, 256])
@@ -0,0 +1,130 @@
+'''
+Microbenchmarks for ELO_System on a generated league (see workload.py).
+Prints one JSON object per benchmark with the time per operation and the
+commit it ran on; compare two runs with benchmarks.compare.
+
+    python -m benchmarks.bench_elo_system [preset] > results.jsonl
+'''
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+
+from benchmarks.workload import PRESETS, build_league, player_id, run_info
+from elo_system import ELO_System
+from graphics import generate_bracket_image
+from storage import JSONStorage
+
+
+def per_op(fn, ops, repeat=3):
+    # Best of repeat runs of fn, which performs ops operations
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings) / ops
+
+
+def emit(info, benchmark, seconds_per_op, **params):
+    print(json.dumps(dict(info, benchmark=benchmark, seconds_per_op=seconds_per_op, **params)), flush=True)
+
+
+def main(preset="medium"):
+    info = dict(run_info(), league=preset)
+    num_players = PRESETS[preset][0]
+    rng = random.Random(1)
+
+    start = time.perf_counter()
+    elo_system = build_league(ELO_System({}, {}), preset)
+    emit(info, "build_league", time.perf_counter() - start, players=len(elo_system.records), duels=len(elo_system.duels))
+
+    score_lists = [
+        (rng.choice(ELO_System.EVENTS), [(player_id(p), rng.randint(500, 600)) for p in rng.sample(range(num_players), 5)])
+        for _ in range(2000)
+    ]
+    emit(info, "record_scores", per_op(lambda: [elo_system.record_scores(event, scores) for event, scores in score_lists], len(score_lists), repeat=1), players_per_list=5)
+
+    duels = [(player_id(a), rng.randint(0, 10), player_id(b), rng.randint(0, 10)) for a, b in (rng.sample(range(num_players), 2) for _ in range(2000))]
+    emit(info, "challenge_match", per_op(lambda: [elo_system.challenge_match(*duel) for duel in duels], len(duels), repeat=1))
+
+    for event, start_rank, end_rank in [(None, 0, 10), ("air", 0, 10), (None, 500, 520), ("sport", 500, 520)]:
+        emit(info, "get_leaderboard", per_op(lambda: [elo_system.get_leaderboard(event, start_rank, end_rank) for _ in range(1000)], 1000),
+             event=event, start=start_rank, end=end_rank)
+
+    def build_windows():
+        elo_system._windows = None
+        elo_system._get_windows()
+    emit(info, "build_windows", per_op(build_windows, 1), scores=sum(len(record.scores) for record in elo_system.records.values()))
+
+    def scan_leaderboard(event, since, until):
+        # The same ranking by scanning every player's history, what a window costs without the index
+        by_best = []
+        for player in elo_system.records:
+            scores = [score for day, score_event, score in elo_system.iter_scores(player) if score_event == event and since <= day <= until]
+            if scores:
+                by_best.append((player, max(scores)))
+        return sorted(by_best, key=lambda row: (-row[1], row[0]))[:10]
+
+    # Generated scores are from 2024, the record_scores above added some for today
+    for since, until in [("2024-12-01", "2024-12-31"), ("2024-01-01", "2024-12-31")]:
+        emit(info, "get_leaderboard", per_op(lambda: [elo_system.get_leaderboard("air", 0, 10, since, until) for _ in range(10)], 10),
+             event="air", start=0, end=10, since=since, until=until)
+        emit(info, "scan_leaderboard", per_op(lambda: scan_leaderboard("air", since, until), 1, repeat=1), event="air", since=since, until=until)
+
+    # A duel that isn't a tournament match is checked against every pending bracket
+    emit(info, "update_tournament", per_op(lambda: [elo_system._update_tournament(*duel) for duel in duels], len(duels)), match=False)
+
+    for size in [8, 64, 512]:
+        players = [(player_id(p), f"player{p}") for p in rng.sample(range(num_players), min(size, num_players))]
+        order = [player for player, _ in players]
+        emit(info, "start_tournament", per_op(lambda: [elo_system.start_tournament(players, order, f"bench-{size}") for _ in range(20)], 20), players=size)
+
+        # Every first round match in turn, each one found in the pending index
+        first_round = elo_system.tournaments[f"bench-{size}"].bracket[0]
+        matches = [(lower["id"], 6, upper["id"], 4) for lower, upper in zip(first_round[::2], first_round[1::2]) if lower and upper]
+        emit(info, "update_tournament", per_op(lambda: [elo_system._update_tournament(*match) for match in matches], len(matches), repeat=1),
+             match=True, players=size)
+
+    # Seeded formats at the size of a big open event
+    players = [(player_id(p), f"player{p}") for p in rng.sample(range(num_players), min(500, num_players))]
+    for format in ["seeded", "double", "swiss"]:
+        emit(info, "start_tournament", per_op(lambda: elo_system.start_tournament(players, name=f"bench-{format}", format=format), 1),
+             players=len(players), format=format)
+
+    # The next Swiss round is paired when the last result of the current one comes in. Results go
+    # to the tournament directly, the same pairs can be pending in the other bench tournaments.
+    swiss = elo_system.tournaments["bench-swiss"]
+    for round_idx in range(2, 6):
+        matches = [tuple(sorted(pair)) for pair in swiss._pending_matches]
+        for playerA, playerB in matches[:-1]:
+            swiss.record_result(playerA, 6, playerB, 4)
+        playerA, playerB = matches[-1]
+        emit(info, "pair_swiss_round", per_op(lambda: swiss.record_result(playerA, 6, playerB, 4), 1, repeat=1),
+             players=len(players), round=round_idx)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for snapshot_format in JSONStorage.SNAPSHOT_FORMATS:
+            filepath = os.path.join(tmp_dir, f"state-{snapshot_format}.json")
+            elo_system.storage = JSONStorage(filepath, use_journal=False, snapshot_format=snapshot_format)
+            emit(info, "save_to_json", per_op(elo_system.save_to_json, 1), bytes=os.path.getsize(filepath), format=snapshot_format)
+            emit(info, "from_json", per_op(lambda: ELO_System.from_json(filepath), 1), bytes=os.path.getsize(filepath), format=snapshot_format)
+        elo_system.storage = None
+
+        for renderer, sizes in [("pillow", [8, 64, 512]), ("matplotlib", [8, 64])]:
+            for size in sizes:
+                bracket = elo_system.get_tournament_bracket(f"bench-{size}")
+                filepath = os.path.join(tmp_dir, f"{renderer}-{size}.png")
+                emit(info, "generate_bracket_image", per_op(lambda: generate_bracket_image(bracket, filepath, renderer), 1), renderer=renderer, players=size)
+
+        for format in ["double", "swiss"]:
+            bracket = elo_system.get_tournament_bracket(f"bench-{format}")
+            filepath = os.path.join(tmp_dir, f"{format}.png")
+            emit(info, "generate_bracket_image", per_op(lambda: generate_bracket_image(bracket, filepath, "pillow"), 1),
+                 renderer="pillow", players=len(players), format=format)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
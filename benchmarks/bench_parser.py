@@ -0,0 +1,46 @@
+'''
+Times commands against the regexes elo_bot used before it on score lists of
+growing length and on duels. Prints one JSON object per (parser, command, size).
+
+    python -m benchmarks.bench_parser [sizes...]
+'''
+import sys
+import json
+import timeit
+
+import commands
+from benchmarks.fuzz_parser import legacy_score_list, legacy_duel
+
+
+def make_score_list(num_players):
+    return "air pistol " + " ".join(f"<@U{i:08d}|player{i}> {500 + i % 100}" for i in range(num_players))
+
+
+def time_parse(parse, text):
+    # Best of 5 runs, scaled so each run takes roughly the same time
+    number = max(1, 20000 // max(len(text) // 20, 1))
+    return min(timeit.repeat(lambda: parse(text), number=number, repeat=5)) / number
+
+
+def main(sizes):
+    for num_players in sizes:
+        text = make_score_list(num_players)
+        assert commands.parse_score_list(text) == legacy_score_list(text)
+        for name, parse in [("commands", commands.parse_score_list), ("legacy_regex", legacy_score_list)]:
+            seconds = time_parse(parse, text)
+            print(json.dumps({
+                "benchmark": "parse_score_list",
+                "parser": name,
+                "players": num_players,
+                "chars": len(text),
+                "seconds": seconds,
+                "chars_per_second": len(text) / seconds
+            }))
+
+    text = "<@U00000001> 7 - 5 <@U00000002>"
+    for name, parse in [("commands", commands.parse_duel), ("legacy_regex", legacy_duel)]:
+        print(json.dumps({"benchmark": "parse_duel", "parser": name, "seconds": time_parse(parse, text)}))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 1000, 10000])
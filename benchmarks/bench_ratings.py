@@ -0,0 +1,92 @@
+'''
+Times the vectorized rating updates against a plain pairwise loop.
+Prints one JSON object per (update, size).
+
+    python -m benchmarks.bench_ratings [sizes...]
+'''
+import sys
+import json
+import math
+import time
+
+import numpy as np
+
+from ratings import GLICKO2_SCALE, glicko2_update, plackett_luce_update
+
+
+def pairwise_plackett_luce(mu, sigma, scores, beta, kappa=1e-4):
+    # The update as written in the Weng-Lin paper, a double loop over players
+    num_players = len(mu)
+    c = math.sqrt(sum(s ** 2 + beta ** 2 for s in sigma))
+    strength = [math.exp((m - max(mu)) / c) for m in mu]
+    ranked_at_or_below = [sum(strength[s] for s in range(num_players) if scores[s] <= scores[q]) for q in range(num_players)]
+    tied = [sum(1 for s in range(num_players) if scores[s] == scores[q]) for q in range(num_players)]
+
+    new_mu, new_sigma = [], []
+    for i in range(num_players):
+        omega = delta = 0
+        for q in range(num_players):
+            if scores[q] >= scores[i]:
+                share = strength[i] / ranked_at_or_below[q]
+                delta += share * (1 - share) / tied[q]
+                omega += ((1 if q == i else 0) - share) / tied[q]
+        new_mu.append(mu[i] + sigma[i] ** 2 / c * omega)
+        new_sigma.append(sigma[i] * math.sqrt(max(1 - sigma[i] / c * sigma[i] ** 2 / c ** 2 * delta, kappa)))
+    return new_mu, new_sigma
+
+
+def best_of(fn, repeat=5):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(sizes):
+    rng = np.random.default_rng(0)
+    for num_players in sizes:
+        mu = rng.normal(1500, 200, num_players)
+        sigma = rng.uniform(50, 350, num_players)
+        scores = rng.integers(450, 600, num_players).astype(float)
+
+        print(json.dumps({
+            "benchmark": "plackett_luce_score_list",
+            "implementation": "vectorized",
+            "players": num_players,
+            "seconds": best_of(lambda: plackett_luce_update(mu, sigma, scores, 175))
+        }))
+        if num_players <= 2000:
+            args = (mu.tolist(), sigma.tolist(), scores.tolist(), 175)
+            assert np.allclose(pairwise_plackett_luce(*args)[0], plackett_luce_update(mu, sigma, scores, 175)[0])
+            print(json.dumps({
+                "benchmark": "plackett_luce_score_list",
+                "implementation": "pairwise",
+                "players": num_players,
+                "seconds": best_of(lambda: pairwise_plackett_luce(*args), repeat=1)
+            }))
+
+        # One Glicko-2 rating period with 5 duels per player on average
+        num_duels = 5 * num_players // 2
+        a = rng.integers(0, num_players, num_duels)
+        b = (a + rng.integers(1, num_players, num_duels)) % max(num_players, 1)
+        results = rng.random(num_duels)
+        glicko_mu = (mu - 1500) / GLICKO2_SCALE
+        glicko_phi = sigma / GLICKO2_SCALE
+        volatility = np.full(num_players, 0.06)
+        print(json.dumps({
+            "benchmark": "glicko2_period",
+            "implementation": "vectorized",
+            "players": num_players,
+            "duels": num_duels,
+            "seconds": best_of(lambda: glicko2_update(
+                glicko_mu, glicko_phi, volatility,
+                np.concatenate([a, b]), np.concatenate([glicko_mu[b], glicko_mu[a]]), np.concatenate([glicko_phi[b], glicko_phi[a]]),
+                np.concatenate([results, 1 - results]), 0.5, 350 / GLICKO2_SCALE
+            ))
+        }))
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 10000, 100000])
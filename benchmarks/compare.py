@@ -0,0 +1,58 @@
+'''
+Compares two runs of the JSON-line benchmarks, e.g. from two commits:
+
+    python -m benchmarks.bench_elo_system > before.jsonl
+    git checkout my-branch
+    python -m benchmarks.bench_elo_system > after.jsonl
+    python -m benchmarks.compare before.jsonl after.jsonl [threshold]
+
+Results are matched on every field except the timings and the run info.
+Prints one JSON object per matched result with after/before, and exits with 1
+if any timing got slower by more than threshold (1.2 = 20%) times.
+'''
+import sys
+import json
+
+# The first of these in a result is the one compared, lower is better
+TIMING_FIELDS = ["seconds_per_op", "p50_seconds", "median_seconds", "seconds"]
+IGNORED_FIELDS = TIMING_FIELDS + ["commit", "python", "p95_seconds", "p99_seconds", "mean_seconds", "requests_per_second"]
+
+
+def read_results(filepath):
+    results = {}
+    with open(filepath) as f:
+        for line in f:
+            if line.strip():
+                result = json.loads(line)
+                key = json.dumps({k: v for k, v in result.items() if k not in IGNORED_FIELDS}, sort_keys=True)
+                results[key] = result
+    return results
+
+
+def timing(result):
+    for field in TIMING_FIELDS:
+        if field in result:
+            return field, result[field]
+    return None, None
+
+
+def main(before_filepath, after_filepath, threshold=1.2):
+    threshold = float(threshold)
+    before, after = read_results(before_filepath), read_results(after_filepath)
+    regressions = 0
+    for key, after_result in after.items():
+        if key not in before:
+            continue
+        field, after_seconds = timing(after_result)
+        _, before_seconds = timing(before[key])
+        if not field or not before_seconds:
+            continue
+        ratio = after_seconds / before_seconds
+        regressed = ratio > threshold
+        regressions += regressed
+        print(json.dumps(dict(json.loads(key), field=field, before=before_seconds, after=after_seconds, ratio=ratio, regressed=regressed)))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    exit(main(*sys.argv[1:]))
@@ -0,0 +1,182 @@
+'''
+Checks commands against the regexes elo_bot used before it, on generated
+commands and on random mutations of them. Prints a JSON summary and exits
+non-zero on a mismatch.
+
+The parser is stricter than the old regexes, which skipped over text they
+didn't understand, so a mutated command may be rejected by one and accepted
+by the other. Whenever both accept a command they have to agree on it.
+
+    python -m benchmarks.fuzz_parser [iterations] [seed]
+'''
+import re
+import sys
+import json
+import random
+
+import commands
+from commands import ParseError
+
+SLACK_ID_REGEX = r"<(@[A-Z0-9]*)(?:\|[a-z0-9._-]*)?>"
+SLACK_ID_MATCH_USERNAME_REGEX = r"<(@[A-Z0-9]*)\|?([a-z0-9._-]*)?>"
+MUTATION_CHARS = " -<>@|0123456789AUZairsportstandardpistolx\t\n"
+
+
+def legacy_score_list(text):
+    match = re.search(r"((?i:air|sport|standard))(?i:\s*pistol)?\s*", text)
+    if not match:
+        return None
+    scores = re.findall(rf"{SLACK_ID_REGEX}\s*(\d+)", text)
+    return commands.ScoreList(match.groups()[0].lower(), [(f"<{s[0]}>", int(s[1])) for s in scores])
+
+
+def legacy_duel(text):
+    match = re.match(rf"(?:<@[A-Z0-9]*>)?\s*{SLACK_ID_REGEX}\s*(\d+)\s*-\s*(\d+)\s*{SLACK_ID_REGEX}", text)
+    if not match:
+        return None
+    playerA, scoreA, scoreB, playerB = match.groups()
+    return commands.Duel(f"<{playerA}>", int(scoreA), int(scoreB), f"<{playerB}>")
+
+
+def legacy_mention(text):
+    if re.match(r"<@[A-Z0-9]*>\s*(?i:air|sport|standard)(?i:\s*pistol)?(\s*(<@[A-Z0-9]*>)\s*(\d{3}))+", text):
+        return legacy_score_list(text)
+    if re.match(r"<@[A-Z0-9]*>\s*<@[A-Z0-9]*>\s*\d+\s*-\s*\d+\s*<@[A-Z0-9]*>", text):
+        return legacy_duel(text)
+    return None
+
+
+def legacy_tournament(text):
+    name_match = re.match(r"\s*([\w-]+)", text)
+    players = re.findall(SLACK_ID_MATCH_USERNAME_REGEX, text)
+    if not players:
+        return None
+    return commands.TournamentStart(name_match.groups()[0] if name_match else "default", [(f"<{p[0]}>", p[1]) for p in players])
+
+
+def random_space(rng):
+    return rng.choice(["", " ", " ", "  ", "\t"])
+
+
+def random_mention(rng, with_username=False):
+    user_id = "U" + "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789") for _ in range(rng.randint(1, 10)))
+    if with_username and rng.random() < 0.5:
+        return f"<@{user_id}|{rng.choice(['ann', 'bob.smith', 'c_d', 'e-f'])}>"
+    return f"<@{user_id}>"
+
+
+def random_event(rng):
+    event = rng.choice(["air", "sport", "standard"])
+    event = rng.choice([event, event.upper(), event.capitalize()])
+    if rng.random() < 0.5:
+        event += random_space(rng) + rng.choice(["pistol", "Pistol"])
+    return event
+
+
+def generate_score_list(rng, bot=True):
+    # Mention events carry bare "<@U123>" ids, slash commands may include usernames
+    parts = [random_mention(rng)] if bot else []
+    parts.append(random_event(rng))
+    for _ in range(rng.randint(1, 12)):
+        parts.append(random_mention(rng, with_username=not bot))
+        parts.append(str(rng.randint(100, 654)))
+    return " ".join(parts)
+
+
+def generate_duel(rng, bot=True):
+    playerA = random_mention(rng, with_username=not bot)
+    playerB = playerA
+    # Self-duels are rejected by the parser but not the old regexes
+    while playerB.split("|")[0].rstrip(">") == playerA.split("|")[0].rstrip(">"):
+        playerB = random_mention(rng, with_username=not bot)
+    return "".join([
+        random_mention(rng) + " " if bot else "",
+        playerA, random_space(rng) or " ",
+        str(rng.randint(0, 20)), random_space(rng), "-", random_space(rng), str(rng.randint(0, 20)),
+        random_space(rng) or " ", playerB
+    ])
+
+
+def generate_tournament(rng):
+    parts = [rng.choice(["spring-open", "league_2", "Finals"])] if rng.random() < 0.5 else []
+    # Repeated players are rejected by the parser but not the old regexes
+    mentions = {}
+    for _ in range(rng.randint(1, 16)):
+        mention = random_mention(rng, with_username=True)
+        mentions.setdefault(mention.split("|")[0].rstrip(">"), mention)
+    return " ".join(parts + list(mentions.values()))
+
+
+def mutate(rng, text):
+    chars = list(text)
+    for _ in range(rng.randint(1, 3)):
+        pos = rng.randint(0, len(chars))
+        action = rng.random()
+        if action < 0.4:
+            chars.insert(pos, rng.choice(MUTATION_CHARS))
+        elif action < 0.7 and pos < len(chars):
+            del chars[pos]
+        elif pos < len(chars):
+            chars[pos] = rng.choice(MUTATION_CHARS)
+    return "".join(chars)
+
+
+def parse_or_none(parse, text):
+    try:
+        return parse(text)
+    except ParseError as e:
+        assert 0 <= e.pos <= len(text), (text, e.pos)
+        return None
+
+
+CASES = [
+    # (name, generator, parser, legacy parser)
+    ("score_list", lambda rng: generate_score_list(rng, bot=False), commands.parse_score_list, legacy_score_list),
+    ("duel", lambda rng: generate_duel(rng, bot=False), commands.parse_duel, legacy_duel),
+    ("mention", lambda rng: rng.choice([generate_score_list, generate_duel])(rng), commands.parse_mention, legacy_mention),
+    ("tournament", generate_tournament, commands.parse_tournament, legacy_tournament)
+]
+
+
+def run(iterations=2000, seed=0):
+    '''
+    Returns (summary, failures), the per-case counts and the commands the
+    parser and the old regexes disagreed on
+    '''
+    rng = random.Random(seed)
+    failures = []
+    summary = {}
+    for name, generate, parse, legacy_parse in CASES:
+        counts = {"valid": 0, "mutated": 0, "both_accept": 0, "only_parser_accepts": 0, "only_legacy_accepts": 0}
+        for _ in range(iterations):
+            text = generate(rng)
+            counts["valid"] += 1
+            expected = legacy_parse(text)
+            result = parse_or_none(parse, text)
+            if result is None or result != expected:
+                failures.append({"case": name, "text": text, "parser": result, "legacy": expected})
+
+            text = mutate(rng, text)
+            counts["mutated"] += 1
+            expected = legacy_parse(text)
+            result = parse_or_none(parse, text)
+            if result is not None and expected is not None:
+                counts["both_accept"] += 1
+                if result != expected:
+                    failures.append({"case": name, "text": text, "parser": result, "legacy": expected})
+            elif result is not None:
+                counts["only_parser_accepts"] += 1
+            elif expected is not None:
+                counts["only_legacy_accepts"] += 1
+        summary[name] = counts
+    return summary, failures
+
+
+def main(iterations=2000, seed=0):
+    summary, failures = run(iterations, seed)
+    print(json.dumps({"iterations": iterations, "seed": seed, "cases": summary, "failures": failures[:20]}, indent=2))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(*map(int, sys.argv[1:])))
@@ -0,0 +1,106 @@
+'''
+End-to-end load driver: preloads a generated league (see workload.py), then
+fires a mix of slash commands at the Flask routes from several threads
+through the test client, with Slack calls going to a FakeSlackServer.
+Prints one JSON object per route with latency percentiles, and one with
+the overall throughput.
+
+    python -m benchmarks.load_routes [preset] [num_requests] [num_threads] > results.jsonl
+'''
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+for name in ["SLACK_SIGNING_SECRET", "SLACK_BOT_TOKEN", "VERIFICATION_TOKEN"]:
+    os.environ.setdefault(name, "load")
+os.environ.setdefault("ELO_BOT_CHANNEL_ID", "CLOAD")
+
+import numpy as np
+
+import elo_bot
+from benchmarks.workload import PRESETS, build_league, player_id, run_info
+from elo_system import ELO_System
+from fake_slack import FakeSlackServer
+from graphics import BracketRenderer
+from shards import ShardManager
+from slack_client import SlackClient
+from storage import open_storage
+
+# (route, weight), reads dominate like in the real workload
+ROUTE_MIX = [("/leaderboard", 30), ("/stats", 30), ("/h2h", 8), ("/record", 15), ("/duel", 15), ("/tournament", 2)]
+
+
+def make_requests(num_requests, num_players, seed=0):
+    rng = random.Random(seed)
+    routes, weights = zip(*ROUTE_MIX)
+    # Most lookups are for the most active players
+    player = lambda: player_id(min(int(rng.expovariate(1 / 50)), num_players - 1))
+    requests = []
+    for route in rng.choices(routes, weights, k=num_requests):
+        if route == "/leaderboard":
+            text = rng.choice(["", "air", "sport 1-20", "standard", "20-40", "air --since 2024-12-01", "sport 1-20 --season 2024"])
+        elif route == "/stats":
+            text = player() + rng.choice(["", "", " history", " history 2"])
+        elif route == "/h2h":
+            text = f"{player()} {player()}" if rng.random() < 0.5 else player()
+        elif route == "/record":
+            text = rng.choice(ELO_System.EVENTS) + " " + " ".join(f"{player()} {rng.randint(500, 600)}" for _ in range(rng.randint(2, 8)))
+        elif route == "/duel":
+            a, b = rng.sample(range(num_players), 2)
+            text = f"{player_id(a)} {rng.randint(0, 10)} - {rng.randint(0, 10)} {player_id(b)}"
+        else:
+            text = f"load-{len(requests)} " + " ".join(player_id(p) for p in rng.sample(range(num_players), rng.choice([8, 16, 32])))
+        requests.append((route, text))
+    return requests
+
+
+def main(preset="small", num_requests=5000, num_threads=8):
+    num_requests, num_threads = int(num_requests), int(num_threads)
+    info = dict(run_info(), league=preset, threads=num_threads)
+
+    with tempfile.TemporaryDirectory() as tmp_dir, FakeSlackServer() as server:
+        state_path = os.path.join(tmp_dir, "state.json")
+        elo_system = ELO_System.from_storage(open_storage("journal", state_path))
+        build_league(elo_system, preset)
+        elo_system.checkpoint()
+        elo_system.close()
+
+        elo_bot.ELO_STATE_PATH = state_path
+        elo_bot.slack_client = SlackClient("xoxb-load", base_url=server.url)
+        elo_bot.bracket_renderer = BracketRenderer(os.path.join(tmp_dir, "brackets"), renderer="pillow")
+        elo_bot.shards = ShardManager(elo_bot.open_shard)
+        elo_bot.shards.get("default", elo_bot.ELO_BOT_CHANNEL_ID)
+        client = elo_bot.app.test_client()
+
+        latencies = defaultdict(list)
+
+        def post(request):
+            route, text = request
+            start = time.perf_counter()
+            response = client.post(route, data={"token": elo_bot.VERIFICATION_TOKEN, "channel_id": elo_bot.ELO_BOT_CHANNEL_ID, "text": text})
+            latencies[route].append(time.perf_counter() - start)
+            assert response.status_code == 200, response.data
+
+        requests = make_requests(num_requests, PRESETS[preset][0])
+        start = time.perf_counter()
+        with ThreadPoolExecutor(num_threads) as pool:
+            list(pool.map(post, requests))
+        elapsed = time.perf_counter() - start
+
+        elo_bot.bracket_renderer.close()
+        elo_bot.slack_client.close()
+        elo_bot.shards.close()
+
+    for route, timings in sorted(latencies.items()):
+        p50, p95, p99 = np.percentile(timings, [50, 95, 99]).tolist()
+        print(json.dumps(dict(info, benchmark="route_latency", route=route, requests=len(timings), p50_seconds=p50, p95_seconds=p95, p99_seconds=p99)))
+    print(json.dumps(dict(info, benchmark="route_throughput", requests=num_requests, seconds=elapsed, requests_per_second=num_requests / elapsed)))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
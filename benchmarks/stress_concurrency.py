@@ -0,0 +1,114 @@
+'''
+Fires concurrent /duel and /record requests at the Flask app and checks that
+nothing was lost or applied twice: the duel log, W-L totals, score counts and
+the (zero-sum) elo total must add up, and reloading the journal must give the
+same state as the one in memory.
+
+With --async the commands go through the job queue (ELO_ASYNC) and every
+one of them must post its response to its response_url.
+
+    python -m benchmarks.stress_concurrency [num_requests] [num_threads] [--async]
+'''
+import os
+import sys
+import json
+import math
+import random
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+for name in ["SLACK_SIGNING_SECRET", "SLACK_BOT_TOKEN", "VERIFICATION_TOKEN"]:
+    os.environ.setdefault(name, "stress")
+os.environ.setdefault("ELO_BOT_CHANNEL_ID", "CSTRESS")
+
+import elo_bot
+from elo_system import ELO_System
+from fake_slack import FakeSlackServer
+from jobs import JobQueue, RateLimiter
+from shards import ShardManager
+from slack_client import SlackClient
+from storage import open_storage
+
+
+def run(num_requests=4000, num_threads=32, num_players=200, seed=0, use_jobs=False):
+    '''
+    Returns the list of failed checks, empty if everything adds up
+    '''
+    rng = random.Random(seed)
+    requests = []
+    expected_scores = Counter()
+    decisive_duels = 0
+    for _ in range(num_requests):
+        if rng.random() < 0.5:
+            a, b = rng.sample(range(num_players), 2)
+            score_a, score_b = rng.randint(0, 10), rng.randint(0, 10)
+            decisive_duels += score_a != score_b
+            requests.append(("/duel", f"<@U{a}|u{a}> {score_a} - {score_b} <@U{b}|u{b}>"))
+        else:
+            shooters = rng.sample(range(num_players), 5)
+            expected_scores.update(f"<@U{p}>" for p in shooters)
+            requests.append(("/record", "air " + " ".join(f"<@U{p}|u{p}> {rng.randint(500, 600)}" for p in shooters)))
+
+    with tempfile.TemporaryDirectory() as tmp_dir, FakeSlackServer() as server:
+        state_path = os.path.join(tmp_dir, "state.json")
+        elo_bot.ELO_STATE_PATH = state_path
+        elo_bot.slack_client = SlackClient("xoxb-stress", base_url=server.url)
+        elo_bot.shards = ShardManager(elo_bot.open_shard)
+        if use_jobs:
+            elo_bot.jobs = JobQueue(8, num_requests)
+            elo_bot.rate_limiter = RateLimiter(rate=num_requests, burst=num_requests)
+        client = elo_bot.app.test_client()
+
+        def post(numbered_request):
+            i, (path, text) = numbered_request
+            data = {"token": elo_bot.VERIFICATION_TOKEN, "channel_id": elo_bot.ELO_BOT_CHANNEL_ID, "text": text}
+            if use_jobs:
+                data.update(user_id=f"U{i % num_players}", response_url=f"{server.url}/respond/{i}")
+            response = client.post(path, data=data)
+            assert response.status_code == 200, response.data
+
+        with ThreadPoolExecutor(num_threads) as pool:
+            list(pool.map(post, enumerate(requests)))
+        failures = []
+        if use_jobs:
+            elo_bot.jobs.close()
+            elo_bot.jobs = None
+            responses = [path for path, _ in server.calls if path.startswith("/api/respond/")]
+            if len(set(responses)) != num_requests:
+                failures.append(f"{len(set(responses))} responses posted to response_url")
+
+        elo_system = elo_bot.shards.get("default", elo_bot.ELO_BOT_CHANNEL_ID)
+        records = elo_system.records
+        if len(elo_system.duels) != num_requests - sum(expected_scores.values()) // 5:
+            failures.append(f"{len(elo_system.duels)} duels logged")
+        if sum(info["W"] for info in records.values()) != decisive_duels or sum(info["L"] for info in records.values()) != decisive_duels:
+            failures.append("W-L totals don't match the decisive duels")
+        if not math.isclose(sum(info["elo"] for info in records.values()), ELO_System.BASE_ELO * len(records)):
+            failures.append("elo isn't conserved")
+        for player, count in expected_scores.items():
+            if records[player]["totals"]["air"]["count"] != count:
+                failures.append(f"{player} has {records[player]['totals']['air']['count']} scores, expected {count}")
+
+        # Compare through JSON since tuples come back as lists
+        state = json.loads(json.dumps(elo_system.to_state()))
+        elo_bot.shards.close()
+        elo_bot.slack_client.close()
+        reloaded = ELO_System.from_storage(open_storage("journal", state_path))
+        if json.loads(json.dumps(reloaded.to_state())) != state:
+            failures.append("replaying the journal doesn't reproduce the in-memory state")
+        reloaded.close()
+    return failures
+
+
+def main(num_requests=4000, num_threads=32, num_players=200, seed=0, use_jobs=False):
+    failures = run(num_requests, num_threads, num_players, seed, use_jobs)
+    for failure in failures:
+        print("FAIL:", failure)
+    print(f"{num_requests} requests on {num_threads} threads: {'ok' if not failures else f'{len(failures)} failures'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if arg != "--async"]
+    exit(main(*map(int, args), use_jobs="--async" in sys.argv))
@@ -0,0 +1,102 @@
+'''
+Seeded generator of realistic leagues for the benchmarks.
+
+Players get a latent skill; score lists are sessions of a few regulars
+shooting one event, with scores around their skill, and duels are 10-round
+matches decided by the skill difference. A few players shoot most of the
+sessions, like in a real club. The same seed always gives the same league.
+
+Rows are in the bulk.py NDJSON shape, so a league can be written out and
+imported with manage.py:
+
+    python -m benchmarks.workload [preset] > league.ndjson
+    python manage.py import state.json league.ndjson
+'''
+import sys
+import json
+import random
+import platform
+import itertools
+import subprocess
+from datetime import date, timedelta
+
+import bulk
+from elo_system import ELO_System
+
+# (players, score lists, duels), score lists have 5 players on average
+PRESETS = {
+    "small": (500, 20000, 10000),
+    "medium": (2000, 100000, 50000),
+    "large": (5000, 400000, 200000)
+}
+TOURNAMENT_SIZES = [8, 32, 128, 512]
+
+
+def player_id(k):
+    return f"<@U{k:07d}>"
+
+
+def generate_rows(num_players, num_score_lists, num_duels, days=365, seed=0):
+    '''
+    Yields score list and duel rows over days days, oldest first
+    '''
+    rng = random.Random(seed)
+    skills = [rng.gauss(540, 20) for _ in range(num_players)]
+    # Zipf-like participation, player k shows up about 1/(k+1)^0.8 as often as player 0
+    cum_weights = list(itertools.accumulate(1 / (k + 1) ** 0.8 for k in range(num_players)))
+    first_day = date(2024, 1, 1)
+
+    total = num_score_lists + num_duels
+    remaining_lists = num_score_lists
+    for k in range(total):
+        day = (first_day + timedelta(days=k * days // total)).isoformat()
+        if rng.random() * (total - k) < remaining_lists:
+            remaining_lists -= 1
+            shooters = set(rng.choices(range(num_players), cum_weights=cum_weights, k=rng.randint(2, 8)))
+            event = rng.choice(ELO_System.EVENTS)
+            scores = [(player_id(p), min(600, round(rng.gauss(skills[p], 12)))) for p in shooters]
+            yield {"type": "scores", "date": day, "event": event, "scores": scores}
+        else:
+            a, b = rng.choices(range(num_players), cum_weights=cum_weights, k=2)
+            if a == b:
+                b = (a + 1) % num_players
+            # Each round goes to A with the Elo-style probability from the skill difference
+            p = 1 / (1 + 10 ** ((skills[b] - skills[a]) / 40))
+            score_a = sum(rng.random() < p for _ in range(10))
+            yield {"type": "duel", "date": day, "playerA": player_id(a), "scoreA": score_a, "playerB": player_id(b), "scoreB": 10 - score_a}
+
+
+def build_league(elo_system, preset="medium", tournament_sizes=TOURNAMENT_SIZES, seed=0):
+    '''
+    Imports a generated league into elo_system and starts one tournament per
+    size ("cup-<size>"), with half of each first round played
+    '''
+    num_players, num_score_lists, num_duels = PRESETS[preset]
+    rows = ((k, row) for k, row in enumerate(generate_rows(num_players, num_score_lists, num_duels, seed=seed)))
+    bulk.import_rows(elo_system, rows)
+
+    rng = random.Random(seed)
+    for size in tournament_sizes:
+        players = rng.sample(range(num_players), min(size, num_players))
+        name = f"cup-{size}"
+        elo_system.start_tournament([(player_id(p), f"player{p}") for p in players], name=name)
+        first_round = elo_system.tournaments[name].bracket[0]
+        matches = [(lower, upper) for lower, upper in zip(first_round[::2], first_round[1::2]) if lower and upper]
+        for lower, upper in matches[:len(matches) // 2]:
+            elo_system.challenge_match(lower["id"], rng.randint(0, 4), upper["id"], rng.randint(5, 10))
+    elo_system.save()
+    return elo_system
+
+
+def run_info():
+    # Attached to every result so runs from different commits can be told apart
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "python": platform.python_version()}
+
+
+if __name__ == "__main__":
+    for row in generate_rows(*PRESETS[sys.argv[1] if len(sys.argv) > 1 else "medium"]):
+        sys.stdout.write(json.dumps(row, separators=(',', ':')) + "\n")
@@ -0,0 +1,252 @@
+'''
+Streaming import and export of score and duel history as CSV or NDJSON.
+
+Both formats hold one row per line and are read and written a row at a time,
+so files of any size go through in constant memory. NDJSON rows look like
+
+    {"type": "scores", "date": "2024-03-02", "event": "air", "scores": [["<@U1>", 552], ["<@U2>", 538]]}
+    {"type": "duel", "date": "2024-03-02", "playerA": "<@U1>", "scoreA": 6, "playerB": "<@U2>", "scoreB": 4}
+
+CSV rows have the columns in CSV_FIELDS, one score or duel per row:
+
+    type,date,event,player,score,opponent,opponent_score,list
+    score,2024-03-02,air,<@U1>,552,,,1
+    score,2024-03-02,air,<@U2>,538,,,1
+    duel,2024-03-02,,<@U1>,6,<@U2>,4,
+
+Consecutive CSV score rows with the same list id are recorded as one score
+list, a score row without one (or a file without the list column) is a list
+of its own. Exports keep score lists and duels in the order they were
+recorded and number the lists from 1.
+Players can be given as bare Slack ids ("U1").
+'''
+import io
+import csv
+import json
+from datetime import date
+
+from elo_system import ELO_System
+from player import NO_LIST, SCORE_RANGE
+
+CSV_FIELDS = ["type", "date", "event", "player", "score", "opponent", "opponent_score", "list"]
+FORMATS = ["csv", "ndjson"]
+
+
+class BulkError(Exception):
+    def __init__(self, message, line):
+        super().__init__(f"{message} on line {line}")
+        self.message = message
+        self.line = line
+
+
+def guess_format(filename):
+    return "csv" if filename.lower().endswith(".csv") else "ndjson"
+
+
+def _player(value, line):
+    value = (value or "").strip()
+    if not value:
+        raise BulkError("missing player", line)
+    return value if value.startswith("<@") else f"<@{value}>"
+
+
+def _score(value, line):
+    try:
+        score = int(value)
+    except (TypeError, ValueError):
+        raise BulkError(f"invalid score {value!r}", line)
+    if score not in SCORE_RANGE:
+        raise BulkError(f"score {score} is out of range", line)
+    return score
+
+
+def _date(value, line):
+    try:
+        return date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise BulkError(f"invalid date {value!r}, expected YYYY-MM-DD", line)
+
+
+def _event(value, line):
+    event = (value or "").strip().lower()
+    if event not in ELO_System.EVENTS:
+        raise BulkError(f"invalid event {value!r}", line)
+    return event
+
+
+def _check_row(row, line):
+    # Validates an NDJSON-shaped row and normalizes its fields
+    if row.get("type") == "scores":
+        if not isinstance(row.get("scores"), list) or not row["scores"]:
+            raise BulkError("a score list needs scores", line)
+        scores = []
+        for entry in row["scores"]:
+            if not isinstance(entry, list) or len(entry) != 2:
+                raise BulkError("scores must be [player, score] pairs", line)
+            scores.append((_player(entry[0], line), _score(entry[1], line)))
+        return {"type": "scores", "date": _date(row.get("date"), line), "event": _event(row.get("event"), line), "scores": scores}
+    if row.get("type") == "duel":
+        duel = {
+            "type": "duel",
+            "date": _date(row.get("date"), line),
+            "playerA": _player(row.get("playerA"), line),
+            "scoreA": _score(row.get("scoreA"), line),
+            "playerB": _player(row.get("playerB"), line),
+            "scoreB": _score(row.get("scoreB"), line)
+        }
+        if duel["playerA"] == duel["playerB"]:
+            raise BulkError("a player can't duel themselves", line)
+        return duel
+    raise BulkError(f"unknown row type {row.get('type')!r}", line)
+
+
+def read_ndjson(lines):
+    '''
+    Yields (line number, row) for every row in lines of NDJSON
+    '''
+    for line, text in enumerate(lines, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise BulkError(f"invalid JSON ({e.msg})", line)
+        if not isinstance(row, dict):
+            raise BulkError("expected a JSON object", line)
+        yield line, _check_row(row, line)
+
+
+def read_csv(lines):
+    '''
+    Yields (line number, row) for every row in lines of CSV, rows in the
+    NDJSON shape. A score list is yielded once the next row doesn't continue it.
+    '''
+    reader = csv.DictReader(lines)
+    if reader.fieldnames is None or "type" not in reader.fieldnames:
+        raise BulkError(f"expected a header with the columns {','.join(CSV_FIELDS)}", 1)
+
+    score_list = None
+    for record in reader:
+        line = reader.line_num
+        kind = (record.get("type") or "").strip()
+        if kind == "score":
+            day, event = _date(record.get("date"), line), _event(record.get("event"), line)
+            player, score = _player(record.get("player"), line), _score(record.get("score"), line)
+            list_id = (record.get("list") or "").strip()
+            if score_list and list_id and list_id == score_list[2]:
+                if (score_list[1]["date"], score_list[1]["event"]) != (day, event):
+                    raise BulkError(f"score list {list_id} has rows from different dates or events", line)
+                score_list[1]["scores"].append((player, score))
+                continue
+            if score_list:
+                yield score_list[0], score_list[1]
+            score_list = (line, {"type": "scores", "date": day, "event": event, "scores": [(player, score)]}, list_id)
+            continue
+
+        if score_list:
+            yield score_list[0], score_list[1]
+            score_list = None
+        if kind == "duel":
+            yield line, _check_row({
+                "type": "duel",
+                "date": record.get("date"),
+                "playerA": record.get("player"),
+                "scoreA": record.get("score"),
+                "playerB": record.get("opponent"),
+                "scoreB": record.get("opponent_score")
+            }, line)
+        else:
+            raise BulkError(f"unknown row type {kind!r}, expected score or duel", line)
+    if score_list:
+        yield score_list[0], score_list[1]
+
+
+def read_rows(lines, format):
+    if format == "csv":
+        return read_csv(lines)
+    if format == "ndjson":
+        return read_ndjson(lines)
+    raise ValueError(f"Unknown format {format!r}, expected one of {', '.join(FORMATS)}")
+
+
+def import_rows(elo_system, rows):
+    '''
+    Records every (line number, row) from read_rows in order inside one
+    elo_system.bulk(), so the state is only written once at the end.
+    Returns {"scores": score lists recorded, "duels": duels recorded}.
+    A bad row raises BulkError, the rows before it stay imported.
+    '''
+    counts = {"scores": 0, "duels": 0}
+    with elo_system.bulk():
+        for line, row in rows:
+            if row["type"] == "scores":
+                elo_system.record_scores(row["event"], row["scores"], row["date"])
+                counts["scores"] += 1
+            else:
+                elo_system.challenge_match(row["playerA"], row["scoreA"], row["playerB"], row["scoreB"], row["date"])
+                counts["duels"] += 1
+    return counts
+
+
+def _duel_row(duel):
+    day, playerA, scoreA, playerB, scoreB = duel
+    return {"type": "duel", "date": day, "playerA": playerA, "scoreA": scoreA, "playerB": playerB, "scoreB": scoreB}
+
+
+def _export_rows(elo_system):
+    # Score lists and duels in the order they were recorded, replaying them in another order could change
+    # the ratings. A list's id counts the lists and duels before it, so the duels that come ahead of the
+    # k-th list are the first list_id - k. Rows are read as they're written rather than copied first,
+    # commands that arrive meanwhile may or may not be included.
+    duels = iter(elo_system.iter_duels())
+    num_lists = num_duels = 0
+    for day, event, scores, list_id in elo_system.iter_score_lists():
+        if list_id != NO_LIST:
+            while num_duels < list_id - num_lists:
+                duel = next(duels, None)
+                if duel is None:
+                    break
+                num_duels += 1
+                yield _duel_row(duel)
+            num_lists += 1
+        yield {"type": "scores", "date": day, "event": event, "scores": scores}
+    for duel in duels:
+        yield _duel_row(duel)
+
+
+def export_ndjson(elo_system):
+    '''
+    Yields the score and duel history as NDJSON lines
+    '''
+    for row in _export_rows(elo_system):
+        yield json.dumps(row, separators=(',', ':')) + "\n"
+
+
+def export_csv(elo_system, batch_size=1000):
+    '''
+    Yields the score and duel history as chunks of CSV text
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(CSV_FIELDS)
+    list_id = 0
+    for k, row in enumerate(_export_rows(elo_system), start=1):
+        if row["type"] == "scores":
+            list_id += 1
+            for player, score in row["scores"]:
+                writer.writerow(["score", row["date"], row["event"], player, score, "", "", list_id])
+        else:
+            writer.writerow(["duel", row["date"], "", row["playerA"], row["scoreA"], row["playerB"], row["scoreB"], ""])
+        if k % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export(elo_system, format):
+    if format == "csv":
+        return export_csv(elo_system)
+    if format == "ndjson":
+        return export_ndjson(elo_system)
+    raise ValueError(f"Unknown format {format!r}, expected one of {', '.join(FORMATS)}")
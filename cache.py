@@ -0,0 +1,49 @@
+import threading
+from collections import OrderedDict
+
+import metrics
+
+
+class ResponseCache:
+    '''
+    LRU cache of rendered command responses.
+
+    Every entry is stored with the versions of the state it was built from,
+    see ELO_System.cache_versions. Mutations bump the versions of the players,
+    events and leaderboards they touch, so an entry is only rebuilt once
+    something it shows has changed.
+    '''
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (versions, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_build(self, key, versions, build):
+        '''
+        Returns the value cached for key if it was built at versions, otherwise
+        calls build() and caches its result. versions must be read before any
+        of the state build() uses.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == versions:
+                self._entries.move_to_end(key)
+                metrics.CACHE_REQUESTS.inc(route=metrics.current_route(), result="hit")
+                return entry[1]
+        metrics.CACHE_REQUESTS.inc(route=metrics.current_route(), result="miss")
+
+        value = build()
+        with self._lock:
+            self._entries[key] = (versions, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
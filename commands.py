@@ -0,0 +1,287 @@
+'''
+Parses slash command and mention text into typed commands.
+
+Text is split into tokens by one regex compiled at import, in a single
+left-to-right pass, so parsing is linear in the length of the text. Each
+command is then read off the token list. Errors raise ParseError with the
+position in the text where the parser got stuck.
+
+Player ids are kept in the "<@U123>" form the rest of the bot uses.
+'''
+import re
+from collections import namedtuple
+from datetime import date, timedelta
+
+from player import SCORE_RANGE
+
+Token = namedtuple("Token", ["kind", "value", "pos"])
+
+ScoreList = namedtuple("ScoreList", ["event", "scores"])                    # scores: list of (player, score)
+Duel = namedtuple("Duel", ["playerA", "scoreA", "scoreB", "playerB"])
+Stats = namedtuple("Stats", ["player", "args"])                             # args: trailing words, e.g. ["graph"]
+TournamentStart = namedtuple("TournamentStart", ["name", "players", "format", "rounds"], defaults=["single", None])  # players: list of (player, username)
+Leaderboard = namedtuple("Leaderboard", ["event", "start", "end", "args", "since", "until"], defaults=[None, None])  # start/end: 0-based rank slice, since/until: ISO dates
+HeadToHeadQuery = namedtuple("HeadToHeadQuery", ["playerA", "playerB"])        # playerB: None for playerA's rivals
+
+
+# Tournament format options, see tournament.FORMATS
+TOURNAMENT_FORMAT_OPTIONS = {"--single": "single", "--seeded": "seeded", "--double": "double", "--swiss": "swiss"}
+
+
+class ParseError(Exception):
+    def __init__(self, message, pos):
+        super().__init__(f"{message} at position {pos}")
+        self.message = message
+        self.pos = pos
+
+
+TOKEN_REGEX = re.compile(r'''
+    (?P<WS>\s+)
+  | (?P<MENTION><@(?P<user_id>[A-Z0-9]*)(?:\|(?P<username>[a-z0-9._-]*))?>)
+  | (?P<EVENT>(?P<event_name>(?i:air|sport|standard))(?:\s*(?i:pistol))?)(?![\w-])
+  | (?P<DATE>\d{4}-\d{2}-\d{2})(?![\w-])
+  | (?P<NUMBER>\d+)(?!\w)
+  | (?P<OPTION>--[\w-]+)
+  | (?P<DASH>-)
+  | (?P<WORD>[\w][\w.:/-]*)
+  | (?P<OTHER>.)
+''', re.VERBOSE | re.DOTALL)
+
+
+def tokenize(text):
+    tokens = []
+    append = tokens.append
+    # Every character matches some alternative, so finditer covers the text without gaps
+    for match in TOKEN_REGEX.finditer(text):
+        kind = match.lastgroup
+        if kind == "WS":
+            continue
+        if kind == "MENTION":
+            value = (f"<@{match.group('user_id')}>", match.group("username") or "")
+        elif kind == "NUMBER":
+            value = int(match.group(kind))
+        elif kind == "EVENT":
+            value = match.group("event_name").lower()
+        else:
+            value = match.group(kind)
+        append(Token(kind, value, match.start()))
+    return tokens
+
+
+class _Reader:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = tokenize(text)
+        self.idx = 0
+
+    def peek(self, offset=0):
+        idx = self.idx + offset
+        return self.tokens[idx] if idx < len(self.tokens) else None
+
+    def peek_kind(self, offset=0):
+        token = self.peek(offset)
+        return token.kind if token else None
+
+    def take(self, kind, description):
+        token = self.peek()
+        if not token or token.kind != kind:
+            raise ParseError(f"expected {description}", token.pos if token else len(self.text))
+        self.idx += 1
+        return token.value
+
+    def take_if(self, kind):
+        if self.peek_kind() == kind:
+            self.idx += 1
+            return self.tokens[self.idx - 1].value
+        return None
+
+    def skip_leading_mention(self):
+        # Mentions of the bot itself start app_mention text, "<@BOT> air ..." or "<@BOT> <@A> 5 - 3 <@B>"
+        if self.peek_kind() == "MENTION" and self.peek_kind(1) in ["EVENT", "MENTION"]:
+            self.idx += 1
+
+    def rest(self):
+        tokens = self.tokens[self.idx:]
+        self.idx = len(self.tokens)
+        return tokens
+
+
+def _take_score(reader):
+    token = reader.peek()
+    score = reader.take("NUMBER", "a score")
+    if score not in SCORE_RANGE:
+        raise ParseError(f"score {score} is out of range", token.pos)
+    return score
+
+
+def _read_score_list(reader):
+    event = reader.take("EVENT", "an event (air, sport or standard)")
+    scores = []
+    while reader.peek():
+        player, _ = reader.take("MENTION", "a @mention")
+        scores.append((player, _take_score(reader)))
+    return ScoreList(event, scores)
+
+
+def _read_duel(reader):
+    playerA, _ = reader.take("MENTION", "a @mention")
+    scoreA = _take_score(reader)
+    reader.take("DASH", "'-'")
+    scoreB = _take_score(reader)
+    token = reader.peek()
+    playerB, _ = reader.take("MENTION", "a @mention")
+    if playerB == playerA:
+        raise ParseError("a player can't duel themselves", token.pos)
+    return Duel(playerA, scoreA, scoreB, playerB)
+
+
+def parse_score_list(text):
+    '''
+    "[@bot] air [pistol] @A 550 @B 530 ..."
+    '''
+    reader = _Reader(text)
+    reader.skip_leading_mention()
+    return _read_score_list(reader)
+
+
+def parse_duel(text):
+    '''
+    "[@bot] @A 5 - 3 @B"
+    '''
+    reader = _Reader(text)
+    reader.skip_leading_mention()
+    return _read_duel(reader)
+
+
+def parse_stats(text):
+    '''
+    "@A [words...]"
+    '''
+    reader = _Reader(text)
+    player, _ = reader.take("MENTION", "a @mention")
+    return Stats(player, [str(token.value) for token in reader.rest()])
+
+
+def parse_tournament(text):
+    '''
+    "[name] [--seeded | --double | --swiss [--rounds N]] @A @B ..."
+    '''
+    reader = _Reader(text)
+    name = reader.take_if("WORD") or "default"
+    format, rounds, rounds_pos = "single", None, None
+    while reader.peek_kind() == "OPTION":
+        token = reader.peek()
+        option = reader.take("OPTION", "an option")
+        if option in TOURNAMENT_FORMAT_OPTIONS:
+            format = TOURNAMENT_FORMAT_OPTIONS[option]
+        elif option == "--rounds":
+            rounds, rounds_pos = reader.take("NUMBER", "a number of rounds"), token.pos
+            if rounds < 1:
+                raise ParseError("expected at least 1 round", rounds_pos)
+        else:
+            raise ParseError(f"unknown option {option}", token.pos)
+    if rounds and format != "swiss":
+        raise ParseError("--rounds only applies to --swiss", rounds_pos)
+
+    start = reader.peek().pos if reader.peek() else len(text)
+    players = [reader.take("MENTION", "a @mention")]
+    while reader.peek():
+        token = reader.peek()
+        player = reader.take("MENTION", "a @mention")
+        if any(player[0] == other for other, _ in players):
+            raise ParseError(f"<@{player[0]}> is listed twice", token.pos)
+        players.append(player)
+    if format != "single" and len(players) < 2:
+        raise ParseError(f"a {format} tournament needs at least 2 players", start)
+    return TournamentStart(name, players, format, rounds)
+
+
+def _read_date(reader):
+    pos = reader.peek().pos if reader.peek() else len(reader.text)
+    value = reader.take("DATE", "a date (YYYY-MM-DD)")
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        raise ParseError(f"invalid date {value}", pos)
+    return value
+
+
+def parse_leaderboard(text, today=None):
+    '''
+    "[event] [first-last] [--since DATE] [--until DATE] [--last DAYS] [--season [YEAR]] [--options...]",
+    ranks are 1-based and inclusive. The window options need an event, --last
+    counts back from today (a date, defaults to the current one) and --season
+    is a calendar year, the current one if not given.
+    '''
+    reader = _Reader(text)
+    event = reader.take_if("EVENT")
+    start, end = 0, None
+    if reader.peek_kind() == "NUMBER":
+        first = reader.take("NUMBER", "a rank")
+        reader.take("DASH", "'-'")
+        last = reader.take("NUMBER", "a rank")
+        start, end = max(first - 1, 0), last
+
+    today = today or date.today()
+    since, until, args = None, None, []
+    while reader.peek():
+        token = reader.peek()
+        if token.kind == "OPTION" and token.value in ["--since", "--until", "--last", "--season"]:
+            if not event:
+                raise ParseError(f"{token.value} needs an event", token.pos)
+            reader.take("OPTION", "an option")
+            if token.value == "--since":
+                since = _read_date(reader)
+            elif token.value == "--until":
+                until = _read_date(reader)
+            elif token.value == "--last":
+                pos = reader.peek().pos if reader.peek() else len(reader.text)
+                days = reader.take("NUMBER", "a number of days")
+                # The window can't start before 0001-01-01
+                if not 1 <= days <= today.toordinal():
+                    raise ParseError(f"expected 1 to {today.toordinal()} days", pos)
+                since, until = (today - timedelta(days=days - 1)).isoformat(), today.isoformat()
+            else:
+                pos = reader.peek().pos if reader.peek() else len(reader.text)
+                year = reader.take_if("NUMBER")
+                if year is None:
+                    year = today.year
+                elif not 1 <= year <= 9999:
+                    raise ParseError(f"invalid year {year}", pos)
+                since, until = f"{year:04d}-01-01", f"{year:04d}-12-31"
+        else:
+            reader.idx += 1
+            args.append(str(token.value))
+    return Leaderboard(event, start, end, args, since, until)
+
+
+def parse_head_to_head(text):
+    '''
+    "@A [@B]"
+    '''
+    reader = _Reader(text)
+    playerA, _ = reader.take("MENTION", "a @mention")
+    playerB = None
+    if reader.peek():
+        playerB, _ = reader.take("MENTION", "a @mention")
+    if reader.peek():
+        raise ParseError("unexpected text", reader.peek().pos)
+    return HeadToHeadQuery(playerA, playerB)
+
+
+def parse_mention(text):
+    '''
+    Parses app_mention text, "@bot air @A 550 ..." or "@bot @A 5 - 3 @B",
+    deciding between the two from the token after the bot mention
+    '''
+    reader = _Reader(text)
+    reader.take("MENTION", "a mention of the bot")
+    if reader.peek_kind() == "EVENT":
+        command = _read_score_list(reader)
+        if not command.scores:
+            raise ParseError("expected a @mention", len(text))
+        return command
+    if reader.peek_kind() == "MENTION":
+        return _read_duel(reader)
+    token = reader.peek()
+    raise ParseError("expected an event or a @mention", token.pos if token else len(text))
@@ -0,0 +1,89 @@
+import time
+import threading
+from collections import OrderedDict
+
+from journal import Journal
+from utils import read_json_file, write_json_file_atomic
+
+
+class DedupCache:
+    '''
+    Remembers the ids of deliveries already handled (Slack event ids, slash
+    command trigger ids) for ttl seconds, so retried deliveries are dropped.
+
+    Holds at most max_entries ids, the oldest are forgotten first. With a
+    filepath, ids are journaled like state mutations (see journal.py) and
+    come back after a restart.
+    '''
+
+    def __init__(self, filepath=None, ttl=3600, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.filepath = filepath
+        self._expiry = OrderedDict() # id -> expiry time, oldest first
+        self._lock = threading.Lock()
+        self.journal = None
+        if filepath:
+            state = read_json_file(filepath)
+            for key, expires in state.get("seen", []):
+                self._expiry[key] = expires
+            self.journal = Journal(filepath, snapshot_seq=state.get("journal_seq", 0))
+            for entry in self.journal.replay_entries():
+                self._expiry.pop(entry["key"], None)
+                if entry["expires"]:
+                    self._expiry[entry["key"]] = entry["expires"]
+            self._expire(time.time())
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def _expire(self, now):
+        # Every id lives for the same ttl, so the oldest ones expire first
+        while self._expiry:
+            key, expires = next(iter(self._expiry.items()))
+            if expires > now and len(self._expiry) <= self.max_entries:
+                break
+            del self._expiry[key]
+
+    def _log(self, key, expires):
+        if not self.journal:
+            return
+        self.journal.append({"key": key, "expires": expires})
+        self.journal.commit()
+        if self.journal.needs_compaction():
+            self.journal.compact(self._write_snapshot)
+
+    def _write_snapshot(self, journal_seq):
+        write_json_file_atomic({"seen": list(self._expiry.items()), "journal_seq": journal_seq}, self.filepath)
+
+    def claim(self, key):
+        '''
+        Returns True the first time key is seen within ttl, False for repeats.
+        A falsy key (no id on the delivery) is always claimed.
+        '''
+        if not key:
+            return True
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if key in self._expiry:
+                return False
+            self._expiry[key] = now + self.ttl
+            self._log(key, now + self.ttl)
+            if len(self._expiry) > self.max_entries:
+                self._expiry.popitem(last=False)
+        return True
+
+    def release(self, key):
+        # Forgets a claimed key whose handling failed, so a retry runs it again
+        if not key:
+            return
+        with self._lock:
+            if self._expiry.pop(key, None) is not None:
+                self._log(key, 0)
+
+    def close(self):
+        if self.journal:
+            with self._lock:
+                self.journal.compact(self._write_snapshot)
+                self.journal.close()
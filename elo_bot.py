@@ -1,26 +1,128 @@
+import io
 import os
-import requests
-import re
+import hmac
 import json
-from flask import Flask, request, jsonify
+import math
+import time
+import threading
+from contextlib import ExitStack, contextmanager
+from datetime import date, timedelta
+from flask import Flask, Response, g, request, jsonify
 from slackeventsapi import SlackEventAdapter
 
+import bulk
+import commands
+import metrics
+from commands import ParseError
 from elo_system import ELO_System
-from graphics import matrix_to_ascii_table, generate_bracket_image
+from cache import ResponseCache
+from dedup import DedupCache
+from ratings import make_engine
+from jobs import JobQueue, QueueFull, RateLimiter
+from storage import open_storage
+from shards import ShardManager
+from slack_client import SlackClient
+from graphics import matrix_to_ascii_table, render_sparkline, sparkline_text, BracketRenderer
 
 app = Flask(__name__)
 
 SLACK_SIGNING_SECRET = os.environ["SLACK_SIGNING_SECRET"]
 SLACK_BOT_TOKEN = os.environ["SLACK_BOT_TOKEN"]
 VERIFICATION_TOKEN = os.environ["VERIFICATION_TOKEN"]
-ELO_BOT_CHANNEL_ID = os.environ["ELO_BOT_CHANNEL_ID"]
+# Channel the bot was originally set up for, it keeps using ELO_STATE_PATH
+ELO_BOT_CHANNEL_ID = os.environ.get("ELO_BOT_CHANNEL_ID")
+# "journal" appends each command to state.json.journal, "json" rewrites state.json every command,
+# "sqlite" keeps everything in state.db
+ELO_PERSISTENCE = os.environ.get("ELO_PERSISTENCE", "journal")
+ELO_STATE_PATH = os.environ.get("ELO_STATE_PATH")
+# "json" or "binary" snapshots for the journal and json backends, see snapshot.py. Unset keeps each file's format.
+ELO_SNAPSHOT_FORMAT = os.environ.get("ELO_SNAPSHOT_FORMAT")
+# Every other channel gets its own state under ELO_STATE_DIR/<team id>/<channel id>
+ELO_STATE_DIR = os.environ.get("ELO_STATE_DIR", "state")
+# Scores older than this many days are moved to the archive when a channel's state is loaded (JSON state only)
+ELO_HOT_DAYS = os.environ.get("ELO_HOT_DAYS")
+# "elo", "glicko2" or "plackett-luce", see ratings.py
+RATING_ENGINE = make_engine(os.environ.get("RATING_ENGINE", "elo"))
 slack_events_adapter = SlackEventAdapter(SLACK_SIGNING_SECRET, "/slack/events", app)
+# Outbound Slack calls run on background workers so handlers can ack right away
+slack_client = SlackClient(SLACK_BOT_TOKEN, base_url=os.environ.get("SLACK_API_URL", "https://slack.com/api"))
+
+shards = None
+bracket_renderer = None
+jobs = None
+
+BRACKET_IMG_DIR = "brackets"
+GRAPH_IMG_DIR = "graphs"
+# Elo samples in a /stats @user graph
+GRAPH_POINTS = 120
+# (channel, graph image) -> permalink of the image shared in the channel, None while the upload is running.
+# Each image is shared once, asking for the same graph again links to it.
+graph_uploads = {}
+graph_uploads_lock = threading.Lock()
+HISTORY_PAGE_SIZE = 10
+RIVALS_COUNT = 10
+# "matplotlib" or "pillow", the Pillow renderer is much faster for big brackets
+BRACKET_RENDERER = os.environ.get("BRACKET_RENDERER", "matplotlib")
+# Set ELO_PROFILE=1 to profile every request, or send an X-Profile: 1 header with the ELO_ADMIN_TOKEN bearer token
+# to profile one. Stack samples are written to ELO_PROFILE_DIR as collapsed stacks for flamegraph tools.
+ELO_PROFILE = os.environ.get("ELO_PROFILE") == "1"
+ELO_PROFILE_DIR = os.environ.get("ELO_PROFILE_DIR", "profiles")
+# Set ELO_ASYNC=1 to ack /record, /duel, /tournament and mentions right away and run them on a job queue,
+# slash command results are then posted to the command's response_url
+ELO_ASYNC = os.environ.get("ELO_ASYNC") == "1"
+ELO_JOB_WORKERS = int(os.environ.get("ELO_JOB_WORKERS", 4))
+ELO_JOB_QUEUE_SIZE = int(os.environ.get("ELO_JOB_QUEUE_SIZE", 256))
+# Bearer token for the bulk /import and /export endpoints, they're disabled without one
+ELO_ADMIN_TOKEN = os.environ.get("ELO_ADMIN_TOKEN")
+# Rendered /leaderboard, /stats and /h2h responses, rebuilt once what they show changes
+response_cache = ResponseCache(int(os.environ.get("ELO_CACHE_SIZE", 1024)))
+# Slack retries events it doesn't get an ack for in time. Event ids and slash command trigger ids seen in the last
+# ELO_DEDUP_TTL seconds are dropped before doing any work, and kept in ELO_DEDUP_PATH across restarts.
+ELO_DEDUP_TTL = float(os.environ.get("ELO_DEDUP_TTL", 3600))
+ELO_DEDUP_PATH = os.environ.get("ELO_DEDUP_PATH", "deliveries.json")
+deliveries = DedupCache(ttl=ELO_DEDUP_TTL)
+# Each user can queue ELO_USER_BURST commands at once, refilled at ELO_USER_RATE commands per second
+rate_limiter = RateLimiter(float(os.environ.get("ELO_USER_RATE", 0.5)), int(os.environ.get("ELO_USER_BURST", 5)))
+
+metrics.Gauge("elo_bot_players", "Players in the loaded leagues",
+              function=lambda: sum(len(elo_system.records) for elo_system in shards.systems()) if shards else 0)
+metrics.Gauge("elo_bot_state_bytes", "Size of the loaded leagues' state on disk",
+              function=lambda: sum(elo_system.storage.size_bytes() for elo_system in shards.systems() if elo_system.storage) if shards else 0)
+metrics.Gauge("elo_bot_loaded_leagues", "Leagues (workspace and channel pairs) held in memory",
+              function=lambda: len(shards) if shards else 0)
+metrics.Gauge("elo_bot_slack_queue", "Outbound Slack calls waiting for a worker", function=lambda: slack_client.queue_size())
+metrics.Gauge("elo_bot_jobs_pending", "Queued or running commands with ELO_ASYNC", function=lambda: len(jobs) if jobs is not None else 0)
+
+
+def route_label():
+    # The matched route rather than the path, so unknown paths can't grow the metric labels without bound
+    return request.url_rule.rule if request.url_rule else "unmatched"
+
+
+@app.before_request
+def start_request_metrics():
+    metrics.set_route(route_label())
+    g.request_start = time.perf_counter()
+    if ELO_PROFILE or (request.headers.get("X-Profile") == "1" and is_admin_request()):
+        g.profiler = metrics.SamplingProfiler().start()
+
+
+@app.after_request
+def finish_request_metrics(response):
+    route = route_label()
+    metrics.REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, route=route, status=response.status_code)
+    profiler = g.pop("profiler", None)
+    if profiler:
+        profiler.stop()
+        os.makedirs(ELO_PROFILE_DIR, exist_ok=True)
+        profiler.write(os.path.join(ELO_PROFILE_DIR, f"{route.strip('/').replace('/', '_')}-{time.time_ns()}.folded"))
+    return response
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
-elo_system = None
-
-SLACK_ID_REGEX = r"<(@[A-Z0-9]*)(?:\|[a-z0-9._-]*)?>"
-SLACK_ID_MATCH_USERNAME_REGEX = r"<(@[A-Z0-9]*)\|?([a-z0-9._-]*)?>"
-BRACKET_IMG_FILENAME = "bracket.png"
 
 @app.route('/leaderboard', methods=['POST'])
 def leaderboard():
@@ -31,20 +133,20 @@ def leaderboard():
 
     text = data.get('text')
 
-    event_pattern = r"((?i:air|sport|standard))"
-    match = re.match(event_pattern, text)
-    event = match.groups()[0] if match else None
-    
-    by_elo, by_best, by_avg = elo_system.get_leaderboard(event)
-
-    response_text = ""
-    if not event:
-        by_elo_list = "\n".join([f"{i+1}. {key} - {round(elo_system.get_info(key)['elo'])}" for i, key in enumerate(by_elo)])
-        response_text = f"*ELO Leaderboard:*\n{by_elo_list}"
-    else:
-        by_best_list = "\n".join([f"{i+1}. {key} - {elo_system.get_info(key)['best'][event]}" for i, key in enumerate(by_best)])
-        by_avg_list = "\n".join([f"{i+1}. {key} - {round(elo_system.get_info(key)['avg'][event], 2)}" for i, key in enumerate(by_avg)])
-        response_text = f"*Leaderboard by Best in {event.lower().capitalize()}:*\n{by_best_list}\n*Leaderboard by Average in {event.lower().capitalize()}:*\n{by_avg_list}"
+    # Optional event, rank range and time window, e.g. "air 20-40 --last 30"
+    try:
+        with metrics.stage("parse"):
+            command = commands.parse_leaderboard(text)
+    except ParseError as e:
+        return jsonify({"response_type": "ephemeral", "text": f"Invalid format ({e}), please write as: [Event] [First-Last] [--since YYYY-MM-DD] [--until YYYY-MM-DD] [--last Days] [--season [Year]]"})
+    event, start, end = command.event, command.start, command.end
+
+    with get_elo_system(data.get('team_id'), data.get('channel_id')) as elo_system:
+        response_text = cached_text(
+            data, elo_system, ("leaderboard", event, start, end, command.since, command.until),
+            [("event", event) if event else ("elo",)],
+            lambda: leaderboard_text(elo_system, event, start, end, command.since, command.until)
+        )
 
     # Acknowledge the request immediately (important for Slack)
     response = {
@@ -54,31 +156,52 @@ def leaderboard():
     return jsonify(response)
 
 
+def leaderboard_text(elo_system, event, start, end, since=None, until=None):
+    by_elo, by_best, by_avg = elo_system.get_leaderboard(event, start, end, since, until)
+
+    response_text = ""
+    if not event:
+        by_elo_list = "\n".join([f"{start+i+1}. {key} - {round(elo)}" for i, (key, elo) in enumerate(by_elo)])
+        response_text = f"*ELO Leaderboard:*\n{by_elo_list}"
+    else:
+        by_best_list = "\n".join([f"{start+i+1}. {key} - {best}" for i, (key, best) in enumerate(by_best)])
+        by_avg_list = "\n".join([f"{start+i+1}. {key} - {round(avg, 2)}" for i, (key, avg) in enumerate(by_avg)])
+        window = (f" from {since}" if since else "") + (f" through {until}" if until else "")
+        response_text = f"*Leaderboard by Best in {event.lower().capitalize()}{window}:*\n{by_best_list}\n*Leaderboard by Average in {event.lower().capitalize()}{window}:*\n{by_avg_list}"
+    return response_text
+
+
 @app.route('/record', methods=['POST'])
 def record():
     data = request.form
     if not data.get('token') == VERIFICATION_TOKEN:
         return
+    if is_duplicate(delivery_key("trigger", data.get('trigger_id'))):
+        return "", 200
 
     text = data.get('text')
-    result = handle_score_list(text)
+    try:
+        with metrics.stage("parse"):
+            command = commands.parse_score_list(text)
+    except ParseError as e:
+        return jsonify({"response_type": "in_channel", "text": f"Invalid format ({e}), please write as: Event @User1 Score1 @User2 Score2 ..."})
 
-    response_text = ""
-    if result:
-        event, scores = result
-        if len(scores) == 0:
-            response_text = f"No scores listed :("
-        else:
-            scores = sorted(scores, key=lambda x: x[1], reverse=True)
-            response_text = f"*Recorded {event.lower().capitalize()} Scores:*\n"+"\n".join([f"{i+1}. {s[0]} - {s[1]}" for i, s in enumerate(scores)])
+    return run_command(data, record_response, command)
+
+
+def record_response(elo_system, command, channel_id):
+    event, scores = handle_score_list(elo_system, command)
+    if len(scores) == 0:
+        response_text = f"No scores listed :("
     else:
-        response_text = f"Invalid format, please write as: Event @User1 Score1 @User2 Score2 ..."
-    
+        scores = sorted(scores, key=lambda x: x[1], reverse=True)
+        response_text = f"*Recorded {event.lower().capitalize()} Scores:*\n"+"\n".join([f"{i+1}. {s[0]} - {s[1]}" for i, s in enumerate(scores)])
+
     response = {
         "response_type": "in_channel",
         "text": response_text
     }
-    return jsonify(response)
+    return response
 
 
 @app.route('/duel', methods=['POST'])
@@ -86,28 +209,31 @@ def challenge_match():
     data = request.form
     if not data.get('token') == VERIFICATION_TOKEN:
         return
+    if is_duplicate(delivery_key("trigger", data.get('trigger_id'))):
+        return "", 200
 
     text = data.get('text')
-    result = handle_challenge_match(text)
+    try:
+        with metrics.stage("parse"):
+            command = commands.parse_duel(text)
+    except ParseError as e:
+        return jsonify({"response_type": "in_channel", "text": f"Invalid format ({e}), please write as: @User1 Score1 - Score2 @User2"})
+
+    return run_command(data, duel_response, command)
+
+
+def duel_response(elo_system, command, channel_id):
+    playerA, scoreA, playerB, scoreB, eloA, eloB, (deltaA, deltaB), bracket_render = handle_challenge_match(elo_system, command)
+    response_text = f"*{playerA}: {round(eloA - deltaA, 2)} -> {round(eloA, 2)}*\n*{playerB}: {round(eloB - deltaB, 2)} -> {round(eloB, 2)}*"
+
+    if bracket_render:
+        upload_when_rendered(bracket_render, channel_id)
 
-    response_text = ""
-    if result:
-        playerA, scoreA, playerB, scoreB, eloA, eloB, elo_delta, bracket_img_filename = result
-        eloA = round(eloA, 2)
-        eloB = round(eloB, 2)
-        elo_delta = round(elo_delta, 2)
-        response_text = f"*{playerA}: {eloA - elo_delta} -> {eloA}*\n*{playerB}: {eloB + elo_delta} -> {eloB}*"
-
-        if bracket_img_filename:
-            upload_image(bracket_img_filename)
-    else:
-        response_text = f"Invalid format, please write as: @User1 Score1 - Score2 @User2"
-    
     response = {
         "response_type": "in_channel",
         "text": response_text
     }
-    return jsonify(response)
+    return response
 
 
 @app.route('/stats', methods=['POST'])
@@ -117,35 +243,37 @@ def get_player_info():
         return
 
     text = data.get('text')
-    result = handle_get_player_info(text)
 
     response_text = ""
-    if result:
-        response_text = f"```{result['id']}\n"
-
-        elo_table_matrix = [
-            ["ELO", "W-L"],
-            [round(result["elo"],2), f"{result['W']}-{result['L']}"]
-        ]
-        response_text += matrix_to_ascii_table(elo_table_matrix)
-
-        score_table_matrix = []
-        for event in ["air", "standard", "sport"]:
-            # Not using score_string right now because overflows for mobile users
-            score_string = ", ".join([f"({s[0]}, {s[2]})" for s in result["scores"] if s[1] == event]) 
-
-            if not score_string:
-                continue
-
-            if len(score_table_matrix) == 0:
-                score_table_matrix.append(["Event", "Best", "Average"])
-            score_table_matrix.append([event.capitalize(), result["best"][event], round(result["avg"][event],2)])
-
-        if score_table_matrix:
-            response_text += f"\n{matrix_to_ascii_table(score_table_matrix)}"
-        response_text += "```"
-    else:
-        response_text = f"Invalid format, please mention a user"
+    with get_elo_system(data.get('team_id'), data.get('channel_id')) as elo_system:
+        try:
+            with metrics.stage("parse"):
+                command = commands.parse_stats(text)
+            if command.args and command.args[0] == "history":
+                history_text = cached_text(
+                    data, elo_system, ("history", command.player, tuple(command.args[1:2])),
+                    [("player", command.player)],
+                    lambda: handle_score_history(elo_system, command)
+                )
+                return jsonify({"response_type": "ephemeral", "text": history_text})
+            if command.args and command.args[0] == "graph":
+                graph_text, graph_path = cached_text(
+                    data, elo_system, ("graph", command.player),
+                    [("player", command.player)],
+                    lambda: handle_rating_graph(elo_system, command)
+                )
+                if graph_path:
+                    graph_text = share_graph(graph_text, graph_path, data.get('channel_id'))
+                return jsonify({"response_type": "ephemeral", "text": graph_text})
+
+            # The rank changes with anyone's elo
+            response_text = cached_text(
+                data, elo_system, ("stats", command.player),
+                [("player", command.player), ("elo",)],
+                lambda: stats_text(elo_system, command)
+            )
+        except ParseError as e:
+            response_text = f"Invalid format ({e}), please mention a user, optionally followed by: history [page] or graph"
     
     response = {
         "response_type": "ephemeral",
@@ -154,174 +282,432 @@ def get_player_info():
     return jsonify(response)
 
 
+def stats_text(elo_system, command):
+    result = handle_get_player_info(elo_system, command)
+    response_text = f"```{result['id']}\n"
+
+    elo_table_matrix = [
+        ["ELO", "W-L", "Rank"],
+        [round(result["elo"],2), f"{result['W']}-{result['L']}", f"#{elo_system.get_rank(result['id'])}"]
+    ]
+    response_text += matrix_to_ascii_table(elo_table_matrix)
+
+    score_table_matrix = []
+    for event in ["air", "standard", "sport"]:
+        if event not in result["best"]:
+            continue
+
+        if len(score_table_matrix) == 0:
+            score_table_matrix.append(["Event", "Best", "Average"])
+        score_table_matrix.append([event.capitalize(), result["best"][event], round(result["avg"][event],2)])
+
+    if score_table_matrix:
+        response_text += f"\n{matrix_to_ascii_table(score_table_matrix)}"
+    response_text += "```"
+    return response_text
+
+
+@app.route('/h2h', methods=['POST'])
+def head_to_head():
+    data = request.form
+    if not data.get('token') == VERIFICATION_TOKEN:
+        return
+
+    text = data.get('text')
+
+    # "@A @B" for their record against each other, "@A" for A's rivals
+    try:
+        with metrics.stage("parse"):
+            command = commands.parse_head_to_head(text)
+    except ParseError as e:
+        return jsonify({"response_type": "ephemeral", "text": f"Invalid format ({e}), please write as: @User1 [@User2]"})
+
+    with get_elo_system(data.get('team_id'), data.get('channel_id')) as elo_system:
+        if command.playerB:
+            response_text = cached_text(
+                data, elo_system, ("h2h", command.playerA, command.playerB),
+                [("player", command.playerA), ("player", command.playerB)],
+                lambda: handle_head_to_head(elo_system, command)
+            )
+        else:
+            response_text = cached_text(
+                data, elo_system, ("rivals", command.playerA),
+                [("player", command.playerA)],
+                lambda: handle_rivals(elo_system, command)
+            )
+
+    response = {
+        "response_type": "ephemeral",
+        "text": response_text
+    }
+    return jsonify(response)
+
+
 @app.route('/tournament', methods=['POST'])
 def start_tournament():
     data = request.form
     if not data.get('token') == VERIFICATION_TOKEN:
         return
+    if is_duplicate(delivery_key("trigger", data.get('trigger_id'))):
+        return "", 200
 
     text = data.get('text')
-    bracket_img_filename = handle_start_tournament(text)
+    try:
+        with metrics.stage("parse"):
+            command = commands.parse_tournament(text)
+    except ParseError as e:
+        return jsonify({"response_type": "ephemeral", "text": f"Invalid format ({e}), please write as: [Name] [--seeded | --double | --swiss [--rounds N]] @User1 @User2 ..."})
 
-    if not bracket_img_filename:
-        return jsonify({"response_type": "in_channel", "text": "Internal error when starting tournament :("})
+    return run_command(data, tournament_response, command)
+
+
+def tournament_response(elo_system, command, channel_id):
+    bracket_render = handle_start_tournament(elo_system, command)
+    upload_when_rendered(bracket_render, channel_id)
+    # The bracket image is the response, nothing to post to response_url
+    return {"response_type": "in_channel"}
+
+
+def is_admin_request():
+    return bool(ELO_ADMIN_TOKEN) and hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {ELO_ADMIN_TOKEN}")
+
+
+@app.route('/import', methods=['POST'])
+def import_history():
+    # Streams a CSV or NDJSON body of score lists and duels into a league, see bulk.py
+    if not is_admin_request():
+        return jsonify({"error": "unauthorized"}), 403
+
+    format = request.args.get("format") or ("csv" if request.mimetype == "text/csv" else "ndjson")
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    try:
+        with get_elo_system(request.args.get('team_id'), request.args.get('channel_id')) as elo_system, metrics.stage("import"):
+            counts = bulk.import_rows(elo_system, bulk.read_rows(lines, format))
+    except bulk.BulkError as e:
+        return jsonify({"error": f"{e}, rows before it were imported", "line": e.line}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(counts)
 
-    upload_image(bracket_img_filename)
-    return jsonify({"response_type": "in_channel"})
+
+@app.route('/export', methods=['GET'])
+def export_history():
+    if not is_admin_request():
+        return jsonify({"error": "unauthorized"}), 403
+
+    format = request.args.get("format", "ndjson")
+    if format not in bulk.FORMATS:
+        return jsonify({"error": f"Unknown format {format!r}, expected one of {', '.join(bulk.FORMATS)}"}), 400
+    team_id, channel_id = request.args.get('team_id'), request.args.get('channel_id')
+
+    def stream():
+        # The league stays loaded until the last chunk is sent or the client goes away
+        with get_elo_system(team_id, channel_id) as elo_system:
+            yield from bulk.export(elo_system, format)
+    return Response(stream(), mimetype="text/csv" if format == "csv" else "application/x-ndjson")
 
 
 @slack_events_adapter.on("app_mention")
 def app_mention(event_data):
+    metrics.set_route("app_mention")
+    key = delivery_key("event", event_data.get('event_id'))
+    if is_duplicate(key):
+        return
     print(json.dumps(event_data, indent=2))
-    text = event_data['event']['text']
+    event = event_data['event']
+    team_id = event_data.get('team_id')
+
+    # "@bot air @A 550 @B 530 ..." records scores, "@bot @A 5 - 3 @B" records a duel
+    try:
+        with metrics.stage("parse"):
+            command = commands.parse_mention(event['text'])
+    except ParseError as e:
+        print("Couldn't parse mention:", e)
+        add_reaction("thumbsdown", event['ts'], event['channel'])
+        return
 
-    score_list_pattern = r"<@[A-Z0-9]*>\s*(?i:air|sport|standard)(?i:\s*pistol)?(\s*(<@[A-Z0-9]*>)\s*(\d{3}))+"
-    challenge_match_pattern = r"<@[A-Z0-9]*>\s*<@[A-Z0-9]*>\s*\d+\s*-\s*\d+\s*<@[A-Z0-9]*>"
+    if jobs is None:
+        try:
+            handle_mention(team_id, event, command)
+        except Exception:
+            # Let Slack's retry run it again
+            deliveries.release(key)
+            raise
+        return
 
-    result = None
-    if re.match(score_list_pattern, text):
-        result = handle_score_list(text)
-    elif re.match(challenge_match_pattern, text):
-        result = handle_challenge_match(text)
-    
-    if result:
-        add_reaction("thumbsup", event_data['event']['ts'])
-    else:
-        add_reaction("thumbsdown", event_data['event']['ts'])
-    return
+    if not rate_limiter.allow(event.get('user')):
+        add_reaction("thumbsdown", event['ts'], event['channel'])
+        return
+    try:
+        jobs.submit(run_job, "app_mention", time.perf_counter(), handle_mention, team_id, event, command,
+                    keys=command_keys(team_id, event['channel'], command))
+    except QueueFull:
+        add_reaction("thumbsdown", event['ts'], event['channel'])
 
 
-def handle_score_list(text):
-    event_pattern = r"((?i:air|sport|standard))(?i:\s*pistol)?\s*"
-    scores_pattern = rf"{SLACK_ID_REGEX}\s*(\d+)"
+def handle_mention(team_id, event, command):
+    with get_elo_system(team_id, event['channel']) as elo_system:
+        if isinstance(command, commands.ScoreList):
+            handle_score_list(elo_system, command)
+        else:
+            handle_challenge_match(elo_system, command)
+    add_reaction("thumbsup", event['ts'], event['channel'])
 
-    match = re.search(event_pattern, text)
-    if not match:
-        return None
 
-    event = match.groups()[0]
-    scores = re.findall(scores_pattern, text)
-    scores = list(map(lambda s: (f"<{s[0]}>", s[1]), scores))
-    
-    result = elo_system.record_scores(event, scores)
-    elo_system.save_to_json()
-    return result
+def shard_state_path(team_id, channel_id):
+    if channel_id == ELO_BOT_CHANNEL_ID:
+        return ELO_STATE_PATH
+    extension = "db" if ELO_PERSISTENCE == "sqlite" else "json"
+    shard_dir = os.path.join(ELO_STATE_DIR, team_id)
+    os.makedirs(shard_dir, exist_ok=True)
+    return os.path.join(shard_dir, f"{channel_id}.{extension}")
 
 
-def handle_challenge_match(text):
-    challenge_match_pattern = rf"(?:<@[A-Z0-9]*>)?\s*{SLACK_ID_REGEX}\s*(\d+)\s*-\s*(\d+)\s*{SLACK_ID_REGEX}"
+def open_shard(team_id, channel_id):
+    elo_system = ELO_System.from_storage(open_storage(ELO_PERSISTENCE, shard_state_path(team_id, channel_id), ELO_SNAPSHOT_FORMAT), RATING_ENGINE)
+    if ELO_HOT_DAYS and elo_system.archive:
+        if elo_system.archive_scores((date.today() - timedelta(days=int(ELO_HOT_DAYS))).isoformat()):
+            elo_system.checkpoint()
+    return elo_system
 
-    match = re.match(challenge_match_pattern, text)
-    if not match:
-        return None
-    groups = match.groups()
-    if not len(groups) == 4:
-        return None
 
-    playerA = f"<{groups[0]}>"
-    scoreA = int(groups[1])
-    scoreB = int(groups[2])
-    playerB = f"<{groups[3]}>"
+def cached_text(data, elo_system, key, tags, build):
+    # Response text for key in the request's league, build() is only called again once one of the tags' versions changes
+    with metrics.stage("query"):
+        return response_cache.get_or_build(
+            (data.get('team_id'), data.get('channel_id')) + key,
+            elo_system.cache_versions(*tags),
+            build
+        )
 
-    eloA, eloB, elo_delta, found_tournament_match = elo_system.challenge_match(playerA, scoreA, playerB, scoreB)
-    elo_system.save_to_json()
 
-    bracket_img_filename = None
-    if found_tournament_match:
-        bracket = elo_system.get_tournament_bracket()
-        bracket_img_filename = BRACKET_IMG_FILENAME
-        generate_bracket_image(bracket, bracket_img_filename)
+def delivery_key(kind, delivery_id):
+    return f"{kind}:{delivery_id}" if delivery_id else None
 
-    return playerA, scoreA, playerB, scoreB, eloA, eloB, elo_delta, bracket_img_filename
 
+def is_duplicate(key):
+    # Claims the delivery, True if it was already handled. Deliveries without an id are never duplicates.
+    if deliveries.claim(key):
+        return False
+    # Slack retries up to 3 times, anything else would add a label value per request
+    retry = request.headers.get("X-Slack-Retry-Num", "0")
+    metrics.DUPLICATE_DELIVERIES.inc(route=metrics.current_route(), retry=retry if retry in ["0", "1", "2", "3"] else "other")
+    return True
 
-def handle_get_player_info(text):
-    player_pattern = rf"{SLACK_ID_REGEX}"
 
-    match = re.search(player_pattern, text)
-    if not match:
-        return None
-    player = f"<{match.groups()[0]}>"
+def command_keys(team_id, channel_id, command):
+    # Job ordering keys, commands touching the same players or tournament in a league run in order
+    if isinstance(command, commands.ScoreList):
+        keys = [player for player, _ in command.scores]
+    elif isinstance(command, commands.Duel):
+        keys = [command.playerA, command.playerB]
+    else:
+        keys = [player for player, _ in command.players] + [("tournament", command.name)]
+    return [(team_id, channel_id, key) for key in keys]
+
+
+def run_command(data, build_response, command):
+    '''
+    Runs a command that changes the league and returns the response for the
+    request. With ELO_ASYNC the command is queued instead, the request is
+    acked right away and the response is posted to its response_url.
+    build_response(elo_system, command, channel_id) runs the command and
+    returns the response message.
+    '''
+    team_id, channel_id = data.get('team_id'), data.get('channel_id')
+    if jobs is None or not data.get('response_url'):
+        try:
+            with get_elo_system(team_id, channel_id) as elo_system:
+                return jsonify(build_response(elo_system, command, channel_id))
+        except Exception:
+            deliveries.release(delivery_key("trigger", data.get('trigger_id')))
+            raise
+
+    if not rate_limiter.allow(data.get('user_id')):
+        return jsonify({"response_type": "ephemeral", "text": "You're sending commands too fast, please try again in a few seconds"})
+    try:
+        jobs.submit(run_job, request.path, time.perf_counter(), respond_later, data.to_dict(), build_response, command,
+                    keys=command_keys(team_id, channel_id, command))
+    except QueueFull:
+        return jsonify({"response_type": "ephemeral", "text": "The bot is busy, please try again in a minute"})
+    return jsonify({"response_type": "in_channel"})
 
-    return elo_system.get_info(player)
 
+def run_job(route, queued_at, fn, *args):
+    metrics.set_route(route)
+    metrics.STAGE_SECONDS.observe(time.perf_counter() - queued_at, route=route, stage="queued")
+    fn(*args)
 
-def handle_start_tournament(text):
-    player_pattern = rf"{SLACK_ID_MATCH_USERNAME_REGEX}"
 
-    players = re.findall(player_pattern, text)
-    if not players:
-        return None
-    players = list(map(lambda x: (f"<{x[0]}>", x[1]), players))
+def respond_later(data, build_response, command):
+    channel_id = data.get('channel_id')
+    try:
+        with get_elo_system(data.get('team_id'), channel_id) as elo_system:
+            response = build_response(elo_system, command, channel_id)
+    except Exception:
+        slack_client.respond(data['response_url'], {"response_type": "ephemeral", "text": "Sorry, that command failed"})
+        raise
+    if response.get("text"):
+        with metrics.stage("respond"):
+            slack_client.respond(data['response_url'], response)
 
-    elo_system.start_tournament(players)
-    elo_system.save_to_json()
-    bracket = elo_system.get_tournament_bracket()
 
-    bracket_img_filename = BRACKET_IMG_FILENAME
-    generate_bracket_image(bracket, bracket_img_filename)
+@contextmanager
+def get_elo_system(team_id, channel_id):
+    # Each workspace and channel runs its own league, it isn't evicted until the block ends
+    with ExitStack() as stack:
+        with metrics.stage("load_league"):
+            elo_system = stack.enter_context(shards.use(team_id or "default", channel_id or ELO_BOT_CHANNEL_ID))
+        yield elo_system
 
-    return bracket_img_filename
 
+def handle_score_list(elo_system, command):
+    with metrics.stage("record"):
+        result = elo_system.record_scores(command.event, command.scores)
+    with metrics.stage("save"):
+        elo_system.save()
+    return result
 
-def send_message(msg, channel=ELO_BOT_CHANNEL_ID):
-    # set thread_ts to send as thread
-    headers = {
-        "Authorization": f"Bearer {SLACK_BOT_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "channel": channel,
-        "text": msg
-    }
-    r = requests.post("https://slack.com/api/chat.postMessage", headers=headers, data=json.dumps(payload))
-    print("Send Message POST Response:", r.text)
+
+def handle_challenge_match(elo_system, command):
+    playerA, scoreA, scoreB, playerB = command
+
+    with metrics.stage("rate"):
+        eloA, eloB, elo_delta, found_tournament_match = elo_system.challenge_match(playerA, scoreA, playerB, scoreB)
+    with metrics.stage("save"):
+        elo_system.save()
+
+    bracket_render = None
+    if found_tournament_match:
+        with metrics.stage("submit_bracket"):
+            bracket = elo_system.get_tournament_bracket(found_tournament_match)
+            bracket_render = bracket_renderer.render(bracket)
+
+    return playerA, scoreA, playerB, scoreB, eloA, eloB, elo_delta, bracket_render
+
+
+def handle_get_player_info(elo_system, command):
+    return elo_system.get_info(command.player)
+
+
+def handle_score_history(elo_system, command):
+    # "/stats @A history [page]", newest scores first
+    page = int(command.args[1]) if len(command.args) > 1 and command.args[1].isdigit() else 1
+    page = max(page, 1)
+    rows, total = elo_system.get_score_history(command.player, (page - 1) * HISTORY_PAGE_SIZE, HISTORY_PAGE_SIZE)
+    if not rows:
+        return f"No scores recorded for {command.player} on page {page}"
+
+    history_matrix = [["Date", "Event", "Score"]] + [[day, event.capitalize(), score] for day, event, score in rows]
+    return f"```{command.player}\n{matrix_to_ascii_table(history_matrix)}\nPage {page}/{math.ceil(total / HISTORY_PAGE_SIZE)}```"
+
+
+def handle_rating_graph(elo_system, command):
+    # "/stats @A graph", returns the text and the path of the sparkline image of A's recent elo
+    samples = elo_system.rating_history(command.player, GRAPH_POINTS)
+    if not samples:
+        return f"No rating changes recorded for {command.player} yet", None
+
+    lasts = [last for _, _, _, last in samples]
+    low, high = min(sample[1] for sample in samples), max(sample[2] for sample in samples)
+    with metrics.stage("render"):
+        graph_path = render_sparkline(samples, GRAPH_IMG_DIR)
+    return (f"*{command.player}'s ELO since {samples[0][0]}:* {sparkline_text(lasts)}\n"
+            f"{round(lasts[0])} -> {round(lasts[-1])}, low {round(low)}, high {round(high)}"), graph_path
+
+
+def share_graph(graph_text, graph_path, channel_id):
+    # Uploads a graph image to the channel the first time it's asked for, after that the reply links to it
+    key = (channel_id, graph_path)
+    with graph_uploads_lock:
+        uploaded = key in graph_uploads
+        permalink = graph_uploads.get(key)
+        if not uploaded:
+            graph_uploads[key] = None
+    if not uploaded:
+        upload_image(graph_path, channel_id, on_upload=lambda permalink: graph_uploaded(key, permalink))
+    elif permalink:
+        graph_text += f"\n<{permalink}|Rating graph>"
+    return graph_text
+
+
+def graph_uploaded(key, permalink):
+    with graph_uploads_lock:
+        if permalink:
+            graph_uploads[key] = permalink
+        else:
+            # Try again on the next request
+            graph_uploads.pop(key, None)
 
 
-def upload_image(filepath, channel=ELO_BOT_CHANNEL_ID):
-    response = requests.post(
-        "https://slack.com/api/files.getUploadURLExternal",
-        headers={"Authorization": f"Bearer {SLACK_BOT_TOKEN}"},
-        data={"filename": filepath, "length": os.path.getsize(filepath)} 
-    )
+def handle_head_to_head(elo_system, command):
+    record = elo_system.head_to_head(command.playerA, command.playerB)
+    if not record["duels"]:
+        return f"{command.playerA} and {command.playerB} haven't dueled yet"
+    return (f"*{command.playerA} vs {command.playerB}:* {record['wins']}-{record['losses']}-{record['draws']} (W-L-D) "
+            f"in {record['duels']} duels, average margin {record['margin']:+.2f}")
 
-    upload_info = response.json()
-    upload_url = upload_info["upload_url"]
-    file_id = upload_info["file_id"]
 
-    with open(filepath, "rb") as file:
-        upload_response = requests.post(upload_url, files={"file": file})
+def handle_rivals(elo_system, command):
+    rivals = elo_system.rivals(command.playerA, RIVALS_COUNT)
+    if not rivals:
+        return f"{command.playerA} hasn't dueled anyone yet"
+    rivals_list = "\n".join([
+        f"{i+1}. {opponent} - {r['wins']}-{r['losses']}-{r['draws']}, average margin {r['margin']:+.2f}"
+        for i, (opponent, r) in enumerate(rivals)
+    ])
+    return f"*{command.playerA}'s Rivals (W-L-D):*\n{rivals_list}"
 
-    complete_response = requests.post(
-        "https://slack.com/api/files.completeUploadExternal",
-        headers={
-            "Authorization": f"Bearer {SLACK_BOT_TOKEN}",
-            "Content-Type": "application/json"
-        },
-        json={
-            "files": [{"id": file_id}],
-            "channel_id": channel  # Replace with your channel ID
-        }
-    )
+
+def handle_start_tournament(elo_system, command):
+    with metrics.stage("start_tournament"):
+        elo_system.start_tournament(command.players, name=command.name, format=command.format, rounds=command.rounds)
+    with metrics.stage("save"):
+        elo_system.save()
+
+    with metrics.stage("submit_bracket"):
+        bracket = elo_system.get_tournament_bracket(command.name)
+        return bracket_renderer.render(bracket)
+
+
+def send_message(msg, channel=ELO_BOT_CHANNEL_ID):
+    slack_client.send_message(channel, msg)
+
+
+def upload_image(filepath, channel=ELO_BOT_CHANNEL_ID, on_upload=None):
+    slack_client.upload_image(channel, filepath, on_upload)
+
+
+def upload_when_rendered(bracket_render, channel=ELO_BOT_CHANNEL_ID):
+    # bracket_render is a Future from BracketRenderer.render
+    def upload(future):
+        if future.exception():
+            print("Bracket render failed:", repr(future.exception()))
+            return
+        upload_image(future.result(), channel)
+    bracket_render.add_done_callback(upload)
 
 
 def add_reaction(emoji_name, msg_timestamp, channel=ELO_BOT_CHANNEL_ID):
-    headers = {
-        "Authorization": f"Bearer {SLACK_BOT_TOKEN}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "channel": channel,
-        "name": emoji_name,
-        "timestamp": msg_timestamp
-    }
-    r = requests.post("https://slack.com/api/reactions.add", headers=headers, data=json.dumps(payload))
-    print("Add Reaction POST Response:", r.text)
+    slack_client.add_reaction(channel, emoji_name, msg_timestamp)
 
 
 if __name__ == "__main__":
-    elo_system = ELO_System.from_json("state.json")
-    app.run(port=3000)
+    shards = ShardManager(open_shard)
+    bracket_renderer = BracketRenderer(BRACKET_IMG_DIR, renderer=BRACKET_RENDERER)
+    if ELO_ASYNC:
+        jobs = JobQueue(ELO_JOB_WORKERS, ELO_JOB_QUEUE_SIZE)
+    deliveries = DedupCache(ELO_DEDUP_PATH, ELO_DEDUP_TTL)
+    try:
+        # ELO_System and ShardManager are safe to share between request threads
+        app.run(port=3000, threaded=True)
+    finally:
+        if jobs is not None:
+            jobs.close()
+        bracket_renderer.close()
+        slack_client.close()
+        shards.close()
+        deliveries.close()
 
 '''
 TODO:
@@ -1,107 +1,490 @@
+from contextlib import contextmanager
 from datetime import date
+import functools
+import itertools
+import threading
 import random
 import math
 
-from utils import read_json_file, write_json_file
+import metrics
+from head_to_head import HeadToHead
+from leaderboard import LeaderboardIndex
+from player import EVENTS, NO_LIST, SCORE_RANGE, Player, ScoreHistory
+from ratings import EloEngine
+from recompute import encode_duels, tally
+from storage import JSONStorage
+from tournament import FORMATS as TOURNAMENT_FORMATS, Swiss, create as create_tournament, load as load_tournament
+from windowed import WindowIndex
+
+# Epochs are unique across ELO_System instances so a reloaded league never reuses cache versions
+_epochs = itertools.count(1)
+
+def _locked(method):
+	# Mutations run one at a time under the system's write lock
+	@functools.wraps(method)
+	def wrapper(self, *args, **kwargs):
+		with self.lock:
+			return method(self, *args, **kwargs)
+	return wrapper
+
 
 class ELO_System:
+	EVENTS = EVENTS
 	BASE_ELO = 1500
 	EXPECTED_SCORE_CONSTANT = 500 # lower constant -> steeper expected score gradient
 	SCALING_CONSTANT = 100
 
-	def __init__(self, records, tournament_state, save_filepath):
-		self.records = records
+	def __init__(self, records, tournament_state, storage=None, duels=None, engine=None):
+		# Records loaded from JSON or SQLite are dicts, see player.py
+		self.records = {player: info if isinstance(info, Player) else Player.from_dict(info) for player, info in records.items()}
 		self.tournament_state = tournament_state
-		self.filepath = save_filepath
+		self.storage = storage
+		# Old score history moved out of records, see archive_scores
+		self.archive = storage.archive if storage else None
+		self.archive_generation = 0
+		# Rating engine, see ratings.py
+		self.engine = engine if engine else EloEngine(ELO_System.BASE_ELO, ELO_System.EXPECTED_SCORE_CONSTANT, ELO_System.SCALING_CONSTANT)
+		self.duels = duels if duels is not None else [] # List of (date, playerA, scoreA, playerB, scoreB) tuples
+		self.num_score_lists = 0 # how many score lists have been recorded, see iter_score_lists
+		self._duel_count = None # SQLite's duel count, read on first use, see _num_duels
+		self.lock = threading.RLock()
+		self._bulk_players = None # players touched by the bulk() in progress
+		self._head_to_head = None # built from the duel log on first use, see head_to_head
+		self._windows = None # built from the score history on first use, see windowed.py
+		# Cache tag -> version, see cache_versions. Tags are ("player", id), ("elo",), ("event", event) and ("tournament", name)
+		self.versions = {}
+		self.epoch = 0
+		self._build_leaderboards()
+		self._load_tournaments()
+		self._views = {}
+		self._publish(*self.records.keys())
+
+	def _load_tournaments(self):
+		# State files from before named tournaments hold a single bracket
+		if "bracket" in self.tournament_state:
+			self.tournament_state = {"tournaments": {"default": {"bracket": self.tournament_state["bracket"]}}}
+		self.tournament_state.setdefault("tournaments", {})
+		self.tournaments = {}
+		# Player -> names of the tournaments they're in, so a duel result only checks their own tournaments
+		self._player_tournaments = {}
+		for name, state in self.tournament_state["tournaments"].items():
+			self._add_tournament(name, load_tournament(state))
+
+	def _add_tournament(self, name, tournament):
+		# Replaces any tournament with the same name
+		if name in self.tournaments:
+			for player in self.tournaments[name].players():
+				self._player_tournaments[player].pop(name, None)
+		self.tournaments[name] = tournament
+		self.tournament_state["tournaments"][name] = tournament.state
+		for player in tournament.players():
+			# dicts as ordered sets, the oldest tournament gets the result if two have the same match
+			self._player_tournaments.setdefault(player, {})[name] = True
+
+	def _new_player_info(player):
+		return Player(player, elo=ELO_System.BASE_ELO)
 
 	def _init_player(self, player):
-		self.records[player] = {
-			"id":player,
-			"name":"", # only used for tournaments
-			"scores":[], # List of (date, event, score) tuples
-			"best":{},
-			"avg":{},
-			"elo":ELO_System.BASE_ELO,
-			"W":0,
-			"L":0
-		}
+		self.records[player] = ELO_System._new_player_info(player)
+		self.leaderboards[("elo", None)].update(player, ELO_System.BASE_ELO)
+		self._bump(("elo",))
+
+	def _publish(self, *players):
+		'''
+		Publishes copies of the players' records for lock-free readers (see get_info).
+		Called at the end of every mutation with the players it touched, a reader
+		sees either the old or the new copy and never a half-applied mutation.
+		'''
+		if self._bulk_players is not None:
+			self._bulk_players.update(players)
+			return
+		for player in players:
+			info = self.records[player]
+			view = info.fields()
+			view["best"] = dict(info.best)
+			view["avg"] = dict(info.avg)
+			view["totals"] = {event: dict(totals) for event, totals in info.totals.items()}
+			self._views[player] = view
+		self._bump(*[("player", player) for player in players])
+
+	def _bump(self, *tags):
+		# Called after the state the tags cover has changed
+		for tag in tags:
+			self.versions[tag] = self.versions.get(tag, 0) + 1
+
+	def cache_versions(self, *tags):
+		'''
+		Returns the current versions of the tags, for keying cached responses (see cache.py).
+		Doesn't take the lock, read it before reading the state the response is built from.
+		'''
+		return (self.epoch,) + tuple(self.versions.get(tag, 0) for tag in tags)
 
-	def from_json(filepath):
-		state = read_json_file(filepath)
+	def from_storage(storage, engine=None):
+		'''
+		Loads the state kept by storage (see storage.py) and replays any journaled
+		mutations that aren't part of the saved snapshot yet
+		'''
+		state, pending = storage.load()
 		records = state["records"] if "records" in state else {}
 		tournament_state = state["tournament_state"] if "tournament_state" in state else {}
-		return ELO_System(records, tournament_state, filepath)
-
-	def save_to_json(self):
-		state = {
-			"records":	self.records,
-			"tournament_state": self.tournament_state
+		# One-time migration for state files written before totals were tracked
+		missing_totals = any("totals" not in info for info in records.values() if not isinstance(info, Player))
+
+		elo_system = ELO_System(records, tournament_state, duels=state.get("duels", []), engine=engine)
+		elo_system.archive = storage.archive
+		elo_system.archive_generation = state.get("archive_generation", 0)
+		elo_system.num_score_lists = state.get("num_score_lists", 0)
+		if missing_totals:
+			elo_system.rebuild_aggregates()
+
+		for entry in pending:
+			elo_system._apply(entry)
+		elo_system._finish_archiving()
+		elo_system.storage = storage
+		return elo_system
+
+	def from_json(filepath, use_journal=False, engine=None):
+		'''
+		Loads the snapshot at filepath. With use_journal, mutations logged to
+		the journal after the snapshot are replayed on top of it and every
+		later mutation is appended to the journal instead of rewriting the file.
+		'''
+		return ELO_System.from_storage(JSONStorage(filepath, use_journal), engine)
+
+	def to_state(self):
+		return {
+			"records":	{player: info.to_dict() for player, info in self.records.items()},
+			"tournament_state": self.tournament_state,
+			"duels": self.duels,
+			"archive_generation": self.archive_generation,
+			"num_score_lists": self.num_score_lists
 		}
-		write_json_file(state, self.filepath)
 
+	@_locked
+	def save(self):
+		if self.storage:
+			with metrics.SAVE_SECONDS.time(backend=type(self.storage).__name__):
+				self.storage.commit(self)
 
-	def _expectedScore(self, playerA):
-		# return player's expected score -> avg?
-		pass
+	save_to_json = save
 
-	def _update_elo_single_player(self, playerA, scoreA):
-		pass
+	@_locked
+	def checkpoint(self):
+		# Writes a full snapshot now, regardless of the persistence mode
+		if self.storage:
+			self.storage.checkpoint(self)
 
-	def _expectedResult(self, playerA, playerB):
-		# return normalized result for a 1 vs 1 
-		eloA = self.records[playerA]["elo"]
-		eloB = self.records[playerB]["elo"]
-		return 1 / (1 + 10 ** ((eloB - eloA) / ELO_System.EXPECTED_SCORE_CONSTANT))
+	@_locked
+	def close(self):
+		if self.storage:
+			self.storage.close()
 
-	def _update_elo_two_players(self, playerA, scoreA, playerB, scoreB):
-		expected = self._expectedResult(playerA, playerB)
-		actual = int(scoreA) / (int(scoreA) + int(scoreB))
-		elo_delta = ELO_System.SCALING_CONSTANT * (actual - expected)
-
-		self.records[playerA]["elo"] += elo_delta
-		self.records[playerB]["elo"] -= elo_delta
+	@contextmanager
+	def bulk(self):
+		'''
+		Applies many mutations with a single commit at the end, for imports:
 
-		return self.records[playerA]["elo"], self.records[playerB]["elo"], elo_delta
+			with elo_system.bulk():
+				for ...:
+					elo_system.record_scores(event, scores, day)
 
+		Other commands wait until the block is done. JSON state is written as one
+		snapshot at the end instead of being journaled entry by entry, SQLite
+		state as one transaction. Whatever was applied before an exception is
+		still committed, so memory and disk agree.
+		'''
+		with self.lock:
+			self._bulk_players = set()
+			try:
+				yield self
+			finally:
+				players, self._bulk_players = self._bulk_players, None
+				self._publish(*players)
+				self.checkpoint()
+
+	def _log(self, entry):
+		# SQLite writes its rows as entries are logged, the JSON snapshot at the end of a bulk() holds everything
+		if self.storage and (self._bulk_players is None or self.storage.keeps_history):
+			self.storage.append(entry)
+
+	def _apply(self, entry):
+		# Replays a journal entry through the same code path that produced it
+		op = entry["op"]
+		if op == "record_scores":
+			self.record_scores(entry["event"], entry["scores"], entry["date"])
+		elif op == "challenge_match":
+			self.challenge_match(entry["playerA"], entry["scoreA"], entry["playerB"], entry["scoreB"], entry.get("date"))
+		elif op == "start_tournament":
+			self.start_tournament(entry["players"], entry["order"], entry.get("tournament", "default"), entry.get("format", "single"), entry.get("rounds"))
+		elif op == "correct_duel":
+			self.correct_duel(entry["index"], entry["scoreA"], entry["scoreB"], entry.get("date"))
+		elif op == "recompute_ratings":
+			self._recompute(entry["expected_constant"], entry["scaling_constant"], entry.get("date"))
+		elif op == "archive_scores":
+			self._drop_archived_scores(entry["before"], entry["generation"])
+
+	def iter_scores(self, player, with_lists=False):
+		'''
+		Yields the player's (date, event, score) history, oldest first,
+		with the id of the score list as a fourth field if with_lists
+		'''
+		if self.storage and self.storage.keeps_history:
+			yield from self.storage.iter_scores(player, with_lists)
+		else:
+			if self.archive:
+				yield from self.archive.iter_scores(player, with_lists)
+			scores = self.records[player]["scores"]
+			yield from scores.rows_with_lists() if with_lists else scores
 
-	def _update_elo(self, playerA, scoreA, playerB=None, scoreB=None):		
-		if not playerB:
-			return self._update_elo_single_player(playerA, scoreA)
+	def iter_score_lists(self):
+		'''
+		Yields every (date, event, [(player, score)], list id) score list, in the
+		order they were recorded. A list's id is the number of score lists and
+		duels recorded before it, see _next_list_id. Scores recorded before lists
+		were numbered come first, each as a list of its own with the id NO_LIST.
+		Without SQLite a list's players come in the order they first appeared in
+		the league rather than as listed.
+		'''
+		if self.storage and self.storage.keeps_history:
+			yield from self.storage.iter_score_lists()
+			return
+
+		# Scores are kept per player, the lists are gathered from every history before the first is yielded
+		score_lists = {}
+		for player in list(self.records):
+			for day, event, score, list_id in self.iter_scores(player, with_lists=True):
+				if list_id == NO_LIST:
+					yield (day, event, [(player, score)], NO_LIST)
+				else:
+					score_lists.setdefault(list_id, (day, event, [], list_id))[2].append((player, score))
+		for list_id in sorted(score_lists):
+			yield score_lists[list_id]
+
+	def _num_duels(self):
+		if not (self.storage and self.storage.keeps_history):
+			return len(self.duels)
+		if self._duel_count is None:
+			self._duel_count = self.storage.duel_count()
+		return self._duel_count
+
+	def _next_list_id(self):
+		# Lists and duels share one sequence so exports can put them back in the order they were recorded.
+		# Lists numbered before duels were counted get smaller ids and export ahead of every duel.
+		return self.num_score_lists + self._num_duels()
+
+	@_locked
+	def _score_history(self, player):
+		# The player's whole history as a ScoreHistory, archived scores included
+		if (self.storage and self.storage.keeps_history) or (self.archive and self.archive.count(player)):
+			return ScoreHistory(self.iter_scores(player))
+		return self.records[player].scores
+
+	@_locked
+	def get_score_history(self, player, start=0, count=10):
+		'''
+		Returns (rows, total): the player's (date, event, score) rows start through
+		start+count-1 counting from the newest, newest first, and how many there are.
+		Archived rows are only read for the page that needs them.
+		'''
+		if self.storage and self.storage.keeps_history:
+			return self.storage.score_page(player, start, count), self.storage.score_count(player)
+
+		hot = self.records[player]["scores"] if player in self.records else []
+		rows = [tuple(s) for s in reversed(hot[max(len(hot) - start - count, 0):max(len(hot) - start, 0)])]
+		total = len(hot)
+		if self.archive:
+			total += self.archive.count(player)
+			if len(rows) < count:
+				rows += self.archive.page(player, max(start - len(hot), 0), count - len(rows))
+		return rows, total
+
+	@_locked
+	def archive_scores(self, before):
+		'''
+		Moves every score shot before the ISO date before out of records into the
+		archive, leaving the aggregates as they are. Returns how many were moved.
+		'''
+		if not self.archive:
+			raise ValueError("This storage keeps its score history on disk already")
+
+		old_scores = {}
+		for player, info in self.records.items():
+			player_old_scores = [s for s in info["scores"].rows_with_lists() if s[0] < before]
+			if player_old_scores:
+				old_scores[player] = player_old_scores
+		if not old_scores:
+			return 0
+
+		# The archive is written before the entry is logged. If the process stops in
+		# between, _finish_archiving drops the archived scores from records on the next load.
+		generation = self.archive_generation + 1
+		self.archive.add(old_scores, before, generation)
+		self._log({"op": "archive_scores", "before": before, "generation": generation})
+		self._drop_archived_scores(before, generation)
+		return sum(len(player_scores) for player_scores in old_scores.values())
+
+	def _drop_archived_scores(self, before, generation):
+		for player, info in self.records.items():
+			if any(s[0] < before for s in info["scores"]):
+				info["scores"] = [s for s in info["scores"].rows_with_lists() if s[0] >= before]
+				self._publish(player)
+		self.archive_generation = generation
+
+	def _finish_archiving(self):
+		# Drops scores archived by generations that never made it into the state or the journal
+		if not self.archive:
+			return
+		for generation in range(self.archive_generation + 1, self.archive.generation + 1):
+			self._drop_archived_scores(self.archive.archived_before(generation), generation)
+
+	def iter_duels(self):
+		'''
+		Yields every (date, playerA, scoreA, playerB, scoreB) duel, oldest first
+		'''
+		if self.storage and self.storage.keeps_history:
+			yield from self.storage.iter_duels()
 		else:
-			return self._update_elo_two_players(playerA, scoreA, playerB, scoreB)
+			yield from self.duels
 
 
-	def record_scores(self, event, scores):
+	@_locked
+	def record_scores(self, event, scores, day=None):
 		'''
 		Arguemnts:
 		- event: "air", "sport", or "standard"
 		- scores: List of (Slack ID, score) tuples
+		- day: ISO date the scores were shot, defaults to today
 		'''
 		event = event.lower()
-		assert event in ["air", "sport", "standard"]
+		assert event in ELO_System.EVENTS
+		ELO_System._check_scores(*[score for _, score in scores])
+
+		today = day if day else date.today().isoformat()
+		# Exports regroup the scores by their list, see iter_score_lists
+		list_id = self._next_list_id()
+		self.num_score_lists += 1
 
 		records = self.records
 		for s in scores:
 			player, score = s
-			today = date.today().isoformat()
 			if not player in records:
 				self._init_player(player)
-			records[player]["scores"].append((today, event, int(score)))
-
-			# Update stats for the event
-			event_scores = [score_info[2] for score_info in records[player]["scores"] if score_info[1] == event]
-			if event_scores:
-				records[player]["best"][event] = max(event_scores)
-				records[player]["avg"][event] = sum(event_scores)/len(event_scores)
+			if not (self.storage and self.storage.keeps_history):
+				records[player]["scores"].append((today, event, int(score), list_id))
+			self._add_to_aggregates(records[player], event, int(score))
+			if self._windows is not None:
+				self._windows.add(player, today, event, int(score))
+
+		# Multi-player engines rate the list as one free-for-all game
+		rated = self.engine.rate_score_list(records, scores, today)
+		for player in rated:
+			self.leaderboards[("elo", None)].update(player, records[player]["elo"])
+		self._add_rating_points(today, *rated)
+		self._publish(*[player for player, _ in scores])
+		self._bump(("event", event))
+		if rated:
+			self._bump(("elo",))
+		# Logged once applied, an entry that fails halfway must never reach the journal and fail every load after it
+		self._log({"op": "record_scores", "event": event, "scores": scores, "date": today, "list": list_id})
 		return (event, scores)
 
 
-	def challenge_match(self, playerA, scoreA, playerB, scoreB):
+	def _check_scores(*scores):
+		# Before anything is changed, a score the history can't store would fail halfway
+		for score in scores:
+			if int(score) not in SCORE_RANGE:
+				raise ValueError(f"Score {score} is out of range")
+
+
+	def _add_to_aggregates(self, info, event, score):
+		totals = info["totals"].setdefault(event, {"count": 0, "sum": 0, "sum_sq": 0})
+		totals["count"] += 1
+		totals["sum"] += score
+		totals["sum_sq"] += score * score
+
+		if event not in info["best"] or score > info["best"][event]:
+			info["best"][event] = score
+		info["avg"][event] = totals["sum"] / totals["count"]
+
+		self.leaderboards[("best", event)].update(info["id"], info["best"][event])
+		self.leaderboards[("avg", event)].update(info["id"], info["avg"][event])
+
+
+	def _compute_aggregates(self, info):
+		# Recomputes best/avg/totals from the raw score history
+		best, avg, totals = {}, {}, {}
+		for _, event, score in self.iter_scores(info["id"]):
+			event_totals = totals.setdefault(event, {"count": 0, "sum": 0, "sum_sq": 0})
+			event_totals["count"] += 1
+			event_totals["sum"] += score
+			event_totals["sum_sq"] += score * score
+			best[event] = max(best[event], score) if event in best else score
+		for event, event_totals in totals.items():
+			avg[event] = event_totals["sum"] / event_totals["count"]
+		return best, avg, totals
+
+
+	@_locked
+	def rebuild_aggregates(self):
+		for info in self.records.values():
+			info["best"], info["avg"], info["totals"] = self._compute_aggregates(info)
+		self._build_leaderboards()
+		self._publish(*self.records.keys())
+
+
+	def check_aggregates(self):
+		'''
+		Compares the incrementally maintained aggregates against the raw score history.
+		Returns a list of (player, field, stored, expected) mismatches.
+		'''
+		mismatches = []
+		for player, info in self.records.items():
+			expected = dict(zip(["best", "avg", "totals"], self._compute_aggregates(info)))
+			for field, expected_value in expected.items():
+				stored_value = info.get(field)
+				if field == "avg":
+					matches = stored_value is not None and stored_value.keys() == expected_value.keys() \
+						and all(math.isclose(stored_value[e], expected_value[e]) for e in expected_value)
+				else:
+					matches = stored_value == expected_value
+				if not matches:
+					mismatches.append((player, field, stored_value, expected_value))
+		return mismatches
+
+
+	def get_variance(self, player, event):
+		totals = self.records[player]["totals"].get(event)
+		if not totals:
+			return None
+		mean = totals["sum"] / totals["count"]
+		return max(totals["sum_sq"] / totals["count"] - mean * mean, 0)
+
+
+	@_locked
+	def challenge_match(self, playerA, scoreA, playerB, scoreB, day=None):
+		'''
+		Records a duel and rates it.
+		Returns (eloA, eloB, (deltaA, deltaB), tournament name or None), the
+		deltas are the rating changes, equal and opposite with Elo.
+		'''
+		ELO_System._check_scores(scoreA, scoreB)
+		if playerA == playerB:
+			raise ValueError(f"{playerA} can't duel themselves")
+		today = day if day else date.today().isoformat()
+
 		for p in [playerA, playerB]:
 			if p and not p in self.records:
 				self._init_player(p)
+		if not (self.storage and self.storage.keeps_history):
+			self.duels.append((today, playerA, int(scoreA), playerB, int(scoreB)))
+		if self._head_to_head is not None:
+			self._head_to_head.record(playerA, scoreA, playerB, scoreB)
 
-		eloA, eloB, elo_delta = self._update_elo(playerA, scoreA, playerB, scoreB)
+		elo_delta = self.engine.rate_duel(self.records, playerA, scoreA, playerB, scoreB, today)
+		eloA, eloB = self.records[playerA]["elo"], self.records[playerB]["elo"]
+		self.leaderboards[("elo", None)].update(playerA, eloA)
+		self.leaderboards[("elo", None)].update(playerB, eloB)
+		self._add_rating_points(today, playerA, playerB)
 
 		winner_id = winner_score = loser_id = loser_score = None
 		if scoreA > scoreB:
@@ -112,118 +495,249 @@ class ELO_System:
 			self.records[playerB]["W"]+=1
 			self.records[playerA]["L"]+=1
 			winner_id, winner_score, loser_id, loser_score = playerB, scoreB, playerA, scoreA
+		else:
+			# Only Swiss tournaments take draws, see _update_tournament
+			winner_id, winner_score, loser_id, loser_score = playerA, scoreA, playerB, scoreB
 
 		# Check if there's a tournament match between the two players and update bracket if so
 		found_tournament_match = self._update_tournament(winner_id, winner_score, loser_id, loser_score)
 
+		self._publish(playerA, playerB)
+		self._bump(("elo",))
+		if found_tournament_match:
+			self._bump(("tournament", found_tournament_match))
+		# Logged once applied, see record_scores
+		self._log({"op": "challenge_match", "playerA": playerA, "scoreA": scoreA, "playerB": playerB, "scoreB": scoreB, "date": today})
+		if self._duel_count is not None:
+			self._duel_count += 1
 		return eloA, eloB, elo_delta, found_tournament_match
 
 
-	def get_leaderboard(self, event):
-		event = event.lower() if event else None
-		assert event == None or event in ["air", "sport", "standard"] 
+	@_locked
+	def correct_duel(self, index, scoreA, scoreB, day=None):
+		'''
+		Fixes the scores of the index-th logged duel and recomputes every rating from the history.
+		Tournament brackets are left as they are.
+		'''
+		if not self.engine.replays_duel_log:
+			raise ValueError(f"{self.engine.name} ratings can't be recomputed from the duel log")
+		# Checked before logging, an entry that can't be replayed would fail every later load
+		num_duels = self._num_duels()
+		if not 0 <= index < num_duels:
+			raise ValueError(f"There is no duel {index}, {num_duels} duels are logged")
+		ELO_System._check_scores(scoreA, scoreB)
+		today = day if day else date.today().isoformat()
+		# Logged before recomputing, SQLite updates the duel row when the entry is logged
+		self._log({"op": "correct_duel", "index": index, "scoreA": scoreA, "scoreB": scoreB, "date": today})
+		if not (self.storage and self.storage.keeps_history):
+			day, playerA, _, playerB, _ = self.duels[index]
+			self.duels[index] = (day, playerA, int(scoreA), playerB, int(scoreB))
+		self._head_to_head = None
+		# Not logged again, replaying the correct_duel entry recomputes
+		self._recompute(day=today)
+
+
+	@_locked
+	def recompute_ratings(self, expected_constant=None, scaling_constant=None, day=None):
+		'''
+		Replays the whole duel log with the rating engine and replaces every player's rating and W-L.
+		The constants override the Elo ones and are ignored by other engines.
+		Every changed rating is added to the rating history as of day, defaults to today.
+		Returns how well the replayed ratings predicted each duel (see recompute.prediction_stats).
+		'''
+		stats, expected_constant, scaling_constant, today = self._recompute(expected_constant, scaling_constant, day)
+		# Logged once applied, see record_scores
+		self._log({"op": "recompute_ratings", "expected_constant": expected_constant, "scaling_constant": scaling_constant, "date": today})
+		return stats
+
+	def _recompute(self, expected_constant=None, scaling_constant=None, day=None):
+		# recompute_ratings without the journal entry, returns the stats and the constants and date it used
+		engine = self.engine
+		if isinstance(engine, EloEngine):
+			expected_constant = expected_constant or engine.expected_constant
+			scaling_constant = scaling_constant or engine.scaling_constant
+			engine = EloEngine(engine.base_rating, expected_constant, scaling_constant)
+		if not engine.replays_duel_log:
+			raise ValueError(f"{engine.name} ratings can't be recomputed from the duel log")
+
+		duels = list(self.iter_duels())
+		encoded = encode_duels(duels)
+		ratings, states, stats = engine.replay(encoded, [duel[0] for duel in duels])
+		wins, losses = tally(encoded)
+		today = day if day else date.today().isoformat()
+
+		previous = {player: info["elo"] for player, info in self.records.items()}
+		for info in self.records.values():
+			info["elo"], info["rating"], info["W"], info["L"] = ELO_System.BASE_ELO, {}, 0, 0
+		for player, rating, state, player_wins, player_losses in zip(encoded[0].tolist(), ratings.tolist(), states, wins.tolist(), losses.tolist()):
+			if player not in self.records:
+				self._init_player(player)
+			info = self.records[player]
+			info["elo"], info["rating"], info["W"], info["L"] = rating, state, player_wins, player_losses
+		self._add_rating_points(today, *[player for player, info in self.records.items() if info["elo"] != previous.get(player)])
+		# Duels recorded from now on are rated with the new constants too
+		self.engine = engine
+		self._build_leaderboards()
+		self._publish(*self.records.keys())
+		return stats, expected_constant, scaling_constant, today
+
+
+	def _add_rating_points(self, day, *players):
+		for player in players:
+			info = self.records[player]
+			info.history.add(day, info.elo)
+
+
+	@_locked
+	def rating_history(self, player, count=100):
+		'''
+		Returns up to count of the player's newest (date, low, high, last) elo
+		samples, oldest first (see timeseries.py). Takes time in count, not in
+		how many duels the player has played.
+		'''
+		if player not in self.records:
+			return []
+		return self.records[player].history.latest(count)
+
+
+	def _get_head_to_head(self):
+		if self._head_to_head is None:
+			self._head_to_head = HeadToHead.from_duels(self.iter_duels())
+		return self._head_to_head
 
+	@_locked
+	def head_to_head(self, playerA, playerB):
+		'''
+		Returns playerA's record against playerB, see HeadToHead.get
+		'''
+		return self._get_head_to_head().get(playerA, playerB)
+
+	@_locked
+	def rivals(self, player, count=10):
+		'''
+		Returns the player's most frequent opponents and their records, see HeadToHead.rivals
+		'''
+		return self._get_head_to_head().rivals(player, count)
+
+
+	def _build_leaderboards(self):
+		# Sorted indexes per metric and event, kept up to date by every mutation
 		records = self.records
-		
-		by_elo = sorted(records.keys(), key=lambda k: records[k]["elo"], reverse=True)
+		# Everything cached so far was built from the old indexes
+		self.epoch = next(_epochs)
+		self.leaderboards = {("elo", None): LeaderboardIndex({k: v["elo"] for k, v in records.items()})}
+		for event in ELO_System.EVENTS:
+			for metric in ["best", "avg"]:
+				self.leaderboards[(metric, event)] = LeaderboardIndex({k: v[metric][event] for k, v in records.items() if event in v[metric]})
+
+
+	def _get_windows(self):
+		if self._windows is None:
+			self._windows = WindowIndex.from_histories((player, self._score_history(player)) for player in self.records)
+		return self._windows
+
+	@_locked
+	def get_leaderboard(self, event, start=0, end=None, since=None, until=None):
+		'''
+		Returns the (player, value) rows ranked start+1 through end by elo,
+		and by best and average score in the event if one is given.
+		since and until (ISO dates, inclusive) rank best and average by the
+		scores shot in that window only.
+		'''
+		event = event.lower() if event else None
+		assert event == None or event in ELO_System.EVENTS
+		assert event or not (since or until)
+
+		by_elo = self.leaderboards[("elo", None)].page(start, end)
 
 		by_best  = None
 		by_avg = None
-		if event:
-			by_best = sorted(filter(lambda k: event in records[k]["best"], records.keys()), key=lambda k: records[k]["best"][event], reverse=True)
-			by_avg = sorted(filter(lambda k: event in records[k]["avg"], records.keys()), key=lambda k: records[k]["avg"][event], reverse=True)
+		if event and (since or until):
+			by_best, by_avg = self._get_windows().leaderboard(event, since, until)
+			by_best, by_avg = by_best[start:end], by_avg[start:end]
+		elif event:
+			by_best = self.leaderboards[("best", event)].page(start, end)
+			by_avg = self.leaderboards[("avg", event)].page(start, end)
 
 		return by_elo, by_best, by_avg
 
 
+	@_locked
+	def get_rank(self, player, metric="elo", event=None):
+		'''
+		Returns the player's 1-based rank by elo, or by best/avg in an event
+		'''
+		return self.leaderboards[(metric, event.lower() if event else None)].rank(player)
+
+
 	def get_info(self, player):
-		if not player in self.records:
-			self._init_player(player)
-		return self.records[player]
+		'''
+		Returns the player's latest published record without taking the lock.
+		The result is a copy and must not be modified.
+		'''
+		view = self._views.get(player)
+		if view is None:
+			return ELO_System._new_player_info(player)
+		return view
 
 
 	def _update_tournament(self, winner_id, winner_score, loser_id, loser_score):
 		'''
 		Looks for a tournament match with the two players and updates the bracket if found.
-		Returns True if a tournament match is found
+		A draw (equal scores) only counts in Swiss tournaments, elimination matches need a winner.
+		Returns the name of the tournament the match was in, or None
 		'''
-		bracket = self.tournament_state["bracket"]
-
-		# BFS bracket to find a matching match-up with no recorded score
-		queue = [(len(bracket)-1, 0)]
-		while len(queue)>0:
-			round_idx, match_idx = queue.pop(0)
-
-			if round_idx - 1 < 0:
-				continue
-
-			lower_player = bracket[round_idx-1][match_idx*2]
-			upper_player = bracket[round_idx-1][match_idx*2 + 1]
-
-			queue.extend([(round_idx-1, match_idx*2), (round_idx-1, match_idx*2+1)])
-			if not lower_player or not upper_player:
+		draw = winner_score == loser_score
+		# Each format finds the match with a dict lookup on the pair of players
+		for name in self._player_tournaments.get(winner_id, ()):
+			if draw and not isinstance(self.tournaments[name], Swiss):
 				continue
+			if self.tournaments[name].record_result(winner_id, winner_score, loser_id, loser_score):
+				return name
+		return None
 
-			if lower_player["id"] == winner_id and upper_player["id"] == loser_id and not upper_player["score"] and not lower_player["score"]:
-				lower_player["score"] = winner_score
-				upper_player["score"] = loser_score
-				bracket[round_idx][match_idx] = {"id": winner_id, "score": None}
-				return True
-			elif lower_player["id"] == loser_id and upper_player["id"] == winner_id and not upper_player["score"] and not lower_player["score"]:
-				lower_player["score"] = loser_score
-				upper_player["score"] = winner_score
-				bracket[round_idx][match_idx] = {"id": winner_id, "score": None}
-				return True
-
-		return False
 
-
-	def start_tournament(self, players):
-		num_players = len(players)
-		num_rounds = math.ceil(math.log2(num_players) + 1)
+	@_locked
+	def start_tournament(self, players, order=None, name="default", format="single", rounds=None):
+		'''
+		Arguments:
+		- players: List of (Slack ID, name) tuples
+		- order: Bracket order of the Slack IDs for "single", shuffled randomly if not given.
+		  Seeds (best first) for the other formats, by elo if not given
+		- name: Tournament name, starting a tournament replaces any running one with the same name
+		- format: "single", "seeded", "double" or "swiss", see tournament.py
+		- rounds: Number of Swiss rounds, enough for a single unbeaten player if not given
+		'''
+		if format not in TOURNAMENT_FORMATS:
+			raise ValueError(f"Unknown tournament format {format}")
+		# A player listed twice would be paired against themselves
+		players = list(dict(players).items())
+		if format != "single" and len(players) < 2:
+			raise ValueError(f"A {format} tournament needs at least 2 players")
 
 		# initialize player info and store names
 		id_list = []
 		for p in players:
-			slack_id, name = p
+			slack_id, player_name = p
 			if slack_id not in self.records:
 				self._init_player(slack_id)
-			self.records[slack_id]["name"] = name
+			self.records[slack_id]["name"] = player_name
 			id_list.append(slack_id)
 
-		random.shuffle(id_list)
-
-		# bfs down bracket and split players evenly to create bracket with byes
-		# bracket is list of (player_id, score) where adjacent players 2i and 2i+1 are matched up
-		bracket = [[None] * (2 ** r) for r in range(num_rounds-1, -1, -1)]
-		queue = [(num_rounds-1, num_players, 0, 0)]
-		while len(queue) > 0:
-			round_idx, remaining_players, player_idx, bracket_idx = queue.pop(0)
-
-			if remaining_players == 1:
-				bracket[round_idx][bracket_idx] = {"id": id_list[player_idx], "score": None}
-				continue
-
-			num_players_to_bot = math.floor(remaining_players/2)
-			queue.append((round_idx-1, remaining_players - num_players_to_bot, num_players_to_bot + player_idx, 2 * bracket_idx + 1))
-			queue.append((round_idx-1, num_players_to_bot,                     player_idx,                      2 * bracket_idx))
-
-		self.tournament_state["bracket"] = bracket
-
-
-	def get_tournament_bracket(self):
-		output_bracket = []
-
-		bracket = self.tournament_state["bracket"]
-		for r in range(len(bracket)):
-			output_bracket.append([])
-			for p in range(len(bracket[r])):
-				if not bracket[r][p]:
-					output_bracket[r].append((None, None))
-				else:
-					player_id = bracket[r][p]["id"]
-					output_bracket[r].append((self.records[player_id]["name"], bracket[r][p]["score"]))
-		return output_bracket
+		if order:
+			id_list = list(dict.fromkeys(order))
+		elif format == "single":
+			random.shuffle(id_list)
+		else:
+			id_list.sort(key=lambda player: (-self.records[player].elo, player))
 
+		self._add_tournament(name, create_tournament(format, id_list, rounds))
+		self._publish(*id_list)
+		self._bump(("tournament", name))
+		# Logged once applied, see record_scores
+		self._log({"op": "start_tournament", "players": players, "order": id_list, "tournament": name, "format": format, "rounds": rounds})
 
 
+	@_locked
+	def get_tournament_bracket(self, name="default"):
+		return self.tournaments[name].to_matrix(self.records)
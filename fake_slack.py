@@ -0,0 +1,107 @@
+import sys
+import json
+import time
+import threading
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class FakeSlackServer:
+    '''
+    Local stand-in for the Slack Web API endpoints the bot uses, for running
+    SlackClient offline. Every rate_limit_every-th call answers 429 with a
+    Retry-After header. Received calls are kept in calls as (path, body) tuples.
+
+    Use as a context manager and point the client at server.url:
+
+        with FakeSlackServer() as server:
+            client = SlackClient("xoxb-test", base_url=server.url)
+    '''
+
+    def __init__(self, rate_limit_every=0, retry_after=0, latency=0.0):
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.latency = latency
+        self.calls = []
+        self._lock = threading.Lock()
+        self._num_requests = 0
+        self._num_files = 0
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}/api"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def calls_to(self, path):
+        return [body for call_path, body in self.calls if call_path == path]
+
+    def _respond(self, path, body):
+        with self._lock:
+            self._num_requests += 1
+            if self.rate_limit_every and self._num_requests % self.rate_limit_every == 0:
+                return 429, {"ok": False, "error": "ratelimited"}
+            self.calls.append((path, body))
+
+            if path == "/api/files.getUploadURLExternal":
+                self._num_files += 1
+                host, port = self._httpd.server_address
+                return 200, {"ok": True, "upload_url": f"http://{host}:{port}/upload/F{self._num_files}", "file_id": f"F{self._num_files}"}
+            if path == "/api/files.info":
+                file_id = parse_qs(body.decode()).get("file", [""])[0]
+                return 200, {"ok": True, "file": {"id": file_id, "permalink": f"https://fake.slack.com/files/{file_id}"}}
+        return 200, {"ok": True}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length)
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    body = json.loads(body)
+
+                if server.latency:
+                    time.sleep(server.latency)
+                status, payload = server._respond(self.path, body)
+
+                response = json.dumps(payload).encode()
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", str(server.retry_after))
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def load_test(num_calls=1000, num_workers=4, rate_limit_every=50):
+    from slack_client import SlackClient
+
+    with FakeSlackServer(rate_limit_every=rate_limit_every) as server:
+        client = SlackClient("xoxb-test", base_url=server.url, num_workers=num_workers)
+        start = time.perf_counter()
+        for i in range(num_calls):
+            client.send_message("C123", f"message {i}")
+        client.join()
+        elapsed = time.perf_counter() - start
+        client.close()
+
+        delivered = len(server.calls_to("/api/chat.postMessage"))
+        print(f"{delivered}/{num_calls} messages in {elapsed:.2f}s ({num_calls / elapsed:.0f} calls/s)")
+
+
+if __name__ == "__main__":
+    load_test(*map(int, sys.argv[1:]))
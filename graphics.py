@@ -1,5 +1,20 @@
+import os
+import re
+import json
+import time
+import hashlib
 import textwrap
-import matplotlib.pyplot as plt
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import metrics
+
+
+# Whitespace textwrap would replace with spaces
+_WRAP_WHITESPACE = re.compile(r'[\t\n\x0b\x0c\r]')
 
 
 def matrix_to_ascii_table(matrix):
@@ -18,7 +33,11 @@ def matrix_to_ascii_table(matrix):
 
     def wrap_row(row):
         """Wraps each cell in the row to its column width"""
-        wrapped_cells = [textwrap.wrap(str(cell), width=col_widths[i]) or [''] for i, cell in enumerate(row)]
+        cells = [str(cell) for cell in row]
+        # No cell is wider than its column, so textwrap only changes cells with surrounding or special whitespace
+        if all(cell == cell.strip() and not _WRAP_WHITESPACE.search(cell) for cell in cells):
+            return ['|' + '|'.join(f' {cell.ljust(col_widths[i])} ' for i, cell in enumerate(cells)) + '|']
+        wrapped_cells = [textwrap.wrap(cell, width=col_widths[i]) or [''] for i, cell in enumerate(cells)]
         max_lines = max(len(lines) for lines in wrapped_cells)
         wrapped_rows = []
         for line_idx in range(max_lines):
@@ -43,7 +62,63 @@ def matrix_to_ascii_table(matrix):
     return '\n'.join(lines)
 
 
-def generate_bracket_image(players_matrix, filename):
+def _pyplot():
+    # matplotlib is only imported once something is drawn with it, the Pillow renderer never pays for it
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def _bracket_geometry(players_matrix, spacing_x=1.0, spacing_y=1.0):
+    '''
+    Computes the bracket lines and labels in data coordinates (y pointing up).
+    Returns (segments, labels, text_padding_y) where segments is an (n, 2, 2)
+    array of line endpoints and labels a list of (x, y, player, score) with
+    the bottom-left corner of each slot.
+    '''
+    num_players = len(players_matrix[0])
+    rounds = num_players.bit_length()
+    text_padding_y = 0.03 * (2 ** (rounds-2))
+
+    segments = []
+    labels = []
+    for r in range(rounds):
+        players_in_round = num_players // (2**r)
+        p = np.arange(players_in_round)
+        x = spacing_x * r
+        # joint y of the pth match in round r, the midpoint of the two matches feeding it
+        y = (2.0**(r-1) - 1) * spacing_y + p * 2**r * spacing_y + spacing_y/2
+
+        # First round byes aren't drawn
+        drawn = np.ones(players_in_round, dtype=bool)
+        if r == 0:
+            drawn = np.array([slot[0] is not None for slot in players_matrix[0]], dtype=bool)
+        p, y = p[drawn], y[drawn]
+
+        # Horizontal line per player plus a vertical connector to the next round (unless it's the last round)
+        horizontal = np.empty((len(p), 2, 2))
+        horizontal[:, :, 0] = [x, x + spacing_x]
+        horizontal[:, :, 1] = y[:, None]
+        segments.append(horizontal)
+        if r != rounds-1:
+            vertical_line_direction = np.where(p % 2 == 0, 1, -1)
+            vertical = np.empty((len(p), 2, 2))
+            vertical[:, :, 0] = x + spacing_x
+            vertical[:, 0, 1] = y
+            vertical[:, 1, 1] = y + vertical_line_direction * spacing_y/2 * 2**r
+            segments.append(vertical)
+
+        if len(players_matrix) > r:
+            for idx, y_pos in zip(p.tolist(), y.tolist()):
+                player, score = players_matrix[r][idx]
+                if player or score:
+                    labels.append((x, y_pos, player if player else "", str(score) if score else ""))
+
+    return np.concatenate(segments), labels, text_padding_y
+
+
+def generate_bracket_image(players_matrix, filename, renderer="matplotlib"):
     '''
     Accepts a matrix of teams to write into the bracket where
     players_matrix[r][p] is the pth (player, score) in round r.
@@ -56,43 +131,247 @@ def generate_bracket_image(players_matrix, filename):
         [("A", None), ("G", None)], 
         [("A", None)]
     ]
+
+    renderer is "matplotlib" or "pillow", which draws the same bracket without importing matplotlib.
+    Double elimination and Swiss tournaments (a dict from their to_matrix, see
+    tournament.py) are always drawn with Pillow.
     '''
+    if isinstance(players_matrix, dict):
+        return generate_format_image(players_matrix, filename)
+    if renderer == "pillow":
+        return generate_bracket_image_pillow(players_matrix, filename)
+
+    from matplotlib.collections import LineCollection
+    plt = _pyplot()
+
+    segments, labels, text_padding_y = _bracket_geometry(players_matrix)
 
     fig, ax = plt.subplots(figsize=(12, 6))
     ax.axis("off")
 
-    num_players = len(players_matrix[0])
-    rounds = num_players.bit_length()
-    spacing_x = 1.0
-    spacing_y = 1.0
-    text_padding_y = 0.03 * (2 ** (rounds-2))
+    # One artist for every line in the bracket
+    ax.add_collection(LineCollection(segments, colors="k"))
+    ax.autoscale_view()
 
+    for x, y, player, score in labels:
+        if player:
+            ax.text(x + 0.05, y + text_padding_y, player, ha="left", va="center", fontsize=10)
+        if score:
+            ax.text(x + 1.0 - 0.05, y + text_padding_y, score, ha="right", va="center", fontsize=10)
 
-    # joint_ys[r][m] = the y coord of the mth match in the rth round
-    joint_ys = []
-    for r in range(rounds):
-        players_in_round = num_players // (2**r)
-        joint_ys.append([])
-        for p in range(players_in_round):
-            # joint_ys[r].append((joint_ys[r-1][2*p] + joint_ys[r-1][2*p+1]) / 2)
-            joint_ys[r].append((2**(r-1) - 1) * spacing_y + p * 2**r * spacing_y + spacing_y/2)
-
-            x = spacing_x * r
-            y = joint_ys[r][p]
-
-            if r == 0 and players_matrix[r][p][0] == None:
-                # If it's a first round bye, don't draw anything
-                continue
-            
-            # For a given player, draw its horizontal line and a vertical connector to the next round (unless it's the last round)
-            ax.plot([x, x+spacing_x], [y, y], "k-")
-            if r != rounds-1:
-                vertical_line_direction = 1 if p % 2 == 0 else -1
-                ax.plot([x + spacing_x, x + spacing_x], [y, y + vertical_line_direction * spacing_y/2 * 2**r], "k-")
-
-            if len(players_matrix) > r:
-                player, score = players_matrix[r][p]
-                ax.text(x + 0.05, y + text_padding_y, player if player else "", ha="left", va="center", fontsize=10)
-                ax.text(x + spacing_x - 0.05, y + text_padding_y, str(score) if score else "", ha="right", va="center", fontsize=10)
-
-    plt.savefig(filename, bbox_inches='tight')
+    fig.savefig(filename, bbox_inches='tight')
+    plt.close(fig)
+
+
+def generate_bracket_image_pillow(players_matrix, filename, round_width=160, slot_height=24, margin=20):
+    '''
+    Draws the same bracket as generate_bracket_image straight onto a Pillow image.
+    round_width and slot_height are the pixel sizes of one round and of one first round slot.
+    '''
+    _draw_bracket_pillow(players_matrix, round_width, slot_height, margin).save(filename, compress_level=1)
+
+
+def _draw_bracket_pillow(players_matrix, round_width=160, slot_height=24, margin=20):
+    segments, labels, _ = _bracket_geometry(players_matrix)
+
+    max_y = max(segments[:, :, 1].max(), 1.0)
+    width = int(segments[:, :, 0].max() * round_width) + 2 * margin
+    height = int(max_y * slot_height) + 2 * margin
+
+    # Data coordinates have y pointing up, image rows go down
+    pixels = np.empty_like(segments)
+    pixels[:, :, 0] = segments[:, :, 0] * round_width + margin
+    pixels[:, :, 1] = (max_y - segments[:, :, 1]) * slot_height + margin
+
+    image = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for line in pixels.round().astype(int).tolist():
+        draw.line([tuple(line[0]), tuple(line[1])], fill=0)
+
+    font = ImageFont.load_default()
+    for x, y, player, score in labels:
+        px = x * round_width + margin
+        py = (max_y - y) * slot_height + margin - 2
+        if player:
+            top = draw.textbbox((0, 0), player, font=font)[3]
+            draw.text((px + 4, py - top), player, fill=0, font=font)
+        if score:
+            left, _, right, bottom = draw.textbbox((0, 0), score, font=font)
+            draw.text((px + round_width - 4 - (right - left), py - bottom), score, fill=0, font=font)
+
+    return image
+
+
+def _draw_match_columns(columns, column_width=170, row_height=14, margin=20):
+    '''
+    Draws columns side by side, each a (heading, boxes) pair where a box is a
+    list of (label, value) rows, drawn with the label on the left and the
+    value on the right like a bracket slot
+    '''
+    font = ImageFont.load_default()
+    box_gap = row_height // 2
+    heights = [row_height + sum(len(box) * row_height + 4 + box_gap for box in boxes) for _, boxes in columns]
+    image = Image.new("L", (len(columns) * column_width + 2 * margin, max(heights, default=0) + 2 * margin), 255)
+    draw = ImageDraw.Draw(image)
+
+    for idx, (heading, boxes) in enumerate(columns):
+        x = margin + idx * column_width
+        draw.text((x, margin), heading, fill=0, font=font)
+        y = margin + row_height + box_gap
+        for box in boxes:
+            draw.rectangle([x, y, x + column_width - 10, y + len(box) * row_height + 4], outline=0)
+            for label, value in box:
+                label, value = str(label) if label is not None else "", str(value) if value is not None else ""
+                draw.text((x + 4, y + 2), label, fill=0, font=font)
+                left, _, right, _ = draw.textbbox((0, 0), value, font=font)
+                draw.text((x + column_width - 14 - (right - left), y + 2), value, fill=0, font=font)
+                y += row_height
+            y += 4 + box_gap
+    return image
+
+
+def generate_format_image(bracket, filename):
+    '''
+    Draws a double elimination or Swiss tournament from its to_matrix dict.
+    Double elimination is the winners bracket above the losers bracket rounds
+    and the final, Swiss is one column of pairings per round and the standings.
+    '''
+    if bracket["format"] == "double":
+        columns = [(f"Losers round {idx + 1}", matches) for idx, matches in enumerate(bracket["losers"])]
+        columns.append(("Final", [bracket["final"]]))
+        if bracket["champion"]:
+            columns.append(("Champion", [[(bracket["champion"], None)]]))
+        parts = [_draw_bracket_pillow(bracket["winners"]), _draw_match_columns(columns)]
+    else:
+        columns = [(f"Round {idx + 1}", matches) for idx, matches in enumerate(bracket["rounds"])]
+        standings = [(f"{rank}. {name}", f"{points:g}") for rank, (name, points) in enumerate(bracket["standings"], 1)]
+        columns.append((f"Standings, round {len(bracket['rounds'])}/{bracket['num_rounds']}", [standings]))
+        parts = [_draw_match_columns(columns)]
+
+    image = Image.new("L", (max(part.width for part in parts), sum(part.height for part in parts)), 255)
+    y = 0
+    for part in parts:
+        image.paste(part, (0, y))
+        y += part.height
+    image.save(filename, compress_level=1)
+
+
+def _render_bracket_to(players_matrix, filepath, renderer):
+    # Render next to the destination and rename so readers never see a partial file
+    tmp_filepath = f"{filepath[:-len('.png')]}.{os.getpid()}.tmp.png"
+    generate_bracket_image(players_matrix, tmp_filepath, renderer)
+    os.replace(tmp_filepath, filepath)
+    return filepath
+
+
+def _warm_up_worker(renderer):
+    # Pay for the matplotlib font cache and backend setup before the first render
+    if renderer == "matplotlib":
+        plt = _pyplot()
+        fig, ax = plt.subplots()
+        plt.close(fig)
+
+
+class BracketRenderer:
+    '''
+    Renders bracket images in worker processes, off the request thread.
+    Images are cached by a hash of the bracket contents, so rendering the
+    same bracket again costs nothing and concurrent renders of different
+    brackets never share a file.
+    '''
+
+    def __init__(self, cache_dir="brackets", num_workers=1, renderer="matplotlib"):
+        self.cache_dir = cache_dir
+        self.renderer = renderer
+        os.makedirs(cache_dir, exist_ok=True)
+        self._pool = ProcessPoolExecutor(max_workers=num_workers, initializer=_warm_up_worker, initargs=(renderer,))
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def path_for(self, players_matrix):
+        digest = hashlib.sha256(json.dumps([self.renderer, players_matrix]).encode()).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"bracket-{digest}.png")
+
+    def render(self, players_matrix):
+        '''
+        Returns a Future resolving to the path of the rendered image
+        '''
+        start = time.perf_counter()
+        filepath = self.path_for(players_matrix)
+        with self._lock:
+            if filepath in self._in_flight:
+                return self._in_flight[filepath]
+            if os.path.exists(filepath):
+                future = Future()
+                future.set_result(filepath)
+                metrics.BRACKET_RENDER_SECONDS.observe(time.perf_counter() - start, renderer=self.renderer, cached="true")
+                return future
+
+            future = self._pool.submit(_render_bracket_to, players_matrix, filepath, self.renderer)
+            self._in_flight[filepath] = future
+        future.add_done_callback(lambda _: self._finish(filepath, start))
+        return future
+
+    def _finish(self, filepath, start):
+        metrics.BRACKET_RENDER_SECONDS.observe(time.perf_counter() - start, renderer=self.renderer, cached="false")
+        with self._lock:
+            self._in_flight.pop(filepath, None)
+
+    def close(self):
+        self._pool.shutdown()
+
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline_text(values):
+    # One block character per value, scaled between the lowest and the highest
+    low, high = min(values), max(values)
+    span = (high - low) or 1
+    return "".join(SPARK_CHARS[round((value - low) / span * (len(SPARK_CHARS) - 1))] for value in values)
+
+
+def generate_sparkline_image(samples, filename, width=360, height=80, margin=8):
+    '''
+    Draws (date, low, high, last) samples (see ELO_System.rating_history) as a
+    line through the last values over a band spanning low to high, with the
+    highest and lowest values labelled.
+    '''
+    low = min(sample[1] for sample in samples)
+    high = max(sample[2] for sample in samples)
+    span = (high - low) or 1
+    step = (width - 2 * margin) / max(len(samples) - 1, 1)
+    x = lambda k: margin + k * step
+    y = lambda value: height - margin - (value - low) / span * (height - 2 * margin)
+
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for k, (_, sample_low, sample_high, _) in enumerate(samples):
+        if sample_low != sample_high:
+            draw.line([(x(k), y(sample_high)), (x(k), y(sample_low))], fill=(200, 216, 240), width=max(int(step), 1))
+    line = [(x(k), y(sample[3])) for k, sample in enumerate(samples)]
+    draw.line(line if len(line) > 1 else line * 2, fill=(38, 92, 170), width=2)
+    last_x, last_y = line[-1]
+    draw.ellipse([last_x - 3, last_y - 3, last_x + 3, last_y + 3], fill=(38, 92, 170))
+
+    font = ImageFont.load_default()
+    draw.text((2, 0), str(round(high)), fill=(110, 110, 110), font=font)
+    bottom = draw.textbbox((0, 0), str(round(low)), font=font)[3]
+    draw.text((2, height - bottom - 1), str(round(low)), fill=(110, 110, 110), font=font)
+    image.save(filename, compress_level=1)
+
+
+def render_sparkline(samples, cache_dir="graphs"):
+    '''
+    Returns the path of a sparkline image of samples. Images are cached by a
+    hash of the samples, so an unchanged history is only drawn once.
+    '''
+    digest = hashlib.sha256(json.dumps(samples).encode()).hexdigest()[:16]
+    filepath = os.path.join(cache_dir, f"sparkline-{digest}.png")
+    if not os.path.exists(filepath):
+        os.makedirs(cache_dir, exist_ok=True)
+        # Render next to the destination and rename so readers never see a partial file
+        tmp_filepath = f"{filepath[:-len('.png')]}.{os.getpid()}.{threading.get_ident()}.tmp.png"
+        generate_sparkline_image(samples, tmp_filepath)
+        os.replace(tmp_filepath, filepath)
+    return filepath
@@ -0,0 +1,74 @@
+import numpy as np
+
+from recompute import encode_duels
+
+
+class HeadToHead:
+    '''
+    Sparse player x player matrix of duel results, derived from the duel log.
+    Each player has a row {opponent: [wins, losses, draws, margin]} holding
+    only the opponents they've met, margin being the summed score difference
+    from the player's side. Recording a duel and looking up a matchup are O(1).
+    '''
+
+    def __init__(self, rows=None):
+        self.rows = rows if rows is not None else {}
+
+    def record(self, playerA, scoreA, playerB, scoreB):
+        # Self-duels are refused when recorded, older logs may still hold some
+        if playerA == playerB:
+            return
+        scoreA, scoreB = int(scoreA), int(scoreB)
+        for player, opponent, mine, theirs in [(playerA, playerB, scoreA, scoreB), (playerB, playerA, scoreB, scoreA)]:
+            entry = self.rows.setdefault(player, {}).setdefault(opponent, [0, 0, 0, 0])
+            entry[0 if mine > theirs else 1 if mine < theirs else 2] += 1
+            entry[3] += mine - theirs
+
+    def from_duels(duels):
+        '''
+        Builds the matrix from (date, playerA, scoreA, playerB, scoreB) duels in one
+        vectorized pass: every duel is counted from both sides, keyed by the pair's
+        flat index, and summed per pair with bincount.
+        '''
+        player_ids, a_idx, b_idx, score_a, score_b = encode_duels(duels)
+        distinct = a_idx != b_idx
+        a_idx, b_idx, score_a, score_b = a_idx[distinct], b_idx[distinct], score_a[distinct], score_b[distinct]
+        if not len(a_idx):
+            return HeadToHead()
+
+        num_players = len(player_ids)
+        me, opponent = np.concatenate([a_idx, b_idx]), np.concatenate([b_idx, a_idx])
+        mine, theirs = np.concatenate([score_a, score_b]), np.concatenate([score_b, score_a])
+        pairs, pair_idx = np.unique(me * num_players + opponent, return_inverse=True)
+        columns = [
+            np.bincount(pair_idx, weights=mine > theirs),
+            np.bincount(pair_idx, weights=mine < theirs),
+            np.bincount(pair_idx, weights=mine == theirs),
+            np.bincount(pair_idx, weights=mine - theirs)
+        ]
+
+        rows = {}
+        player_ids = player_ids.tolist()
+        for pair, wins, losses, draws, margin in zip(pairs.tolist(), *[column.astype(np.int64).tolist() for column in columns]):
+            player, opponent = divmod(pair, num_players)
+            rows.setdefault(player_ids[player], {})[player_ids[opponent]] = [wins, losses, draws, margin]
+        return HeadToHead(rows)
+
+    def get(self, player, opponent):
+        '''
+        Returns the player's record against the opponent as
+        {"wins", "losses", "draws", "duels", "margin"}, margin being the average
+        score difference per duel
+        '''
+        wins, losses, draws, margin = self.rows.get(player, {}).get(opponent, [0, 0, 0, 0])
+        duels = wins + losses + draws
+        return {"wins": wins, "losses": losses, "draws": draws, "duels": duels, "margin": margin / duels if duels else 0.0}
+
+    def rivals(self, player, count=10):
+        '''
+        Returns the player's most frequent opponents as (opponent, record) rows,
+        records as in get, closest matchups first among equally frequent ones
+        '''
+        row = self.rows.get(player, {})
+        ranked = sorted(row, key=lambda opponent: (-sum(row[opponent][:3]), abs(row[opponent][0] - row[opponent][1]), opponent))
+        return [(opponent, self.get(player, opponent)) for opponent in ranked[:count]]
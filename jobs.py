@@ -0,0 +1,120 @@
+import time
+import queue
+import threading
+from collections import deque
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    '''
+    Runs slash commands on a pool of worker threads after the request has
+    been acknowledged.
+
+    Each job lists ordering keys, e.g. the players and tournament it touches.
+    Jobs sharing a key run one at a time in the order they were submitted,
+    jobs with no key in common run in parallel. At most max_pending jobs can
+    be waiting or running, submit raises QueueFull past that.
+    '''
+
+    def __init__(self, num_workers=4, max_pending=256):
+        self.max_pending = max_pending
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._waiting = {} # key -> deque of the jobs holding or waiting for it, oldest first
+        self._num_pending = 0
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def __len__(self):
+        return self._num_pending
+
+    def submit(self, fn, *args, keys=()):
+        job = (fn, args, tuple(set(keys)))
+        with self._lock:
+            if self._num_pending >= self.max_pending:
+                raise QueueFull(f"{self._num_pending} jobs already pending")
+            self._num_pending += 1
+            for key in job[2]:
+                self._waiting.setdefault(key, deque()).append(job)
+            if self._is_runnable(job):
+                self._ready.put(job)
+
+    def _is_runnable(self, job):
+        # A job runs once it's the oldest job for every one of its keys
+        return all(self._waiting[key][0] is job for key in job[2])
+
+    def _work(self):
+        while True:
+            job = self._ready.get()
+            if job is None:
+                return
+            fn, args, keys = job
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Job {fn.__name__} failed:", repr(e))
+            finally:
+                self._finish(job)
+
+    def _finish(self, job):
+        with self._lock:
+            # A job sharing several keys with this one is only considered once
+            next_jobs = {}
+            for key in job[2]:
+                waiting = self._waiting[key]
+                waiting.popleft()
+                if waiting:
+                    next_jobs[id(waiting[0])] = waiting[0]
+                else:
+                    del self._waiting[key]
+            for next_job in next_jobs.values():
+                if self._is_runnable(next_job):
+                    self._ready.put(next_job)
+            self._num_pending -= 1
+            if self._num_pending == 0:
+                self._idle.notify_all()
+
+    def join(self):
+        # Blocks until every submitted job has finished
+        with self._lock:
+            while self._num_pending:
+                self._idle.wait()
+
+    def close(self):
+        self.join()
+        for _ in self._workers:
+            self._ready.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+class RateLimiter:
+    '''
+    Token bucket per key (a Slack user): up to burst commands at once,
+    refilled at rate commands per second.
+    '''
+
+    def __init__(self, rate=0.5, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {} # key -> (tokens, last refill)
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            # Full buckets carry no information, dropping them keeps memory bounded by active users
+            if len(self._buckets) > 10000:
+                self._buckets = {k: v for k, v in self._buckets.items() if v[0] + (now - v[1]) * self.rate < self.burst}
+            return True
@@ -0,0 +1,112 @@
+import os
+import json
+import time
+
+
+class Journal:
+    '''
+    Append-only log of state mutations kept next to a JSON snapshot.
+
+    Every mutation is appended as one JSON line tagged with an increasing
+    sequence number. Lines are flushed on every commit but only fsynced in
+    batches, and once enough entries pile up the caller folds them into a new
+    snapshot (see compact). The snapshot records the last sequence number it
+    contains so entries already folded in are skipped on replay.
+    '''
+
+    def __init__(self, snapshot_filepath, snapshot_seq=0, fsync_every=16, fsync_interval=1.0, compact_every=1000):
+        self.snapshot_filepath = snapshot_filepath
+        self.filepath = f"{snapshot_filepath}.journal"
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+
+        self.seq = snapshot_seq
+        self.snapshot_seq = snapshot_seq
+        self._pending = self._read_pending()
+        if self._pending:
+            self.seq = self._pending[-1]["seq"]
+
+        self._file = open(self.filepath, 'a')
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _read_pending(self):
+        if not os.path.exists(self.filepath):
+            return []
+
+        entries = []
+        good_offset = 0
+        with open(self.filepath, 'rb') as f:
+            for line in f:
+                try:
+                    # A line without its newline was cut short too, even if it parses
+                    if not line.endswith(b"\n"):
+                        raise ValueError("torn line")
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append, nothing after it was committed
+                    break
+                good_offset += len(line)
+                if entry["seq"] > self.snapshot_seq:
+                    entries.append(entry)
+
+        # Cut the torn tail off, new entries must not be appended onto it
+        if good_offset < os.path.getsize(self.filepath):
+            with open(self.filepath, 'r+b') as f:
+                f.truncate(good_offset)
+                f.flush()
+                os.fsync(f.fileno())
+        return entries
+
+    def replay_entries(self):
+        '''
+        Returns the entries written after the snapshot, in order.
+        Only meaningful right after construction.
+        '''
+        entries = self._pending
+        self._pending = []
+        return entries
+
+    def append(self, entry):
+        self.seq += 1
+        entry = dict(entry, seq=self.seq)
+        self._file.write(json.dumps(entry, separators=(',', ':')) + "\n")
+        self._unsynced += 1
+
+    def commit(self):
+        '''
+        Hands appended entries to the OS and fsyncs once a batch is full
+        or the last fsync is older than fsync_interval.
+        '''
+        self._file.flush()
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def needs_compaction(self):
+        return self.seq - self.snapshot_seq >= self.compact_every
+
+    def compact(self, write_snapshot):
+        '''
+        write_snapshot(seq) must atomically write a snapshot containing every
+        entry up to seq. The journal is truncated afterwards; if we crash in
+        between, replay skips the entries the snapshot already holds.
+        '''
+        self.sync()
+        write_snapshot(self.seq)
+        self.snapshot_seq = self.seq
+
+        self._file.close()
+        self._file = open(self.filepath, 'w')
+        self.sync()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
@@ -0,0 +1,46 @@
+from sortedcontainers import SortedList
+
+
+class LeaderboardIndex:
+    '''
+    Players kept sorted by one metric, highest first.
+    Updates and rank lookups are O(log n), reading k rows is O(log n + k).
+    Ties are broken by player id.
+    '''
+
+    def __init__(self, values=None):
+        self._values = dict(values) if values else {}
+        self._entries = SortedList((-value, player) for player, value in self._values.items())
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, player):
+        return player in self._values
+
+    def update(self, player, value):
+        old_value = self._values.get(player)
+        if old_value == value and player in self._values:
+            return
+        if player in self._values:
+            self._entries.remove((-old_value, player))
+        self._values[player] = value
+        self._entries.add((-value, player))
+
+    def remove(self, player):
+        if player in self._values:
+            self._entries.remove((-self._values.pop(player), player))
+
+    def page(self, start=0, end=None):
+        '''
+        Returns the (player, value) rows ranked start+1 through end
+        '''
+        return [(player, -neg_value) for neg_value, player in self._entries.islice(start, end)]
+
+    def rank(self, player):
+        '''
+        Returns the 1-based rank of player or None if they aren't ranked
+        '''
+        if player not in self._values:
+            return None
+        return self._entries.bisect_left((-self._values[player], player)) + 1
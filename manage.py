@@ -0,0 +1,207 @@
+import os
+import sys
+import argparse
+import itertools
+from datetime import date, timedelta
+
+import bulk
+from elo_system import ELO_System
+from ratings import ENGINES, make_engine
+from recompute import what_if
+from storage import JSONStorage, SQLiteStorage, open_storage
+
+
+def load(state_path, rating_engine="elo"):
+    # .db files are SQLite databases, anything else a snapshot (JSON or binary) with its journal
+    backend = "sqlite" if state_path.endswith(".db") else "journal"
+    return ELO_System.from_storage(open_storage(backend, state_path), make_engine(rating_engine))
+
+
+def rebuild_stats(args):
+    elo_system = load(args.state, args.rating_engine)
+    elo_system.rebuild_aggregates()
+    elo_system.checkpoint()
+    elo_system.close()
+    print(f"Rebuilt stats for {len(elo_system.records)} players")
+
+
+def check_stats(args):
+    elo_system = load(args.state, args.rating_engine)
+    mismatches = elo_system.check_aggregates()
+    elo_system.close()
+    for player, field, stored, expected in mismatches:
+        print(f"{player} {field}: stored {stored}, expected {expected}")
+    print(f"{len(mismatches)} mismatches in {len(elo_system.records)} players")
+    return 1 if mismatches else 0
+
+
+def migrate(args):
+    elo_system = ELO_System.from_json(args.state, use_journal=True, engine=make_engine(args.rating_engine))
+    storage = SQLiteStorage(args.database)
+    storage.import_state(elo_system)
+    storage.close()
+    elo_system.close()
+    print(f"Imported {len(elo_system.records)} players into {args.database}")
+
+
+def archive(args):
+    elo_system = load(args.state, args.rating_engine)
+    before = args.before or (date.today() - timedelta(days=args.keep_days)).isoformat()
+    moved = elo_system.archive_scores(before)
+    # Snapshot right away so the state file shrinks
+    elo_system.checkpoint()
+    elo_system.close()
+    print(f"Archived {moved} scores from before {before}")
+
+
+def convert_snapshot(args):
+    elo_system = ELO_System.from_json(args.state, use_journal=True, engine=make_engine(args.rating_engine))
+    elo_system.storage.snapshot_format = args.format
+    elo_system.checkpoint()
+    elo_system.close()
+    print(f"Wrote a {args.format} snapshot of {len(elo_system.records)} players ({os.path.getsize(args.state)} bytes)")
+
+
+def recompute(args):
+    elo_system = load(args.state, args.rating_engine)
+    storage = elo_system.storage
+    if not args.apply:
+        # A dry run must not reach the journal, it would be replayed on the next load
+        elo_system.storage = None
+    before = {player: (info["elo"], info["W"], info["L"]) for player, info in elo_system.records.items()}
+    stats = elo_system.recompute_ratings(args.expected_constant, args.scaling_constant)
+
+    for player, info in sorted(elo_system.records.items(), key=lambda item: -item[1]["elo"]):
+        old_elo, old_wins, old_losses = before.get(player, (ELO_System.BASE_ELO, 0, 0))
+        print(f"{player}: {round(old_elo, 2)} {old_wins}-{old_losses} -> {round(info['elo'], 2)} {info['W']}-{info['L']}")
+        if info["W"] + info["L"] < old_wins + old_losses:
+            print(f"  warning: {player} has matches from before duels were logged")
+    print(f"Replayed {stats['duels']} duels, accuracy {stats['accuracy']:.3f}, brier {stats['brier']:.4f}")
+
+    if args.apply:
+        elo_system.save()
+        elo_system.checkpoint()
+    storage.close()
+
+
+def correct_duel(args):
+    elo_system = load(args.state, args.rating_engine)
+    try:
+        elo_system.correct_duel(args.index, args.scoreA, args.scoreB)
+        elo_system.save()
+    except ValueError as e:
+        print(e)
+        return 1
+    finally:
+        elo_system.close()
+
+
+def import_history(args):
+    elo_system = load(args.state, args.rating_engine)
+    format = args.format or bulk.guess_format(args.file)
+    try:
+        with open(args.file, newline="") as f:
+            counts = bulk.import_rows(elo_system, bulk.read_rows(f, format))
+    except bulk.BulkError as e:
+        print(f"Stopped at a bad row: {e}. Rows before it were imported.")
+        return 1
+    finally:
+        elo_system.close()
+    print(f"Imported {counts['scores']} score lists and {counts['duels']} duels from {args.file}")
+
+
+def export_history(args):
+    elo_system = load(args.state, args.rating_engine)
+    format = args.format or bulk.guess_format(args.output or ".ndjson")
+    out = open(args.output, "w", newline="") if args.output else sys.stdout
+    try:
+        for chunk in bulk.export(elo_system, format):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+        elo_system.close()
+
+
+def whatif(args):
+    elo_system = load(args.state, args.rating_engine)
+    duels = list(elo_system.iter_duels())
+    elo_system.close()
+
+    constants = list(itertools.product(args.expected_constants, args.scaling_constants))
+    player_ids, results = what_if(duels, constants, ELO_System.BASE_ELO, args.workers)
+    for result in sorted(results, key=lambda r: r["brier"]):
+        top_player = player_ids[result["elo"].argmax()] if len(player_ids) else None
+        print(f"expected={result['expected_constant']} scaling={result['scaling_constant']}: "
+              f"accuracy {result['accuracy']:.3f}, brier {result['brier']:.4f}, top {top_player}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the elo bot state")
+    parser.add_argument("--rating-engine", choices=list(ENGINES), default=os.environ.get("RATING_ENGINE", "elo"),
+                        help="Rating engine the bot runs with, defaults to $RATING_ENGINE")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild_parser = subparsers.add_parser("rebuild-stats", help="Recompute best/avg/totals from the score history")
+    rebuild_parser.add_argument("state", nargs="?", default="state.json")
+    rebuild_parser.set_defaults(func=rebuild_stats)
+
+    check_parser = subparsers.add_parser("check-stats", help="Check best/avg/totals against the score history")
+    check_parser.add_argument("state", nargs="?", default="state.json")
+    check_parser.set_defaults(func=check_stats)
+
+    migrate_parser = subparsers.add_parser("migrate", help="Import a JSON state file into a SQLite database")
+    migrate_parser.add_argument("state", nargs="?", default="state.json")
+    migrate_parser.add_argument("database", nargs="?", default="state.db")
+    migrate_parser.set_defaults(func=migrate)
+
+    archive_parser = subparsers.add_parser("archive", help="Move old score history out of a JSON state file into its archive")
+    archive_parser.add_argument("state", nargs="?", default="state.json")
+    archive_parser.add_argument("--keep-days", type=int, default=365, help="Days of scores to keep in the state file")
+    archive_parser.add_argument("--before", help="Archive scores before this ISO date instead")
+    archive_parser.set_defaults(func=archive)
+
+    snapshot_parser = subparsers.add_parser("snapshot", help="Rewrite a state file as a JSON or binary snapshot, see snapshot.py")
+    snapshot_parser.add_argument("state", nargs="?", default="state.json")
+    snapshot_parser.add_argument("--format", choices=JSONStorage.SNAPSHOT_FORMATS, default="binary")
+    snapshot_parser.set_defaults(func=convert_snapshot)
+
+    recompute_parser = subparsers.add_parser("recompute", help="Replay the duel log and recompute every rating and W-L")
+    recompute_parser.add_argument("state", nargs="?", default="state.json")
+    recompute_parser.add_argument("--expected-constant", type=float, help="Elo only")
+    recompute_parser.add_argument("--scaling-constant", type=float, help="Elo only")
+    recompute_parser.add_argument("--apply", action="store_true", help="Save the recomputed ratings")
+    recompute_parser.set_defaults(func=recompute)
+
+    correct_parser = subparsers.add_parser("correct-duel", help="Fix a logged duel's scores and recompute ratings")
+    correct_parser.add_argument("state")
+    correct_parser.add_argument("index", type=int, help="0-based position in the duel log")
+    correct_parser.add_argument("scoreA", type=int)
+    correct_parser.add_argument("scoreB", type=int)
+    correct_parser.set_defaults(func=correct_duel)
+
+    import_parser = subparsers.add_parser("import", help="Record score lists and duels from a CSV or NDJSON file, see bulk.py")
+    import_parser.add_argument("state")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=bulk.FORMATS, help="Defaults to csv for .csv files, ndjson otherwise")
+    import_parser.set_defaults(func=import_history)
+
+    export_parser = subparsers.add_parser("export", help="Write the score and duel history as CSV or NDJSON")
+    export_parser.add_argument("state", nargs="?", default="state.json")
+    export_parser.add_argument("-o", "--output", help="Defaults to stdout")
+    export_parser.add_argument("--format", choices=bulk.FORMATS, help="Defaults to csv for .csv files, ndjson otherwise")
+    export_parser.set_defaults(func=export_history)
+
+    whatif_parser = subparsers.add_parser("whatif", help="Compare alternative elo constants on the duel log")
+    whatif_parser.add_argument("state", nargs="?", default="state.json")
+    whatif_parser.add_argument("--expected-constants", type=float, nargs="+", default=[ELO_System.EXPECTED_SCORE_CONSTANT])
+    whatif_parser.add_argument("--scaling-constants", type=float, nargs="+", default=[ELO_System.SCALING_CONSTANT])
+    whatif_parser.add_argument("--workers", type=int)
+    whatif_parser.set_defaults(func=whatif)
+
+    args = parser.parse_args()
+    return args.func(args) or 0
+
+
+if __name__ == "__main__":
+    exit(main())
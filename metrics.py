@@ -0,0 +1,211 @@
+'''
+Request metrics in the Prometheus text format, served on /metrics.
+
+Metrics are module-level and safe to update from any thread. Histograms
+count observations into cumulative buckets. Gauges can also be given a
+function that is called at scrape time.
+
+Stage timings are labeled with the route handling the current thread's
+request (see set_route), so handlers can time stages without passing it along:
+
+    with metrics.stage("parse"):
+        command = commands.parse_duel(text)
+'''
+import os
+import sys
+import time
+import bisect
+import threading
+from collections import Counter as _Counter
+
+DEFAULT_BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+
+def _format_labels(label_names, label_values, extra=""):
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(label_names, label_values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = list(label_names)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines += self._samples()
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, label_names=(), function=None):
+        super().__init__(name, help_text, label_names)
+        self._values = {}
+        self.function = function # called at scrape time instead of keeping a value
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.function:
+            return [f"{self.name} {self.function()}"]
+        return [f"{self.name}{_format_labels(self.label_names, key)} {value}" for key, value in sorted(self._values.items())]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = list(buckets)
+        self._values = {} # labels -> [per-bucket counts (last one is +Inf), sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = self._values[key]
+            counts[0][idx] += 1
+            counts[1] += value
+
+    def time(self, **labels):
+        return _Timer(lambda seconds: self.observe(seconds, **labels))
+
+    def count(self, **labels):
+        values = self._values.get(self._key(labels))
+        return sum(values[0]) if values else 0
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ["+Inf"], counts):
+                cumulative += count
+                bound_label = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, bound_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, on_done):
+        self.on_done = on_done
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.on_done(time.perf_counter() - self.start)
+
+
+REGISTRY = []
+
+
+def render():
+    # The whole registry in the Prometheus text exposition format
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram("elo_bot_request_seconds", "Time to handle a request", ["route", "status"])
+STAGE_SECONDS = Histogram("elo_bot_stage_seconds", "Time spent in each stage of a request", ["route", "stage"])
+SAVE_SECONDS = Histogram("elo_bot_save_seconds", "Time to persist one command", ["backend"])
+BRACKET_RENDER_SECONDS = Histogram("elo_bot_bracket_render_seconds", "Time from requesting a bracket image until it's ready", ["renderer", "cached"])
+SLACK_CALL_SECONDS = Histogram("elo_bot_slack_call_seconds", "Duration of each outbound Slack HTTP call", ["method", "status"])
+SLACK_RETRIES = Counter("elo_bot_slack_retries_total", "Slack calls retried", ["method", "reason"])
+SLACK_ERRORS = Counter("elo_bot_slack_errors_total", "Slack calls answered with ok=false", ["method", "error"])
+CACHE_REQUESTS = Counter("elo_bot_cache_requests_total", "Response cache lookups", ["route", "result"])
+DUPLICATE_DELIVERIES = Counter("elo_bot_duplicate_deliveries_total", "Slack events and slash commands dropped as already handled", ["route", "retry"])
+
+_local = threading.local()
+
+
+def set_route(route):
+    _local.route = route
+
+
+def current_route():
+    return getattr(_local, "route", "")
+
+
+def stage(name):
+    return STAGE_SECONDS.time(route=current_route(), stage=name)
+
+
+class SamplingProfiler:
+    '''
+    Samples the stack of one thread every interval seconds from a background
+    thread. Results are written as collapsed stacks, one "frame;frame;... count"
+    line per distinct stack, which flamegraph tools read directly.
+    '''
+
+    def __init__(self, thread_id=None, interval=0.001):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.samples = _Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        return self.samples
+
+    def write(self, filepath):
+        with open(filepath, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
@@ -0,0 +1,185 @@
+from array import array
+from datetime import date
+
+from timeseries import RatingSeries
+
+EVENTS = ["air", "sport", "standard"]
+EVENT_CODES = {event: code for code, event in enumerate(EVENTS)}
+# Scores are stored as int32 at most, here and in binary snapshots
+SCORE_RANGE = range(-2 ** 31, 2 ** 31)
+# List id of scores recorded before score lists were numbered, each one is treated as a list of its own
+NO_LIST = -1
+
+
+class ScoreHistory:
+    '''
+    A player's (date, event, score) history packed into typed arrays: day
+    ordinals as int32, event codes as int8 and scores as int16, 7 bytes a
+    score instead of a few hundred for a list of three objects. Reads as a
+    sequence of (ISO date, event, score) tuples, oldest first.
+
+    The id of the score list each score was recorded in is kept alongside as
+    int32, 4 more bytes a score, and read with rows_with_lists(). Rows without
+    one get NO_LIST.
+    '''
+    __slots__ = ("dates", "events", "scores", "lists")
+
+    def __init__(self, rows=()):
+        self.dates = array("i")
+        self.events = array("b")
+        self.scores = array("h")
+        self.lists = array("i")
+        rows = list(rows)
+        if rows:
+            # Loading a JSON snapshot, convert each day once
+            days, events, scores = zip(*(row[:3] for row in rows))
+            self.lists = array("i", (row[3] if len(row) > 3 else NO_LIST for row in rows))
+            ordinals = {day: date.fromisoformat(day).toordinal() for day in set(days)}
+            self.dates = array("i", map(ordinals.__getitem__, days))
+            self.events = array("b", map(EVENT_CODES.__getitem__, events))
+            scores = list(map(int, scores))
+            try:
+                self.scores = array("h", scores)
+            except OverflowError:
+                self.scores = array("i", scores)
+
+    def from_arrays(dates, events, scores, lists=None):
+        # Takes over the arrays, which must be array("i"), array("b"), array("h" or "i") and array("i")
+        history = ScoreHistory()
+        history.dates, history.events, history.scores = dates, events, scores
+        history.lists = lists if lists is not None else array("i", [NO_LIST]) * len(dates)
+        return history
+
+    def append(self, row):
+        # row is (date, event, score) or (date, event, score, list id)
+        day, event, score = row[:3]
+        try:
+            self.scores.append(score)
+        except OverflowError:
+            # Out of int16 range, widen instead of refusing the score
+            self.scores = array("i", self.scores)
+            self.scores.append(score)
+        self.dates.append(date.fromisoformat(day).toordinal())
+        self.events.append(EVENT_CODES[event])
+        self.lists.append(row[3] if len(row) > 3 else NO_LIST)
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _row(self, idx):
+        return (date.fromordinal(self.dates[idx]).isoformat(), EVENTS[self.events[idx]], self.scores[idx])
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self._row(k) for k in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("score index out of range")
+        return self._row(idx)
+
+    def __iter__(self):
+        ordinals = {}
+        for day, event, score in zip(self.dates, self.events, self.scores):
+            # Scores come in runs from the same day, convert each ordinal once
+            if day not in ordinals:
+                ordinals[day] = date.fromordinal(day).isoformat()
+            yield (ordinals[day], EVENTS[event], score)
+
+    def rows_with_lists(self):
+        '''
+        Yields (ISO date, event, score, list id) tuples, oldest first
+        '''
+        for row, list_id in zip(self, self.lists):
+            yield row + (list_id,)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def nbytes(self):
+        return sum(len(column) * column.itemsize for column in [self.dates, self.events, self.scores, self.lists])
+
+
+class Player:
+    '''
+    One player's record. Fields are slots rather than dict entries, but can
+    still be read and set by name like the dicts records used to hold
+    (info["elo"]), and dict(player) or to_dict() gives the JSON form.
+    '''
+    __slots__ = ("id", "name", "_scores", "best", "avg", "totals", "elo", "rating", "W", "L", "_history")
+    FIELDS = ["id", "name", "scores", "best", "avg", "totals", "elo", "rating", "W", "L", "history"]
+    _FIELD_SET = frozenset(FIELDS)
+
+    def __init__(self, player_id, name="", scores=None, best=None, avg=None, totals=None, elo=1500, rating=None, W=0, L=0, history=None):
+        self.id = player_id
+        self.name = name # only used for tournaments
+        self.scores = scores if scores is not None else ScoreHistory()
+        self.best = best if best is not None else {}
+        self.avg = avg if avg is not None else {}
+        self.totals = totals if totals is not None else {} # event -> running count, sum and sum of squares of scores
+        self.elo = elo
+        self.rating = rating if rating is not None else {} # rating engine state
+        self.W = W
+        self.L = L
+        self.history = history if history is not None else RatingSeries() # elo after every change, see timeseries.py
+
+    @property
+    def scores(self):
+        return self._scores
+
+    @scores.setter
+    def scores(self, rows):
+        self._scores = rows if isinstance(rows, ScoreHistory) else ScoreHistory(rows)
+
+    @property
+    def history(self):
+        return self._history
+
+    @history.setter
+    def history(self, state):
+        self._history = state if isinstance(state, RatingSeries) else RatingSeries.from_state(state)
+
+    def from_dict(info):
+        # Fields missing from records written by older versions get their defaults
+        return Player(info["id"], **{field: info[field] for field in Player.FIELDS[1:] if field in info})
+
+    def fields(self):
+        # Shallow copy as a dict, the score and rating histories are shared
+        return {
+            "id": self.id, "name": self.name, "scores": self._scores, "best": self.best, "avg": self.avg,
+            "totals": self.totals, "elo": self.elo, "rating": self.rating, "W": self.W, "L": self.L, "history": self._history
+        }
+
+    def to_dict(self):
+        info = self.fields()
+        info["scores"] = [list(row) for row in self.scores.rows_with_lists()]
+        info["history"] = self._history.to_state()
+        return info
+
+    def __getitem__(self, field):
+        if field not in Player._FIELD_SET:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        if field not in Player._FIELD_SET:
+            raise KeyError(field)
+        setattr(self, field, value)
+
+    def __contains__(self, field):
+        return field in Player._FIELD_SET
+
+    def get(self, field, default=None):
+        return getattr(self, field) if field in Player._FIELD_SET else default
+
+    def keys(self):
+        return list(Player.FIELDS)
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in Player.FIELDS]
+
+    def __iter__(self):
+        return iter(Player.FIELDS)
+
+    def __len__(self):
+        return len(Player.FIELDS)
@@ -0,0 +1,351 @@
+'''
+Rating engines for ELO_System. An engine turns duels and recorded score lists
+into rating changes. Every player's displayed rating stays in info["elo"] so
+leaderboards and /stats work the same with any engine. Anything else the engine
+needs per player is kept in info["rating"].
+
+Each engine implements:
+- rate_duel(records, playerA, scoreA, playerB, scoreB, day) -> (deltaA, deltaB)
+- rate_score_list(records, scores, day) -> players whose rating changed
+- replay(encoded, dates) -> (ratings, states, stats), recomputing every rating
+  from the duel log (see recompute.encode_duels) for ELO_System.recompute_ratings,
+  if replays_duel_log is set
+'''
+import math
+from datetime import date
+
+import numpy as np
+
+from recompute import normalized_results, prediction_stats, replay
+
+
+def _normalized_result(scoreA, scoreB):
+    total = int(scoreA) + int(scoreB)
+    return int(scoreA) / total if total else 0.5
+
+
+class EloEngine:
+    '''
+    Fixed-K Elo on the normalized duel result, scoreA / (scoreA + scoreB).
+    Score lists don't change ratings.
+    '''
+    name = "elo"
+    replays_duel_log = True
+
+    def __init__(self, base_rating=1500, expected_constant=500, scaling_constant=100):
+        self.base_rating = base_rating
+        self.expected_constant = expected_constant # lower constant -> steeper expected score gradient
+        self.scaling_constant = scaling_constant
+
+    def expected_result(self, eloA, eloB):
+        # return normalized result for a 1 vs 1
+        return 1 / (1 + 10 ** ((eloB - eloA) / self.expected_constant))
+
+    def rate_duel(self, records, playerA, scoreA, playerB, scoreB, day=None):
+        expected = self.expected_result(records[playerA]["elo"], records[playerB]["elo"])
+        elo_delta = self.scaling_constant * (_normalized_result(scoreA, scoreB) - expected)
+
+        records[playerA]["elo"] += elo_delta
+        records[playerB]["elo"] -= elo_delta
+        return elo_delta, -elo_delta
+
+    def rate_score_list(self, records, scores, day=None):
+        return []
+
+    def replay(self, encoded, dates):
+        elo, _, _, stats = replay(encoded, self.expected_constant, self.scaling_constant, self.base_rating)
+        return elo, [{} for _ in range(len(elo))], stats
+
+
+GLICKO2_SCALE = 173.7178
+
+
+def _glicko2_g(phi):
+    return 1 / np.sqrt(1 + 3 * phi ** 2 / math.pi ** 2)
+
+
+def _glicko2_volatility(phi, sigma, v, delta, tau, epsilon=1e-6):
+    # Step 5 of Glickman's Glicko-2 example, the Illinois iteration run on every player at once
+    a = np.log(sigma ** 2)
+
+    def f(x):
+        ex = np.exp(x)
+        return ex * (delta ** 2 - phi ** 2 - v - ex) / (2 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau ** 2
+
+    A = a.copy()
+    large_delta = delta ** 2 > phi ** 2 + v
+    B = np.where(large_delta, np.log(np.maximum(delta ** 2 - phi ** 2 - v, 1e-300)), a - tau)
+    step_down = ~large_delta & (f(B) < 0)
+    while step_down.any():
+        B = np.where(step_down, B - tau, B)
+        step_down &= f(B) < 0
+
+    fA, fB = f(A), f(B)
+    for _ in range(100):
+        active = np.abs(B - A) > epsilon
+        if not active.any():
+            break
+        with np.errstate(divide="ignore", invalid="ignore"):
+            C = np.where(active, A + (A - B) * fA / (fB - fA), B)
+        fC = f(C)
+        swap = active & (fC * fB <= 0)
+        A, fA = np.where(swap, B, A), np.where(swap, fB, np.where(active, fA / 2, fA))
+        B, fB = np.where(active, C, B), np.where(active, fC, fB)
+    return np.exp(A / 2)
+
+
+def glicko2_update(mu, phi, sigma, player_idx, opponent_mu, opponent_phi, results, tau, max_phi):
+    '''
+    One Glicko-2 rating period for every player at once, on the internal
+    (mu, phi) scale. Game k was played by player player_idx[k] against an
+    opponent rated (opponent_mu[k], opponent_phi[k]) at the start of the
+    period, with result results[k] in [0, 1]. Players without games only have
+    their deviation grow, up to max_phi. Returns the new (mu, phi, sigma).
+    '''
+    num_players = len(mu)
+    g = _glicko2_g(opponent_phi)
+    expected = 1 / (1 + np.exp(-g * (mu[player_idx] - opponent_mu)))
+    v_inverse = np.bincount(player_idx, g * g * expected * (1 - expected), minlength=num_players)
+    improvement = np.bincount(player_idx, g * (results - expected), minlength=num_players)
+
+    played = v_inverse > 0
+    v = np.divide(1, v_inverse, out=np.full(num_players, np.inf), where=played)
+    new_sigma = sigma.copy()
+    new_sigma[played] = _glicko2_volatility(phi[played], sigma[played], v[played], v[played] * improvement[played], tau)
+
+    phi_star = np.sqrt(phi ** 2 + new_sigma ** 2)
+    new_phi = np.where(played, 1 / np.sqrt(1 / phi_star ** 2 + v_inverse), np.minimum(phi_star, max_phi))
+    new_mu = mu + new_phi ** 2 * improvement
+    return new_mu, new_phi, new_sigma
+
+
+class Glicko2Engine:
+    '''
+    Glicko-2 with rating periods of period_days days. Ratings from every duel in
+    a period are computed against the ratings the players started the period
+    with, so a player's rating during a period is what it would be if the period
+    closed now. Players who sit out periods become less certain, their deviation
+    grows back toward the starting one. Score lists don't change ratings.
+    '''
+    name = "glicko2"
+    replays_duel_log = True
+
+    def __init__(self, base_rating=1500, deviation=350, volatility=0.06, tau=0.5, period_days=7):
+        self.base_rating = base_rating
+        self.max_phi = deviation / GLICKO2_SCALE
+        self.volatility = volatility
+        self.tau = tau
+        self.period_days = period_days
+
+    def _period(self, day):
+        return date.fromisoformat(day).toordinal() // self.period_days
+
+    def _state(self, info):
+        state = info.get("rating")
+        if state and state.get("engine") == Glicko2Engine.name:
+            return state
+        # Players rated by another engine start from their current rating
+        mu = (info["elo"] - self.base_rating) / GLICKO2_SCALE
+        return {"engine": Glicko2Engine.name, "mu": mu, "phi": self.max_phi, "sigma": self.volatility,
+                "base": [mu, self.max_phi, self.volatility], "period": None, "games": []}
+
+    def _roll(self, state, period):
+        # Closes the periods the player's state is from and starts period
+        if state["period"] is not None and period <= state["period"]:
+            return state
+        mu, phi, sigma = state["mu"], state["phi"], state["sigma"]
+        if state["period"] is not None:
+            idle_periods = period - state["period"] - 1
+            phi = min(math.sqrt(phi ** 2 + idle_periods * sigma ** 2), self.max_phi)
+        return {"engine": Glicko2Engine.name, "mu": mu, "phi": phi, "sigma": sigma,
+                "base": [mu, phi, sigma], "period": period, "games": []}
+
+    def _with_game(self, state, opponent_state, result):
+        games = state["games"] + [[opponent_state["base"][0], opponent_state["base"][1], result]]
+        base_mu, base_phi, base_sigma = state["base"]
+        opponent_mu, opponent_phi, results = np.array(games).T
+        mu, phi, sigma = glicko2_update(
+            np.array([base_mu]), np.array([base_phi]), np.array([base_sigma]),
+            np.zeros(len(games), dtype=np.int64), opponent_mu, opponent_phi, results, self.tau, self.max_phi
+        )
+        return dict(state, mu=float(mu[0]), phi=float(phi[0]), sigma=float(sigma[0]), games=games)
+
+    def rating(self, state):
+        return self.base_rating + GLICKO2_SCALE * state["mu"]
+
+    def rate_duel(self, records, playerA, scoreA, playerB, scoreB, day=None):
+        return self._rate_duel(records, playerA, scoreA, playerB, scoreB, self._period(day or date.today().isoformat()))
+
+    def _rate_duel(self, records, playerA, scoreA, playerB, scoreB, period):
+        infoA, infoB = records[playerA], records[playerB]
+        stateA = self._roll(self._state(infoA), period)
+        stateB = self._roll(self._state(infoB), period)
+
+        result = _normalized_result(scoreA, scoreB)
+        stateA, stateB = self._with_game(stateA, stateB, result), self._with_game(stateB, stateA, 1 - result)
+
+        deltaA = self.rating(stateA) - infoA["elo"]
+        deltaB = self.rating(stateB) - infoB["elo"]
+        infoA["rating"], infoA["elo"] = stateA, self.rating(stateA)
+        infoB["rating"], infoB["elo"] = stateB, self.rating(stateB)
+        return deltaA, deltaB
+
+    def rate_score_list(self, records, scores, day=None):
+        return []
+
+    def replay(self, encoded, dates):
+        '''
+        Closed periods are updated for all players at once, the duels of the
+        last period then go through rate_duel so its games stay open
+        '''
+        player_ids, a_idx, b_idx, _, _ = encoded
+        num_players = len(player_ids)
+        mu = np.zeros(num_players)
+        phi = np.full(num_players, self.max_phi)
+        sigma = np.full(num_players, self.volatility)
+        results = normalized_results(encoded)
+        expected_results = np.zeros(len(results))
+        if not len(results):
+            return np.full(num_players, float(self.base_rating)), [], prediction_stats(encoded, expected_results)
+
+        periods = np.array([self._period(day or date.today().isoformat()) for day in dates])
+        # Duels are logged in order, but days given out of order count toward the latest period
+        periods = np.maximum.accumulate(periods)
+        boundaries = np.flatnonzero(np.diff(periods)) + 1
+        starts, ends = np.concatenate([[0], boundaries]), np.concatenate([boundaries, [len(periods)]])
+
+        previous_period = None
+        for start, end in zip(starts, ends):
+            period = periods[start]
+            if previous_period is not None:
+                phi = np.minimum(np.sqrt(phi ** 2 + (period - previous_period - 1) * sigma ** 2), self.max_phi)
+            previous_period = period
+
+            a, b = a_idx[start:end], b_idx[start:end]
+            g = _glicko2_g(phi[b])
+            expected_results[start:end] = 1 / (1 + np.exp(-g * (mu[a] - mu[b])))
+            if end == len(periods):
+                break
+            mu, phi, sigma = glicko2_update(
+                mu, phi, sigma,
+                np.concatenate([a, b]), np.concatenate([mu[b], mu[a]]), np.concatenate([phi[b], phi[a]]),
+                np.concatenate([results[start:end], 1 - results[start:end]]), self.tau, self.max_phi
+            )
+
+        records = {}
+        for k, player in enumerate(player_ids.tolist()):
+            state = {"engine": Glicko2Engine.name, "mu": float(mu[k]), "phi": float(phi[k]), "sigma": float(sigma[k]),
+                     "base": [float(mu[k]), float(phi[k]), float(sigma[k])], "period": int(previous_period), "games": []}
+            records[player] = {"elo": self.rating(state), "rating": state}
+        for i, j, score_a, score_b in zip(a_idx[start:].tolist(), b_idx[start:].tolist(), encoded[3][start:].tolist(), encoded[4][start:].tolist()):
+            self._rate_duel(records, player_ids[i], score_a, player_ids[j], score_b, int(previous_period))
+
+        infos = [records[player] for player in player_ids.tolist()]
+        return np.array([info["elo"] for info in infos]), [info["rating"] for info in infos], prediction_stats(encoded, expected_results)
+
+
+def plackett_luce_update(mu, sigma, scores, beta, kappa=1e-4):
+    '''
+    Weng-Lin Bayesian update with the Plackett-Luce model for one free-for-all
+    game between len(mu) players, ranked by score with higher scores better and
+    equal scores tied. Returns the new (mu, sigma).
+
+    Every sum the update needs runs over the players ranked at or below (or at
+    or above) each player, so after one sort they are all cumulative sums and
+    the whole update is O(N log N).
+    '''
+    num_players = len(mu)
+    c = math.sqrt(np.sum(sigma ** 2 + beta ** 2))
+    # Only ratios of these matter, shifting by the best mu keeps exp from overflowing
+    strength = np.exp((mu - mu.max()) / c)
+
+    order = np.argsort(-scores, kind="stable")
+    sorted_scores = scores[order]
+    sorted_strength = strength[order]
+
+    # Players with equal scores share a rank, given by the first and last position of their group
+    new_group = np.concatenate([[True], sorted_scores[1:] != sorted_scores[:-1]])
+    group_id = np.cumsum(new_group) - 1
+    group_first = np.flatnonzero(new_group)
+    group_last = np.concatenate([group_first[1:], [num_players]]) - 1
+    group_size = (group_last - group_first + 1)[group_id]
+
+    # C_q: total strength of the players ranked at or below player q
+    suffix = np.cumsum(sorted_strength[::-1])[::-1]
+    C = suffix[group_first][group_id]
+    # Sums over the players q ranked at or above player i, through the end of i's group
+    sum_inverse = np.cumsum(1 / (group_size * C))[group_last][group_id]
+    sum_inverse_sq = np.cumsum(1 / (group_size * C ** 2))[group_last][group_id]
+
+    sorted_sigma = sigma[order]
+    omega = 1 / group_size - sorted_strength * sum_inverse
+    delta = sorted_strength * sum_inverse - sorted_strength ** 2 * sum_inverse_sq
+    gamma = sorted_sigma / c
+
+    new_mu, new_sigma = np.empty(num_players), np.empty(num_players)
+    new_mu[order] = mu[order] + sorted_sigma ** 2 / c * omega
+    new_sigma[order] = sorted_sigma * np.sqrt(np.maximum(1 - gamma * sorted_sigma ** 2 / c ** 2 * delta, kappa))
+    return new_mu, new_sigma
+
+
+class PlackettLuceEngine:
+    '''
+    Multi-player ratings (Weng-Lin with the Plackett-Luce model). Every recorded
+    score list is a free-for-all game ranked by score and a duel is a two
+    player game. Each player has a rating mu with an uncertainty sigma, which
+    grows by tau before every game so ratings can keep moving.
+    '''
+    name = "plackett-luce"
+    # Ratings also depend on the score lists, which aren't kept in order with the duels
+    replays_duel_log = False
+
+    def __init__(self, base_rating=1500, deviation=350, beta=175, tau=3.5):
+        self.base_rating = base_rating
+        self.deviation = deviation
+        self.beta = beta
+        self.tau = tau
+
+    def _state(self, info):
+        state = info.get("rating")
+        if state and state.get("engine") == PlackettLuceEngine.name:
+            return state
+        return {"engine": PlackettLuceEngine.name, "mu": info["elo"], "sigma": self.deviation}
+
+    def _rate(self, records, player_scores):
+        # player_scores: {player: score}, one game
+        players = list(player_scores)
+        states = [self._state(records[player]) for player in players]
+        mu = np.array([state["mu"] for state in states], dtype=float)
+        sigma = np.sqrt(np.array([state["sigma"] for state in states], dtype=float) ** 2 + self.tau ** 2)
+        scores = np.array([player_scores[player] for player in players], dtype=float)
+
+        new_mu, new_sigma = plackett_luce_update(mu, sigma, scores, self.beta)
+        deltas = []
+        for player, player_mu, player_sigma, old_mu in zip(players, new_mu.tolist(), new_sigma.tolist(), mu.tolist()):
+            records[player]["rating"] = {"engine": PlackettLuceEngine.name, "mu": player_mu, "sigma": player_sigma}
+            records[player]["elo"] = player_mu
+            deltas.append(player_mu - old_mu)
+        return deltas
+
+    def rate_duel(self, records, playerA, scoreA, playerB, scoreB, day=None):
+        deltaA, deltaB = self._rate(records, {playerA: int(scoreA), playerB: int(scoreB)})
+        return deltaA, deltaB
+
+    def rate_score_list(self, records, scores, day=None):
+        # A player listed twice is ranked by their best score
+        player_scores = {}
+        for player, score in scores:
+            player_scores[player] = max(player_scores.get(player, int(score)), int(score))
+        if len(player_scores) < 2:
+            return []
+        self._rate(records, player_scores)
+        return list(player_scores)
+
+
+ENGINES = {engine.name: engine for engine in [EloEngine, Glicko2Engine, PlackettLuceEngine]}
+
+
+def make_engine(name):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown rating engine {name}, expected one of {', '.join(ENGINES)}")
+    return ENGINES[name]()
@@ -0,0 +1,110 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def encode_duels(duels):
+    '''
+    Turns (date, playerA, scoreA, playerB, scoreB) duels into arrays indexed by
+    integer player ids. Returns (player_ids, a_idx, b_idx, score_a, score_b)
+    where player_ids[k] is the Slack ID of player k.
+    '''
+    duels = list(duels)
+    if not duels:
+        empty = np.zeros(0, dtype=np.int64)
+        return np.array([], dtype=object), empty, empty, empty, empty
+
+    _, players_a, scores_a, players_b, scores_b = zip(*duels)
+    # Ids are handed out in order of first appearance, hashing is much cheaper than np.unique on strings
+    id_of = {}
+    a_idx = np.fromiter((id_of.setdefault(p, len(id_of)) for p in players_a), dtype=np.int64, count=len(duels))
+    b_idx = np.fromiter((id_of.setdefault(p, len(id_of)) for p in players_b), dtype=np.int64, count=len(duels))
+    return (
+        np.array(list(id_of), dtype=object),
+        a_idx,
+        b_idx,
+        np.array(scores_a, dtype=np.int64),
+        np.array(scores_b, dtype=np.int64)
+    )
+
+
+def normalized_results(encoded):
+    # Player A's share of the combined score in each duel, 0.5 for a 0-0 duel
+    _, _, _, score_a, score_b = encoded
+    totals = score_a + score_b
+    return np.divide(score_a, totals, out=np.full(len(totals), 0.5), where=totals > 0)
+
+
+def tally(encoded):
+    '''
+    Returns (wins, losses) arrays indexed by player id
+    '''
+    player_ids, a_idx, b_idx, score_a, score_b = encoded
+    num_players = len(player_ids)
+    wins = np.bincount(a_idx[score_a > score_b], minlength=num_players) + np.bincount(b_idx[score_b > score_a], minlength=num_players)
+    losses = np.bincount(a_idx[score_a < score_b], minlength=num_players) + np.bincount(b_idx[score_b < score_a], minlength=num_players)
+    return wins, losses
+
+
+def prediction_stats(encoded, expected_results):
+    '''
+    Measures how well the expected results, player A's predicted share of each
+    duel from the ratings before it, matched what happened
+    '''
+    _, _, _, score_a, score_b = encoded
+    actual = normalized_results(encoded)
+    expected_results = np.asarray(expected_results, dtype=float)
+    decided = score_a != score_b
+    return {
+        "duels": len(actual),
+        # Fraction of decided duels won by the player rated higher beforehand
+        "accuracy": float(np.mean((expected_results[decided] > 0.5) == (score_a[decided] > score_b[decided]))) if decided.any() else math.nan,
+        # Mean squared error between the expected and the actual normalized result
+        "brier": float(np.mean((expected_results - actual) ** 2)) if len(actual) else math.nan
+    }
+
+
+def replay(encoded, expected_constant, scaling_constant, base_elo):
+    '''
+    Replays every duel in order from base_elo.
+    Returns (elo, wins, losses, stats) where the first three are arrays indexed
+    by player id, and stats measures how well the ratings before each duel
+    predicted its result.
+    '''
+    player_ids, a_idx, b_idx, _, _ = encoded
+    # Win/loss tallies and normalized results don't depend on ratings, so compute them in one pass
+    wins, losses = tally(encoded)
+    actual = normalized_results(encoded)
+
+    # Each update depends on the previous one, so this part is sequential.
+    # Plain lists are indexed faster than NumPy arrays one element at a time.
+    elo = [float(base_elo)] * len(player_ids)
+    expected_results = [0.0] * len(actual)
+    for k, (i, j, result) in enumerate(zip(a_idx.tolist(), b_idx.tolist(), actual.tolist())):
+        expected = 1 / (1 + 10 ** ((elo[j] - elo[i]) / expected_constant))
+        elo_delta = scaling_constant * (result - expected)
+        elo[i] += elo_delta
+        elo[j] -= elo_delta
+        expected_results[k] = expected
+
+    return np.array(elo), wins, losses, prediction_stats(encoded, expected_results)
+
+
+def _replay_constants(args):
+    encoded, expected_constant, scaling_constant, base_elo = args
+    elo, wins, losses, stats = replay(encoded, expected_constant, scaling_constant, base_elo)
+    return dict(stats, expected_constant=expected_constant, scaling_constant=scaling_constant, elo=elo)
+
+
+def what_if(duels, constants, base_elo, num_workers=None):
+    '''
+    Replays the duel history once per (expected_constant, scaling_constant)
+    pair across a process pool. Returns one dict per pair with the prediction
+    stats and the resulting elo array, plus the player ids the arrays are indexed by.
+    '''
+    encoded = encode_duels(duels)
+    jobs = [(encoded, expected_constant, scaling_constant, base_elo) for expected_constant, scaling_constant in constants]
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        results = list(pool.map(_replay_constants, jobs))
+    return encoded[0], results
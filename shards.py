@@ -0,0 +1,133 @@
+import time
+import threading
+from contextlib import contextmanager
+
+
+class ShardManager:
+    '''
+    Keeps one ELO_System per shard (a Slack workspace and channel pair).
+    Shards are loaded on first use and closed again once they've been idle
+    for idle_timeout seconds, so only the active leagues are held in memory.
+    A shard held through use() is never evicted until the last holder is done.
+
+    open_shard(team_id, channel_id) must return the loaded ELO_System for a shard.
+    '''
+
+    def __init__(self, open_shard, idle_timeout=600, evict_interval=60):
+        self.open_shard = open_shard
+        self.idle_timeout = idle_timeout
+        self.evict_interval = evict_interval
+        self._shards = {}
+        self._last_used = {}
+        self._in_use = {} # key -> number of use() blocks holding the shard
+        # key -> Event set once the shard has been opened or closed, loading and checkpointing
+        # happen outside _lock so a slow shard doesn't hold up requests for the others
+        self._pending = {}
+        self._last_eviction = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._shards)
+
+    def systems(self):
+        # The currently loaded ELO_Systems
+        with self._lock:
+            return list(self._shards.values())
+
+    def get(self, team_id, channel_id):
+        # The shard may be evicted as soon as it's idle, hold it with use() while it's being worked on
+        return self._get((team_id, channel_id))
+
+    def _get(self, key, hold=False):
+        # Returns the shard, counting it as in use if hold. Loads it if needed, while other
+        # callers for the same key wait for it rather than opening it a second time.
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            if now - self._last_eviction >= self.evict_interval:
+                evicted = self._take_idle(now)
+        self._close(evicted)
+
+        while True:
+            with self._lock:
+                if key in self._shards:
+                    self._last_used[key] = time.monotonic()
+                    if hold:
+                        self._in_use[key] = self._in_use.get(key, 0) + 1
+                    return self._shards[key]
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Being opened or closed by another thread, look again once that's done
+            pending.wait()
+
+        elo_system = None
+        try:
+            elo_system = self.open_shard(*key)
+        finally:
+            with self._lock:
+                del self._pending[key]
+                if elo_system is not None:
+                    self._shards[key] = elo_system
+                    self._last_used[key] = time.monotonic()
+                    if hold:
+                        self._in_use[key] = self._in_use.get(key, 0) + 1
+            pending.set()
+        return elo_system
+
+    @contextmanager
+    def use(self, team_id, channel_id):
+        '''
+        Yields the shard's ELO_System and keeps it loaded until the block ends:
+
+            with shards.use(team_id, channel_id) as elo_system:
+                ...
+        '''
+        key = (team_id, channel_id)
+        elo_system = self._get(key, hold=True)
+        try:
+            yield elo_system
+        finally:
+            with self._lock:
+                self._in_use[key] -= 1
+                if not self._in_use[key]:
+                    del self._in_use[key]
+                # Idle time counts from when the last holder is done
+                self._last_used[key] = time.monotonic()
+
+    def evict_idle(self, now=None):
+        with self._lock:
+            evicted = self._take_idle(now if now is not None else time.monotonic())
+        self._close(evicted)
+
+    def _take_idle(self, now):
+        # Called with _lock held, the shards returned are closed by _close once it's released
+        self._last_eviction = now
+        return [self._take(key) for key, last_used in list(self._last_used.items())
+                if now - last_used >= self.idle_timeout and key not in self._in_use]
+
+    def _take(self, key):
+        del self._last_used[key]
+        self._pending[key] = threading.Event()
+        return key, self._shards.pop(key)
+
+    def _close(self, evicted):
+        # Every shard is closed and released even if one fails, the first error is raised after
+        errors = []
+        for key, elo_system in evicted:
+            try:
+                elo_system.checkpoint()
+                elo_system.close()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                with self._lock:
+                    self._pending.pop(key).set()
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        with self._lock:
+            evicted = [self._take(key) for key in list(self._shards)]
+        self._close(evicted)
@@ -0,0 +1,167 @@
+import os
+import time
+import queue
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+class SlackClient:
+    '''
+    Sends Slack Web API calls from background workers over one pooled session
+    so request handlers can return their ack right away.
+
+    Rate limited calls (HTTP 429) are retried after the Retry-After delay,
+    server errors, timeouts and dropped connections with exponential backoff.
+    A reaction that is already queued isn't queued again.
+    '''
+
+    def __init__(self, token, base_url="https://slack.com/api", num_workers=2, max_retries=5, pool_size=10):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._queue = queue.Queue()
+        self._pending_reactions = set()
+        self._pending_lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(num_workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            fn, args = job
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"Slack call {fn.__name__} failed:", repr(e))
+            finally:
+                self._queue.task_done()
+
+    def submit(self, fn, *args):
+        self._queue.put((fn, args))
+
+    def queue_size(self):
+        # Calls waiting for a worker
+        return self._queue.qsize()
+
+    def join(self):
+        # Blocks until every queued call has finished
+        self._queue.join()
+
+    def close(self):
+        self.join()
+        for _ in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self.session.close()
+
+    def _request(self, method, url, metric_label, **kwargs):
+        # metric_label names the call in the Slack metrics, e.g. the API method
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=10, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.SLACK_CALL_SECONDS.observe(time.perf_counter() - start, method=metric_label, status="error")
+                if attempt == self.max_retries:
+                    raise
+                reason = "timeout" if isinstance(e, requests.Timeout) else "connection"
+                metrics.SLACK_RETRIES.inc(method=metric_label, reason=reason)
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+            metrics.SLACK_CALL_SECONDS.observe(time.perf_counter() - start, method=metric_label, status=response.status_code)
+
+            if response.status_code == 429 and attempt < self.max_retries:
+                metrics.SLACK_RETRIES.inc(method=metric_label, reason="rate_limited")
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+            elif response.status_code >= 500 and attempt < self.max_retries:
+                metrics.SLACK_RETRIES.inc(method=metric_label, reason="server_error")
+                time.sleep(0.5 * 2 ** attempt)
+            else:
+                return response
+        return response
+
+    def call(self, api_method, json=None, data=None):
+        # Calls a Web API method on the current thread and returns the decoded response
+        response = self._request(
+            "POST",
+            f"{self.base_url}/{api_method}",
+            api_method,
+            headers={"Authorization": f"Bearer {self.token}"},
+            json=json,
+            data=data
+        )
+        result = response.json()
+        if not result.get("ok"):
+            metrics.SLACK_ERRORS.inc(method=api_method, error=result.get("error", ""))
+        return result
+
+    def respond(self, response_url, message):
+        # Posts a slash command's delayed response on the current thread, response URLs need no token
+        response = self._request("POST", response_url, "response_url", json=message)
+        if response.status_code != 200:
+            print("Response URL POST Response:", response.status_code, response.text)
+
+    def _send_message(self, channel, msg):
+        r = self.call("chat.postMessage", json={"channel": channel, "text": msg})
+        if not r.get("ok"):
+            print("Send Message POST Response:", r)
+
+    def _upload_image(self, channel, filepath, on_upload=None):
+        # on_upload(permalink) is called once the upload is shared, or with None if it failed
+        permalink = None
+        try:
+            # Read once so a retried upload sends the whole file again, not what's left of an open one
+            with open(filepath, "rb") as file:
+                content = file.read()
+            filename = os.path.basename(filepath)
+            upload_info = self.call("files.getUploadURLExternal", data={"filename": filename, "length": len(content)})
+
+            self._request("POST", upload_info["upload_url"], "file_upload", files={"file": (filename, content)})
+
+            result = self.call("files.completeUploadExternal", json={
+                "files": [{"id": upload_info["file_id"]}],
+                "channel_id": channel
+            })
+            if on_upload and result.get("ok"):
+                file_info = self.call("files.info", data={"file": upload_info["file_id"]})
+                permalink = file_info.get("file", {}).get("permalink")
+        finally:
+            if on_upload:
+                on_upload(permalink)
+
+    def _add_reaction(self, channel, emoji_name, msg_timestamp):
+        try:
+            r = self.call("reactions.add", json={"channel": channel, "name": emoji_name, "timestamp": msg_timestamp})
+            if not r.get("ok"):
+                print("Add Reaction POST Response:", r)
+        finally:
+            with self._pending_lock:
+                self._pending_reactions.discard((channel, emoji_name, msg_timestamp))
+
+    def send_message(self, channel, msg):
+        self.submit(self._send_message, channel, msg)
+
+    def upload_image(self, channel, filepath, on_upload=None):
+        self.submit(self._upload_image, channel, filepath, on_upload)
+
+    def add_reaction(self, channel, emoji_name, msg_timestamp):
+        key = (channel, emoji_name, msg_timestamp)
+        with self._pending_lock:
+            if key in self._pending_reactions:
+                return
+            self._pending_reactions.add(key)
+        self.submit(self._add_reaction, *key)
@@ -0,0 +1,191 @@
+'''
+Binary state snapshots, an alternative to the JSON snapshot for large leagues.
+
+    8 bytes   magic, b"ELOSNAP1"
+    8 bytes   header length, little-endian
+    header    JSON: player fields other than the score and rating history, tournament
+              state, and the dtype, offset and length of every column
+    columns   little-endian arrays, each starting on an 8-byte boundary
+
+The score and rating history of every player and the duel log are stored as
+columns (day ordinals, event codes, scores, score list ids, ratings, player indexes), so
+loading is a handful of memcpys out of a memory map instead of parsing
+millions of JSON lists.
+'''
+import os
+import json
+import struct
+from array import array
+from datetime import date
+
+import numpy as np
+
+from player import Player, ScoreHistory
+from timeseries import RatingSeries
+
+MAGIC = b"ELOSNAP1"
+# Ordinal written for duels recorded without a date
+NO_DATE = 0
+
+
+def is_snapshot(filepath):
+    try:
+        with open(filepath, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except FileNotFoundError:
+        return False
+
+
+def _concatenate(arrays, dtype):
+    return np.concatenate([np.frombuffer(column, dtype=column.typecode) for column in arrays] or [[]]).astype(dtype)
+
+
+def _offsets(lengths):
+    return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64)
+
+
+def _encode_duels(duels, index):
+    ordinals = {None: NO_DATE}
+    columns = [[], [], [], [], []]
+    for day, playerA, scoreA, playerB, scoreB in duels:
+        if day not in ordinals:
+            ordinals[day] = date.fromisoformat(day).toordinal()
+        for column, value in zip(columns, [ordinals[day], index[playerA], scoreA, index[playerB], scoreB]):
+            column.append(value)
+    return [np.array(column, dtype=np.int32) for column in columns]
+
+
+def write_snapshot(elo_system, filepath, journal_seq=0):
+    '''
+    Writes elo_system's state to filepath, atomically like write_json_file_atomic
+    '''
+    records = elo_system.records
+    ids = list(records)
+    index = {player: k for k, player in enumerate(ids)}
+    # Duels can name players without a record in states written by hand
+    for _, playerA, _, playerB, _ in elo_system.duels:
+        for player in [playerA, playerB]:
+            if player not in index:
+                index[player] = len(ids)
+                ids.append(player)
+
+    histories = [records[player].scores for player in records]
+    wide = any(history.scores.typecode != "h" for history in histories)
+    score_dtype = np.int32 if wide else np.int16
+    series = [records[player].history for player in records]
+    duel_dates, duel_a, duel_score_a, duel_b, duel_score_b = _encode_duels(elo_system.duels, index)
+    columns = {
+        "score_offsets": _offsets([len(history) for history in histories]),
+        "score_dates": _concatenate([h.dates for h in histories], np.int32),
+        "score_events": _concatenate([h.events for h in histories], np.int8),
+        "score_values": _concatenate([h.scores for h in histories], score_dtype),
+        "score_lists": _concatenate([h.lists for h in histories], np.int32),
+        "rating_offsets": _offsets([len(s.dates) for s in series]),
+        "rating_dates": _concatenate([s.dates for s in series], np.int32),
+        "ratings": _concatenate([s.ratings for s in series], np.float64),
+        "bucket_offsets": _offsets([len(s.bucket_dates) for s in series]),
+        "bucket_dates": _concatenate([s.bucket_dates for s in series], np.int32),
+        "bucket_lows": _concatenate([s.lows for s in series], np.float64),
+        "bucket_highs": _concatenate([s.highs for s in series], np.float64),
+        "bucket_lasts": _concatenate([s.lasts for s in series], np.float64),
+        "duel_dates": duel_dates,
+        "duel_a": duel_a,
+        "duel_score_a": duel_score_a,
+        "duel_b": duel_b,
+        "duel_score_b": duel_score_b
+    }
+
+    layout, offset = {}, 0
+    for name, column in columns.items():
+        column = column.astype(column.dtype.newbyteorder("<"), copy=False)
+        columns[name] = column
+        layout[name] = {"dtype": column.dtype.str, "offset": offset, "length": len(column)}
+        offset += -(-column.nbytes // 8) * 8
+
+    header = json.dumps({
+        "ids": ids,
+        "players": [[info.name, info.best, info.avg, info.totals, info.elo, info.rating, info.W, info.L] for info in records.values()],
+        "tournament_state": elo_system.tournament_state,
+        "archive_generation": elo_system.archive_generation,
+        "num_score_lists": elo_system.num_score_lists,
+        "journal_seq": journal_seq,
+        "columns": layout
+    }, separators=(',', ':')).encode()
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % 8)
+
+    tmp_path = f"{filepath}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for column in columns.values():
+            data = column.tobytes()
+            f.write(data + b"\0" * (-len(data) % 8))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+
+def read_snapshot(filepath):
+    '''
+    Returns the state in the binary snapshot at filepath, in the shape
+    ELO_System.from_storage expects, with Player records
+    '''
+    data = np.memmap(filepath, dtype=np.uint8, mode="r")
+    (header_length,) = struct.unpack("<Q", data[len(MAGIC):len(MAGIC) + 8].tobytes())
+    start = len(MAGIC) + 8
+    header = json.loads(data[start:start + header_length].tobytes())
+    start += header_length
+
+    def column(name, dtype=None):
+        # Snapshots written before a column existed read as empty
+        if name not in header["columns"]:
+            return np.zeros(len(header["players"]) + 1 if name.endswith("_offsets") else 0, dtype=dtype)
+        layout = header["columns"][name]
+        return np.frombuffer(data, dtype=layout["dtype"], count=layout["length"], offset=start + layout["offset"])
+
+    def history_arrays(offsets, typecodes, columns, k):
+        lo, hi = offsets[k], offsets[k + 1]
+        return [array(typecode, column[lo:hi].tobytes()) for typecode, column in zip(typecodes, columns)]
+
+    ids = header["ids"]
+    offsets = column("score_offsets").tolist()
+    dates, events, scores = column("score_dates"), column("score_events"), column("score_values")
+    score_typecodes = ["i", "b", "h" if scores.dtype.itemsize == 2 else "i"]
+    # Snapshots written before score lists were numbered have no list ids
+    score_lists = column("score_lists") if "score_lists" in header["columns"] else None
+    rating_offsets = column("rating_offsets", np.int64).tolist()
+    rating_columns = [column("rating_dates", np.int32), column("ratings", np.float64)]
+    bucket_offsets = column("bucket_offsets", np.int64).tolist()
+    bucket_columns = [column(name, dtype) for name, dtype in [
+        ("bucket_dates", np.int32), ("bucket_lows", np.float64), ("bucket_highs", np.float64), ("bucket_lasts", np.float64)
+    ]]
+    records = {}
+    for k, (name, best, avg, totals, elo, rating, W, L) in enumerate(header["players"]):
+        history = ScoreHistory.from_arrays(*history_arrays(offsets, score_typecodes, [dates, events, scores], k))
+        if score_lists is not None:
+            history.lists = history_arrays(offsets, ["i"], [score_lists], k)[0]
+        series = RatingSeries()
+        series.dates, series.ratings = history_arrays(rating_offsets, ["i", "d"], rating_columns, k)
+        series.bucket_dates, series.lows, series.highs, series.lasts = history_arrays(bucket_offsets, ["i", "d", "d", "d"], bucket_columns, k)
+        records[ids[k]] = Player(ids[k], name, history, best, avg, totals, elo, rating, W, L, series)
+
+    iso_dates = {NO_DATE: None}
+    duel_dates = column("duel_dates").tolist()
+    for ordinal in set(duel_dates) - {NO_DATE}:
+        iso_dates[ordinal] = date.fromordinal(ordinal).isoformat()
+    duels = list(zip(
+        [iso_dates[ordinal] for ordinal in duel_dates],
+        [ids[k] for k in column("duel_a").tolist()],
+        column("duel_score_a").tolist(),
+        [ids[k] for k in column("duel_b").tolist()],
+        column("duel_score_b").tolist()
+    ))
+    del data
+
+    return {
+        "records": records,
+        "tournament_state": header["tournament_state"],
+        "duels": duels,
+        "archive_generation": header["archive_generation"],
+        "num_score_lists": header.get("num_score_lists", 0),
+        "journal_seq": header["journal_seq"]
+    }
@@ -0,0 +1,355 @@
+import os
+import json
+import sqlite3
+import itertools
+
+import snapshot
+from archive import ScoreArchive
+from journal import Journal
+from player import NO_LIST
+from utils import read_json_file, write_json_file_atomic
+
+
+class JSONStorage:
+    '''
+    Keeps the whole state in one JSON file. With use_journal every mutation is
+    appended to a journal and the file is only rewritten when compacting,
+    otherwise it is rewritten on every commit. Old score history can be moved
+    out of the file into a ScoreArchive next to it (see ELO_System.archive_scores).
+
+    snapshot_format is "json" or "binary" (see snapshot.py). Either kind of
+    file can be loaded; by default snapshots are written in the format the
+    existing file is in, JSON for a new one.
+    '''
+    keeps_history = False
+    SNAPSHOT_FORMATS = ["json", "binary"]
+
+    def __init__(self, filepath, use_journal=True, snapshot_format=None):
+        if snapshot_format not in JSONStorage.SNAPSHOT_FORMATS + [None]:
+            raise ValueError(f"Unknown snapshot format {snapshot_format}")
+        self.filepath = filepath
+        self.use_journal = use_journal
+        self.snapshot_format = snapshot_format
+        self.journal = None
+        self.archive = ScoreArchive(f"{filepath}.archive")
+
+    def load(self):
+        '''
+        Returns the saved state and the journal entries written after it
+        '''
+        binary = snapshot.is_snapshot(self.filepath)
+        if self.snapshot_format is None:
+            self.snapshot_format = "binary" if binary else "json"
+        state = snapshot.read_snapshot(self.filepath) if binary else read_json_file(self.filepath)
+        pending = []
+        if self.use_journal:
+            self.journal = Journal(self.filepath, snapshot_seq=state.get("journal_seq", 0))
+            pending = self.journal.replay_entries()
+        return state, pending
+
+    def _write_snapshot(self, elo_system, journal_seq=0):
+        if self.snapshot_format == "binary":
+            snapshot.write_snapshot(elo_system, self.filepath, journal_seq)
+            return
+        state = elo_system.to_state()
+        state["journal_seq"] = journal_seq
+        write_json_file_atomic(state, self.filepath)
+
+    def append(self, entry):
+        if self.journal:
+            self.journal.append(entry)
+
+    def commit(self, elo_system):
+        if not self.journal:
+            self._write_snapshot(elo_system)
+            return
+
+        self.journal.commit()
+        if self.journal.needs_compaction():
+            self.journal.compact(lambda seq: self._write_snapshot(elo_system, seq))
+
+    def checkpoint(self, elo_system):
+        # Writes a full snapshot now
+        if self.journal:
+            self.journal.compact(lambda seq: self._write_snapshot(elo_system, seq))
+        else:
+            self._write_snapshot(elo_system)
+
+    def close(self):
+        if self.journal:
+            self.journal.close()
+
+    def size_bytes(self):
+        # Snapshot plus journal, the archive isn't loaded so it isn't counted
+        paths = [self.filepath, f"{self.filepath}.journal"]
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+class SQLiteStorage:
+    '''
+    Keeps players, score history, duels and tournaments in SQLite tables.
+    Only player rows and their per-event aggregates are loaded at startup, the
+    score history stays on disk and is read through indexed queries.
+    Each command's writes are committed as one transaction.
+    '''
+    keeps_history = True
+    # Score history is already on disk and read through indexes
+    archive = None
+
+    # Player fields stored in their own columns, the remaining ones go into the data column as JSON
+    PLAYER_COLUMNS = {"id": "id", "name": "name", "elo": "elo", "W": "wins", "L": "losses"}
+    DERIVED_FIELDS = ["scores", "best", "avg", "totals"]
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS players (
+            id TEXT PRIMARY KEY,
+            name TEXT NOT NULL DEFAULT '',
+            elo REAL NOT NULL,
+            wins INTEGER NOT NULL DEFAULT 0,
+            losses INTEGER NOT NULL DEFAULT 0,
+            data TEXT NOT NULL DEFAULT '{}'
+        );
+        CREATE INDEX IF NOT EXISTS players_elo ON players (elo);
+
+        CREATE TABLE IF NOT EXISTS scores (
+            id INTEGER PRIMARY KEY,
+            player TEXT NOT NULL,
+            event TEXT NOT NULL,
+            date TEXT NOT NULL,
+            score INTEGER NOT NULL,
+            list_id INTEGER NOT NULL DEFAULT -1
+        );
+        CREATE INDEX IF NOT EXISTS scores_player_event_date ON scores (player, event, date, score);
+        CREATE INDEX IF NOT EXISTS scores_event_date ON scores (event, date, player, score);
+
+        CREATE TABLE IF NOT EXISTS duels (
+            id INTEGER PRIMARY KEY,
+            date TEXT,
+            player_a TEXT NOT NULL,
+            score_a INTEGER NOT NULL,
+            player_b TEXT NOT NULL,
+            score_b INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS duels_player_a ON duels (player_a, date);
+        CREATE INDEX IF NOT EXISTS duels_player_b ON duels (player_b, date);
+
+        CREATE TABLE IF NOT EXISTS tournaments (
+            name TEXT PRIMARY KEY,
+            state TEXT NOT NULL
+        );
+    '''
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.conn = sqlite3.connect(filepath, check_same_thread=False)
+        self.conn.executescript(SQLiteStorage.SCHEMA)
+        # Databases created before score lists were numbered
+        if "list_id" not in [row[1] for row in self.conn.execute("PRAGMA table_info(scores)")]:
+            self.conn.execute(f"ALTER TABLE scores ADD COLUMN list_id INTEGER NOT NULL DEFAULT {NO_LIST}")
+            self.conn.commit()
+        self._dirty_players = set()
+        self._all_players_dirty = False
+        self._tournament_dirty = False
+
+    def load(self):
+        records = {}
+        for row in self.conn.execute("SELECT id, name, elo, wins, losses, data FROM players"):
+            player, name, elo, wins, losses, data = row
+            info = json.loads(data)
+            info.update({"id": player, "name": name, "elo": elo, "W": wins, "L": losses})
+            info.update({"scores": [], "best": {}, "avg": {}, "totals": {}})
+            records[player] = info
+
+        # Aggregates come from one grouped scan of the covering index instead of the raw rows
+        aggregates = self.conn.execute('''
+            SELECT player, event, COUNT(*), SUM(score), SUM(score * score), MAX(score)
+            FROM scores GROUP BY player, event
+        ''')
+        for player, event, count, total, total_sq, best in aggregates:
+            info = records[player]
+            info["totals"][event] = {"count": count, "sum": total, "sum_sq": total_sq}
+            info["best"][event] = best
+            info["avg"][event] = total / count
+
+        tournaments = {}
+        for name, state in self.conn.execute("SELECT name, state FROM tournaments"):
+            state = json.loads(state)
+            # Earlier versions could save an empty state before any tournament was started
+            if "bracket" in state:
+                tournaments[name] = state
+        tournament_state = {"tournaments": tournaments}
+        (num_score_lists,) = self.conn.execute("SELECT COUNT(DISTINCT list_id) FROM scores WHERE list_id != ?", (NO_LIST,)).fetchone()
+
+        return {"records": records, "tournament_state": tournament_state, "num_score_lists": num_score_lists}, []
+
+    def _player_row(self, info):
+        data = {k: v for k, v in info.items() if k not in SQLiteStorage.PLAYER_COLUMNS and k not in SQLiteStorage.DERIVED_FIELDS}
+        # The rating history is stored in its JSON form, see timeseries.py
+        return (info["id"], info["name"], info["elo"], info["W"], info["L"], json.dumps(data, default=lambda value: value.to_state()))
+
+    def _upsert_players(self, infos):
+        self.conn.executemany('''
+            INSERT INTO players (id, name, elo, wins, losses, data) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                name = excluded.name, elo = excluded.elo, wins = excluded.wins,
+                losses = excluded.losses, data = excluded.data
+        ''', [self._player_row(info) for info in infos])
+
+    def _save_tournament_state(self, tournament_state):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO tournaments (name, state) VALUES (?, ?)",
+            [(name, json.dumps(state)) for name, state in tournament_state["tournaments"].items()]
+        )
+
+    def append(self, entry):
+        op = entry["op"]
+        if op == "record_scores":
+            self.conn.executemany(
+                "INSERT INTO scores (player, event, date, score, list_id) VALUES (?, ?, ?, ?, ?)",
+                [(player, entry["event"], entry["date"], int(score), entry.get("list", NO_LIST)) for player, score in entry["scores"]]
+            )
+            self._dirty_players.update(player for player, _ in entry["scores"])
+        elif op == "challenge_match":
+            self.conn.execute(
+                "INSERT INTO duels (date, player_a, score_a, player_b, score_b) VALUES (?, ?, ?, ?, ?)",
+                (entry["date"], entry["playerA"], entry["scoreA"], entry["playerB"], entry["scoreB"])
+            )
+            self._dirty_players.update([entry["playerA"], entry["playerB"]])
+            self._tournament_dirty = True
+        elif op == "start_tournament":
+            self._dirty_players.update(player for player, _ in entry["players"])
+            self._tournament_dirty = True
+        elif op == "correct_duel":
+            self.conn.execute(
+                "UPDATE duels SET score_a = ?, score_b = ? WHERE id = (SELECT id FROM duels ORDER BY id LIMIT 1 OFFSET ?)",
+                (entry["scoreA"], entry["scoreB"], entry["index"])
+            )
+        elif op == "recompute_ratings":
+            self._all_players_dirty = True
+
+    def commit(self, elo_system):
+        # Player rows and the bracket are written once per command with their final values
+        if self._all_players_dirty:
+            self._upsert_players(elo_system.records.values())
+        else:
+            self._upsert_players(elo_system.records[p] for p in self._dirty_players if p in elo_system.records)
+        if self._tournament_dirty:
+            self._save_tournament_state(elo_system.tournament_state)
+        self.conn.commit()
+        self._dirty_players.clear()
+        self._all_players_dirty = False
+        self._tournament_dirty = False
+
+    def checkpoint(self, elo_system):
+        self.commit(elo_system)
+
+    def close(self):
+        self.conn.close()
+
+    def size_bytes(self):
+        return os.path.getsize(self.filepath) if os.path.exists(self.filepath) else 0
+
+    def import_state(self, elo_system, score_history=None):
+        '''
+        Bulk loads everything in elo_system in a single transaction, replacing
+        what's in the database
+        '''
+        with self.conn:
+            self.conn.execute("DELETE FROM players")
+            self.conn.execute("DELETE FROM scores")
+            self.conn.execute("DELETE FROM duels")
+            self.conn.execute("DELETE FROM tournaments")
+            self._upsert_players(elo_system.records.values())
+            self.conn.executemany(
+                "INSERT INTO scores (player, event, date, score, list_id) VALUES (?, ?, ?, ?, ?)",
+                (
+                    (player, event, day, int(score), list_id)
+                    for player in elo_system.records for day, event, score, list_id in elo_system.iter_scores(player, with_lists=True)
+                )
+            )
+            self.conn.executemany(
+                "INSERT INTO duels (date, player_a, score_a, player_b, score_b) VALUES (?, ?, ?, ?, ?)",
+                elo_system.iter_duels()
+            )
+            self._save_tournament_state(elo_system.tournament_state)
+
+    def iter_duels(self):
+        return self.conn.execute("SELECT date, player_a, score_a, player_b, score_b FROM duels ORDER BY id")
+
+    def iter_scores(self, player, with_lists=False):
+        columns = "date, event, score, list_id" if with_lists else "date, event, score"
+        return self.conn.execute(
+            f"SELECT {columns} FROM scores WHERE player = ? ORDER BY date, id", (player,)
+        )
+
+    def iter_score_lists(self):
+        # (date, event, [(player, score)], list id) lists in the order they were recorded, see ELO_System.iter_score_lists
+        rows = self.conn.execute("SELECT list_id, date, event, player, score FROM scores ORDER BY list_id, id")
+        for list_id, list_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            if list_id == NO_LIST:
+                for _, day, event, player, score in list_rows:
+                    yield (day, event, [(player, score)], NO_LIST)
+                continue
+            list_rows = list(list_rows)
+            yield (list_rows[0][1], list_rows[0][2], [(player, score) for _, _, _, player, score in list_rows], list_id)
+
+    def score_page(self, player, start, count):
+        # The player's (date, event, score) rows start through start+count-1, newest first
+        return self.conn.execute(
+            "SELECT date, event, score FROM scores WHERE player = ? ORDER BY date DESC, id DESC LIMIT ? OFFSET ?",
+            (player, count, start)
+        ).fetchall()
+
+    def score_count(self, player):
+        return self.conn.execute("SELECT COUNT(*) FROM scores WHERE player = ?", (player,)).fetchone()[0]
+
+    def duel_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM duels").fetchone()[0]
+
+    def event_stats(self, player):
+        '''
+        Returns {event: (best, average, count)} for the player
+        '''
+        rows = self.conn.execute('''
+            SELECT event, MAX(score), AVG(score), COUNT(*) FROM scores
+            WHERE player = ? GROUP BY event
+        ''', (player,))
+        return {event: (best, avg, count) for event, best, avg, count in rows}
+
+    def leaderboard(self, metric="elo", event=None, start=0, end=None):
+        '''
+        Returns the (player, value) rows ranked start+1 through end by elo,
+        or by best/avg score in the event
+        '''
+        limit = -1 if end is None else end - start
+        if metric == "elo":
+            return self.conn.execute(
+                "SELECT id, elo FROM players ORDER BY elo DESC, id LIMIT ? OFFSET ?", (limit, start)
+            ).fetchall()
+
+        aggregate = {"best": "MAX(score)", "avg": "AVG(score)"}[metric]
+        return self.conn.execute(f'''
+            SELECT player, {aggregate} AS value FROM scores WHERE event = ?
+            GROUP BY player ORDER BY value DESC, player LIMIT ? OFFSET ?
+        ''', (event, limit, start)).fetchall()
+
+    def player_stats(self, player):
+        row = self.conn.execute(
+            "SELECT id, name, elo, wins, losses FROM players WHERE id = ?", (player,)
+        ).fetchone()
+        if not row:
+            return None
+        player, name, elo, wins, losses = row
+        return {"id": player, "name": name, "elo": elo, "W": wins, "L": losses, "events": self.event_stats(player)}
+
+
+def open_storage(backend, filepath=None, snapshot_format=None):
+    '''
+    backend is "journal" (snapshot + journal), "json" (snapshot rewritten on
+    every save) or "sqlite". snapshot_format is passed on to JSONStorage.
+    '''
+    if backend == "sqlite":
+        return SQLiteStorage(filepath or "state.db")
+    if backend in ["json", "journal"]:
+        return JSONStorage(filepath or "state.json", use_journal=backend == "journal", snapshot_format=snapshot_format)
+    raise ValueError(f"Unknown storage backend {backend}")
@@ -0,0 +1,6 @@
+import os
+
+# elo_bot reads its configuration on import
+for name in ["SLACK_SIGNING_SECRET", "SLACK_BOT_TOKEN", "VERIFICATION_TOKEN"]:
+    os.environ.setdefault(name, "test")
+os.environ.setdefault("ELO_BOT_CHANNEL_ID", "CTEST")
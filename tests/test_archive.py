@@ -0,0 +1,40 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from archive import ScoreArchive
+from player import EVENTS, NO_LIST
+
+
+def random_scores(rng, players, start, days):
+    return {player: sorted(((start + timedelta(days=rng.randint(0, days))).isoformat(), rng.choice(EVENTS), rng.randint(100, 654), rng.choice([NO_LIST, 1, 2]))
+                           for _ in range(rng.randint(1, 40))) for player in players}
+
+
+def newest_first(rows):
+    return [row[:3] for row in reversed(rows)]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_pages_match_the_whole_history(tmp_path, seed):
+    rng = random.Random(seed)
+    players = [f"<@U{k}>" for k in range(6)]
+    archive = ScoreArchive(str(tmp_path))
+    # Two generations over three seasons, the second rewrites one of the first's
+    first = random_scores(rng, players[:4], date(2022, 6, 1), 400)
+    archive.add(first, "2023-07-06", 1)
+    second = random_scores(rng, players[2:], date(2023, 7, 6), 300)
+    archive.add(second, "2024-05-01", 2)
+
+    archive = ScoreArchive(str(tmp_path))
+    for player in players:
+        # Same-day rows keep the order they were added in
+        history = sorted(first.get(player, []) + second.get(player, []), key=lambda row: row[0])
+        assert list(archive.iter_scores(player, with_lists=True)) == history
+        assert archive.count(player) == len(history)
+        for count in [1, 3, 10]:
+            for start in range(0, len(history) + 2, 2):
+                assert archive.page(player, start, count) == newest_first(history)[start:start + count]
+    assert archive.page("<@UNOBODY>", 0, 10) == []
+    assert archive.archived_before(1) == "2023-07-06" and archive.generation == 2
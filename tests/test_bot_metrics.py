@@ -0,0 +1,39 @@
+import os
+
+import elo_bot
+import metrics
+
+
+def test_unknown_paths_share_one_route_label(monkeypatch, tmp_path):
+    monkeypatch.setattr(elo_bot, "ELO_PROFILE_DIR", str(tmp_path))
+    client = elo_bot.app.test_client()
+    for i in range(5):
+        assert client.get(f"/no/such/path/{i}").status_code == 404
+    client.get("/metrics", headers={"X-Profile": "1"})
+    rendered = metrics.render()
+    assert 'route="unmatched"' in rendered
+    assert "/no/such/path" not in rendered
+    assert 'route="/metrics"' in rendered
+
+
+def test_profile_header_needs_the_admin_token(monkeypatch, tmp_path):
+    monkeypatch.setattr(elo_bot, "ELO_PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(elo_bot, "ELO_ADMIN_TOKEN", "secret")
+    client = elo_bot.app.test_client()
+    client.get("/metrics", headers={"X-Profile": "1"})
+    assert not os.listdir(tmp_path)
+    client.get("/metrics", headers={"X-Profile": "1", "Authorization": "Bearer secret"})
+    assert [name.split("-")[0] for name in os.listdir(tmp_path)] == ["metrics"]
+
+
+def test_retry_label_is_bounded():
+    route = metrics.current_route()
+    before = {retry: metrics.DUPLICATE_DELIVERIES.value(route=route, retry=retry) for retry in ["2", "other"]}
+    for retry in ["2", "7", 'x"}']:
+        with elo_bot.app.test_request_context(headers={"X-Slack-Retry-Num": retry}):
+            key = ("retry-label", retry)
+            assert not elo_bot.is_duplicate(key)
+            assert elo_bot.is_duplicate(key)
+    assert metrics.DUPLICATE_DELIVERIES.value(route=route, retry="2") == before["2"] + 1
+    assert metrics.DUPLICATE_DELIVERIES.value(route=route, retry="other") == before["other"] + 2
+    assert 'retry="7"' not in metrics.render()
@@ -0,0 +1,136 @@
+import io
+import json
+
+import pytest
+
+import bulk
+from elo_system import ELO_System
+from player import NO_LIST
+from ratings import make_engine
+from storage import JSONStorage, open_storage
+
+SCORE_LISTS = [
+    ("2024-03-02", "air", [("<@U1>", 552), ("<@U2>", 538)]),
+    ("2024-03-02", "air", [("<@U3>", 541), ("<@U4>", 530)]),
+    ("2024-03-02", "air", [("<@U1>", 560), ("<@U3>", 549), ("<@U2>", 520)]),
+    ("2024-03-09", "sport", [("<@U2>", 570)]),
+    ("2023-11-20", "air", [("<@U4>", 511), ("<@U1>", 533)])
+]
+
+
+def record(elo_system):
+    for day, event, scores in SCORE_LISTS:
+        elo_system.record_scores(event, scores, day)
+    elo_system.challenge_match("<@U1>", 6, "<@U2>", 4, "2024-03-02")
+    elo_system.save()
+
+
+def exported(elo_system, format):
+    return "".join(bulk.export(elo_system, format))
+
+
+def score_lists(text, format):
+    # Players within a list may come out in a different order
+    rows = bulk.read_rows(io.StringIO(text), format)
+    return [(row["date"], row["event"], sorted(map(tuple, row["scores"]))) for _, row in rows if row["type"] == "scores"]
+
+
+def sorted_lists(lists):
+    return [(day, event, sorted(scores)) for day, event, scores in lists]
+
+
+@pytest.mark.parametrize("backend, snapshot_format", [("journal", "json"), ("journal", "binary"), ("sqlite", None)])
+@pytest.mark.parametrize("format", bulk.FORMATS)
+def test_export_keeps_score_lists(tmp_path, backend, snapshot_format, format):
+    path = str(tmp_path / ("state.db" if backend == "sqlite" else "state.json"))
+    elo_system = ELO_System.from_storage(open_storage(backend, path, snapshot_format))
+    record(elo_system)
+    elo_system.checkpoint()
+    elo_system.close()
+
+    # From the snapshot, and again after replaying a journaled list on top of it
+    elo_system = ELO_System.from_storage(open_storage(backend, path, snapshot_format))
+    assert score_lists(exported(elo_system, format), format) == sorted_lists(SCORE_LISTS)
+    elo_system.record_scores("air", [("<@U2>", 555), ("<@U4>", 544)], "2024-03-10")
+    elo_system.save()
+    elo_system.close()
+    elo_system = ELO_System.from_storage(open_storage(backend, path, snapshot_format))
+    assert score_lists(exported(elo_system, format), format) == sorted_lists(SCORE_LISTS + [("2024-03-10", "air", [("<@U2>", 555), ("<@U4>", 544)])])
+    elo_system.close()
+
+
+def test_archived_scores_keep_their_lists(tmp_path):
+    elo_system = ELO_System.from_storage(JSONStorage(str(tmp_path / "state.json")))
+    record(elo_system)
+    assert elo_system.archive_scores("2024-03-05") == 9
+    elo_system.save()
+    assert score_lists(exported(elo_system, "csv"), "csv") == sorted_lists(SCORE_LISTS)
+    elo_system.close()
+
+
+def test_import_round_trip(tmp_path):
+    elo_system = ELO_System({}, {})
+    record(elo_system)
+    text = exported(elo_system, "csv")
+
+    imported = ELO_System({}, {})
+    assert bulk.import_rows(imported, bulk.read_rows(io.StringIO(text), "csv")) == {"scores": len(SCORE_LISTS), "duels": 1}
+    assert exported(imported, "csv") == text
+
+
+def test_scores_without_list_ids_are_lists_of_their_own(tmp_path):
+    path = tmp_path / "state.json"
+    # Written before score lists were numbered
+    path.write_text(json.dumps({"records": {
+        "<@U1>": {"id": "<@U1>", "scores": [["2024-03-02", "air", 552]], "elo": 1500},
+        "<@U2>": {"id": "<@U2>", "scores": [["2024-03-02", "air", 538]], "elo": 1500}
+    }, "tournament_state": {}}))
+    elo_system = ELO_System.from_storage(JSONStorage(str(path), use_journal=False))
+    elo_system.record_scores("air", [("<@U1>", 540), ("<@U2>", 545)], "2024-03-03")
+    assert list(elo_system.iter_score_lists()) == [
+        ("2024-03-02", "air", [("<@U1>", 552)], NO_LIST),
+        ("2024-03-02", "air", [("<@U2>", 538)], NO_LIST),
+        ("2024-03-03", "air", [("<@U1>", 540), ("<@U2>", 545)], 0)
+    ]
+
+
+def interleaved_history(elo_system):
+    # Lists and duels alternate, some of them backdated
+    elo_system.challenge_match("<@U1>", 6, "<@U2>", 4, "2024-03-01")
+    for k, (day, event, scores) in enumerate(SCORE_LISTS):
+        elo_system.record_scores(event, scores, day)
+        elo_system.challenge_match(scores[0][0], 3 + k, "<@U4>" if scores[0][0] != "<@U4>" else "<@U3>", 5, day)
+    elo_system.challenge_match("<@U3>", 7, "<@U2>", 2, "2024-02-01")
+
+
+@pytest.mark.parametrize("backend", ["journal", "sqlite"])
+def test_export_keeps_lists_and_duels_in_recorded_order(tmp_path, backend):
+    path = str(tmp_path / ("state.db" if backend == "sqlite" else "state.json"))
+    elo_system = ELO_System.from_storage(open_storage(backend, path), engine=make_engine("plackett-luce"))
+    interleaved_history(elo_system)
+    for format in bulk.FORMATS:
+        text = exported(elo_system, format)
+        rows = [row for _, row in bulk.read_rows(io.StringIO(text), format)]
+        assert [row["type"] for row in rows] == ["duel"] + ["scores", "duel"] * len(SCORE_LISTS) + ["duel"]
+
+        # Plackett-Luce rates lists and duels alike, replaying them in another order would change the ratings
+        imported = ELO_System({}, {}, engine=make_engine("plackett-luce"))
+        bulk.import_rows(imported, bulk.read_rows(io.StringIO(text), format))
+        assert {player: info["elo"] for player, info in imported.records.items()} == pytest.approx(
+            {player: info["elo"] for player, info in elo_system.records.items()})
+    elo_system.close()
+
+
+def test_csv_groups_by_list_column():
+    text = "\n".join([
+        ",".join(bulk.CSV_FIELDS),
+        "score,2024-03-02,air,U1,552,,,a",
+        "score,2024-03-02,air,U2,538,,,a",
+        "score,2024-03-02,air,U3,541,,,b",
+        "score,2024-03-02,air,U4,530,,,",
+        "score,2024-03-02,air,U5,530,,,"
+    ])
+    assert [len(scores) for _, _, scores in score_lists(text, "csv")] == [2, 1, 1, 1]
+
+    with pytest.raises(bulk.BulkError):
+        list(bulk.read_csv(io.StringIO("type,date,event,player,score,list\nscore,2024-03-02,air,U1,552,a\nscore,2024-03-03,air,U2,538,a\n")))
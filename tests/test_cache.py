@@ -0,0 +1,58 @@
+from cache import ResponseCache
+from elo_system import ELO_System
+
+
+def cached_stats(cache, elo_system, player, built):
+    # How /stats keys its response
+    def build():
+        built.append(player)
+        return elo_system.get_info(player)["elo"]
+    return cache.get_or_build(("stats", player), elo_system.cache_versions(("player", player)), build)
+
+
+def test_entries_are_rebuilt_when_their_tags_change():
+    cache = ResponseCache()
+    elo_system = ELO_System({}, {})
+    elo_system.challenge_match("<@U1>", 6, "<@U2>", 4, "2024-03-02")
+    built = []
+    elo = cached_stats(cache, elo_system, "<@U1>", built)
+    assert cached_stats(cache, elo_system, "<@U1>", built) == elo
+    assert built == ["<@U1>"]
+
+    # Another player's scores leave the entry as it is
+    elo_system.record_scores("air", [("<@U3>", 550)], "2024-03-02")
+    cached_stats(cache, elo_system, "<@U1>", built)
+    assert built == ["<@U1>"]
+
+    elo_system.challenge_match("<@U1>", 2, "<@U2>", 8, "2024-03-03")
+    assert cached_stats(cache, elo_system, "<@U1>", built) < elo
+    assert built == ["<@U1>", "<@U1>"]
+
+
+def test_entries_are_rebuilt_after_a_new_epoch():
+    cache = ResponseCache()
+    elo_system = ELO_System({}, {})
+    elo_system.challenge_match("<@U1>", 6, "<@U2>", 4, "2024-03-02")
+    built = []
+    cached_stats(cache, elo_system, "<@U1>", built)
+    # Recomputing rebuilds every index without bumping each tag
+    elo_system.recompute_ratings(expected_constant=300, day="2024-03-03")
+    cached_stats(cache, elo_system, "<@U1>", built)
+    assert built == ["<@U1>", "<@U1>"]
+
+    # A league reloaded from disk starts at a new epoch too
+    other = ELO_System({}, {})
+    other.challenge_match("<@U1>", 6, "<@U2>", 4, "2024-03-02")
+    assert other.cache_versions(("player", "<@U1>")) != elo_system.cache_versions(("player", "<@U1>"))
+
+
+def test_least_recently_used_entries_are_dropped():
+    cache = ResponseCache(max_entries=2)
+    for key in ["a", "b", "a", "c"]:
+        cache.get_or_build(key, (0,), lambda: key)
+    assert len(cache) == 2
+    built = []
+    # "a" was used after "b", so "b" went
+    cache.get_or_build("a", (0,), lambda: built.append("a"))
+    cache.get_or_build("b", (0,), lambda: built.append("b"))
+    assert built == ["b"]
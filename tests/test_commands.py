@@ -0,0 +1,26 @@
+from datetime import date
+
+import pytest
+
+import commands
+from commands import ParseError
+
+TODAY = date(2026, 10, 17)
+
+
+@pytest.mark.parametrize("text, pos", [
+    ("air --last 999999999", 11),
+    ("air --last 0", 11),
+    ("air --season 99999", 13),
+    ("air --season 0", 13)
+])
+def test_out_of_range_windows_are_rejected(text, pos):
+    with pytest.raises(ParseError) as e:
+        commands.parse_leaderboard(text, today=TODAY)
+    assert e.value.pos == pos
+
+
+def test_widest_windows():
+    assert commands.parse_leaderboard(f"air --last {TODAY.toordinal()}", today=TODAY).since == "0001-01-01"
+    assert commands.parse_leaderboard("air --season 9999", today=TODAY).until == "9999-12-31"
+
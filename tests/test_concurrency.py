@@ -0,0 +1,110 @@
+import json
+import math
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import elo_bot
+from elo_system import ELO_System
+from shards import ShardManager
+from storage import open_storage
+
+NUM_PLAYERS = 30
+
+
+def random_commands(num_commands, seed=0):
+    # ("duel", playerA, scoreA, playerB, scoreB) and ("scores", [(player, score)]) commands
+    rng = random.Random(seed)
+    commands = []
+    for _ in range(num_commands):
+        if rng.random() < 0.5:
+            a, b = rng.sample(range(NUM_PLAYERS), 2)
+            commands.append(("duel", f"<@U{a}>", rng.randint(0, 10), f"<@U{b}>", rng.randint(0, 10)))
+        else:
+            commands.append(("scores", [(f"<@U{p}>", rng.randint(500, 600)) for p in rng.sample(range(NUM_PLAYERS), 5)]))
+    return commands
+
+
+def assert_nothing_lost(elo_system, commands):
+    duels = [command for command in commands if command[0] == "duel"]
+    decisive = sum(scoreA != scoreB for _, _, scoreA, _, scoreB in duels)
+    expected_scores = Counter(player for command in commands if command[0] == "scores" for player, _ in command[1])
+    records = elo_system.records
+
+    assert len(list(elo_system.iter_duels())) == len(duels)
+    assert sum(info["W"] for info in records.values()) == sum(info["L"] for info in records.values()) == decisive
+    # Elo is zero-sum, a lost or doubled update would show in the total
+    assert math.isclose(sum(info["elo"] for info in records.values()), ELO_System.BASE_ELO * len(records))
+    assert {player: records[player]["totals"]["air"]["count"] for player in expected_scores} == dict(expected_scores)
+
+
+def state(elo_system):
+    # Compared through JSON since tuples come back as lists
+    return json.loads(json.dumps(elo_system.to_state()))
+
+
+def test_concurrent_mutations_lose_no_updates(tmp_path):
+    path = str(tmp_path / "state.json")
+    elo_system = ELO_System.from_storage(open_storage("journal", path))
+    commands = random_commands(2000)
+    done = threading.Event()
+    read_errors = []
+
+    def run(command):
+        if command[0] == "duel":
+            elo_system.challenge_match(*command[1:], "2024-03-02")
+        else:
+            elo_system.record_scores("air", command[1], "2024-03-02")
+        elo_system.save()
+
+    def read():
+        # Readers don't take the lock, every published view must be whole
+        while not done.is_set():
+            for player in ["<@U0>", "<@U1>"]:
+                info = elo_system.get_info(player)
+                totals = info["totals"].get("air")
+                if totals and not math.isclose(totals["sum"] / totals["count"], info["avg"]["air"]):
+                    read_errors.append(player)
+            elo_system.get_leaderboard("air")
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    with ThreadPoolExecutor(16) as pool:
+        list(pool.map(run, commands))
+    done.set()
+    reader.join()
+
+    assert read_errors == []
+    assert_nothing_lost(elo_system, commands)
+    expected = state(elo_system)
+    elo_system.close()
+    reloaded = ELO_System.from_storage(open_storage("journal", path))
+    assert state(reloaded) == expected
+    reloaded.close()
+
+
+@pytest.mark.parametrize("num_threads", [1, 16])
+def test_concurrent_requests_lose_no_updates(monkeypatch, tmp_path, num_threads):
+    monkeypatch.setattr(elo_bot, "ELO_STATE_PATH", str(tmp_path / "state.json"))
+    monkeypatch.setattr(elo_bot, "shards", ShardManager(elo_bot.open_shard))
+    client = elo_bot.app.test_client()
+    commands = random_commands(600, seed=num_threads)
+
+    def post(command):
+        if command[0] == "duel":
+            _, playerA, scoreA, playerB, scoreB = command
+            path, text = "/duel", f"{playerA} {scoreA} - {scoreB} {playerB}"
+        else:
+            path, text = "/record", "air " + " ".join(f"{player} {score}" for player, score in command[1])
+        data = {"token": elo_bot.VERIFICATION_TOKEN, "channel_id": elo_bot.ELO_BOT_CHANNEL_ID, "text": text}
+        assert client.post(path, data=data).status_code == 200
+
+    with ThreadPoolExecutor(num_threads) as pool:
+        list(pool.map(post, commands))
+
+    with elo_bot.shards.use("default", elo_bot.ELO_BOT_CHANNEL_ID) as elo_system:
+        assert_nothing_lost(elo_system, commands)
+    elo_bot.shards.close()
@@ -0,0 +1,64 @@
+from dedup import DedupCache
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ids_expire_after_the_ttl(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr("time.time", clock)
+    deliveries = DedupCache(ttl=60)
+    assert deliveries.claim("Ev1")
+    assert not deliveries.claim("Ev1")
+    clock.now += 59
+    assert not deliveries.claim("Ev1")
+    clock.now += 1
+    assert deliveries.claim("Ev1")
+    # Deliveries without an id are never duplicates
+    assert deliveries.claim(None) and deliveries.claim(None)
+
+
+def test_released_ids_can_be_claimed_again():
+    deliveries = DedupCache()
+    assert deliveries.claim("Ev1")
+    deliveries.release("Ev1")
+    assert deliveries.claim("Ev1")
+
+
+def test_oldest_ids_go_first_when_full():
+    deliveries = DedupCache(max_entries=2)
+    for key in ["Ev1", "Ev2", "Ev3"]:
+        assert deliveries.claim(key)
+    assert len(deliveries) == 2
+    assert deliveries.claim("Ev1")
+    assert not deliveries.claim("Ev3")
+
+
+def test_ids_come_back_from_the_journal(monkeypatch, tmp_path):
+    clock = FakeTime()
+    monkeypatch.setattr("time.time", clock)
+    path = str(tmp_path / "dedup.json")
+    deliveries = DedupCache(path, ttl=60)
+    for key in ["Ev1", "Ev2", "Ev3"]:
+        deliveries.claim(key)
+        clock.now += 10
+    deliveries.release("Ev2")
+    # Not closed, as after a crash: everything is in the journal only
+    deliveries.journal.sync()
+
+    reloaded = DedupCache(path, ttl=60)
+    assert not reloaded.claim("Ev1") and not reloaded.claim("Ev3")
+    assert reloaded.claim("Ev2")
+    reloaded.close()
+
+    # Expired while the process was down
+    clock.now += 45
+    reloaded = DedupCache(path, ttl=60)
+    assert reloaded.claim("Ev1")
+    assert not reloaded.claim("Ev3")
+    reloaded.close()
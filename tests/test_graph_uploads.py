@@ -0,0 +1,29 @@
+import elo_bot
+from fake_slack import FakeSlackServer
+from shards import ShardManager
+from slack_client import SlackClient
+
+
+def test_graph_is_uploaded_once_then_linked(monkeypatch, tmp_path):
+    monkeypatch.setattr(elo_bot, "ELO_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(elo_bot, "GRAPH_IMG_DIR", str(tmp_path / "graphs"))
+    monkeypatch.setattr(elo_bot, "graph_uploads", {})
+    monkeypatch.setattr(elo_bot, "shards", ShardManager(elo_bot.open_shard))
+    with elo_bot.shards.use("T1", "C5") as elo_system:
+        elo_system.challenge_match("<@U1>", 6, "<@U2>", 4, "2024-03-02")
+        elo_system.challenge_match("<@U1>", 5, "<@U2>", 3, "2024-03-03")
+
+    with FakeSlackServer() as server:
+        monkeypatch.setattr(elo_bot, "slack_client", SlackClient("xoxb-test", base_url=server.url))
+        client = elo_bot.app.test_client()
+        form = {"token": elo_bot.VERIFICATION_TOKEN, "team_id": "T1", "channel_id": "C5", "text": "<@U1> graph"}
+        texts = []
+        for _ in range(3):
+            texts.append(client.post("/stats", data=form).get_json()["text"])
+            elo_bot.slack_client.join()
+        elo_bot.slack_client.close()
+    elo_bot.shards.close()
+
+    assert len(server.calls_to("/api/files.completeUploadExternal")) == 1
+    assert "https://fake.slack.com/files/F1" not in texts[0]
+    assert all("<https://fake.slack.com/files/F1|Rating graph>" in text for text in texts[1:])
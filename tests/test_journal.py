@@ -0,0 +1,98 @@
+import os
+
+import pytest
+
+from elo_system import ELO_System
+from journal import Journal
+from storage import JSONStorage
+
+
+def write_entries(path, count):
+    journal = Journal(str(path))
+    for k in range(count):
+        journal.append({"op": "test", "k": k})
+    journal.close()
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    path = tmp_path / "state.json"
+    write_entries(path, 3)
+    journal_path = tmp_path / "state.json.journal"
+    lines = journal_path.read_bytes().splitlines(keepends=True)
+
+    # Cut off mid-line, and cut off right before the newline of a line that parses
+    for torn in [lines[2][:len(lines[2]) // 2], lines[2][:-1]]:
+        journal_path.write_bytes(b"".join(lines[:2]) + torn)
+        journal = Journal(str(path))
+        assert [entry["k"] for entry in journal.replay_entries()] == [0, 1]
+        assert journal_path.read_bytes() == b"".join(lines[:2])
+        # New entries go after the last whole one
+        journal.append({"op": "test", "k": 2})
+        journal.close()
+        assert [entry["seq"] for entry in Journal(str(path)).replay_entries()] == [1, 2, 3]
+
+
+def test_entries_in_the_snapshot_are_skipped(tmp_path):
+    path = tmp_path / "state.json"
+    write_entries(path, 5)
+    journal = Journal(str(path), snapshot_seq=3)
+    assert [entry["seq"] for entry in journal.replay_entries()] == [4, 5]
+    journal.append({"op": "test"})
+    journal.close()
+    assert [entry["seq"] for entry in Journal(str(path), snapshot_seq=3).replay_entries()] == [4, 5, 6]
+
+
+def record(elo_system, days):
+    for day in days:
+        elo_system.record_scores("air", [("<@U1>", 550), ("<@U2>", 540)], day)
+        elo_system.challenge_match("<@U1>", 6, "<@U2>", 4, day)
+        elo_system.save()
+
+
+def league(elo_system):
+    return {player: (list(info["scores"]), info["elo"], info["W"], info["L"]) for player, info in elo_system.records.items()}
+
+
+@pytest.mark.parametrize("snapshot_format", ["json", "binary"])
+def test_replay_after_compaction(tmp_path, snapshot_format):
+    path = str(tmp_path / "state.json")
+    elo_system = ELO_System.from_storage(JSONStorage(path, snapshot_format=snapshot_format))
+    record(elo_system, ["2024-03-01", "2024-03-02"])
+    elo_system.checkpoint()
+    assert os.path.getsize(f"{path}.journal") == 0
+    record(elo_system, ["2024-03-03"])
+    expected = league(elo_system)
+    elo_system.close()
+
+    elo_system = ELO_System.from_storage(JSONStorage(path, snapshot_format=snapshot_format))
+    assert league(elo_system) == expected
+    assert elo_system.storage.journal.seq == 6
+    elo_system.close()
+
+
+@pytest.mark.parametrize("snapshot_format", ["json", "binary"])
+def test_crash_between_snapshot_and_truncation(tmp_path, snapshot_format):
+    path = str(tmp_path / "state.json")
+    elo_system = ELO_System.from_storage(JSONStorage(path, snapshot_format=snapshot_format))
+    record(elo_system, ["2024-03-01", "2024-03-02"])
+    expected = league(elo_system)
+
+    storage = elo_system.storage
+
+    def write_snapshot_then_crash(seq):
+        storage._write_snapshot(elo_system, seq)
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        storage.journal.compact(write_snapshot_then_crash)
+    storage.journal._file.close()
+    assert os.path.getsize(f"{path}.journal") > 0
+
+    # The snapshot holds every entry the journal still has, none are applied twice
+    elo_system = ELO_System.from_storage(JSONStorage(path, snapshot_format=snapshot_format))
+    assert league(elo_system) == expected
+    record(elo_system, ["2024-03-03"])
+    expected = league(elo_system)
+    elo_system.close()
+    elo_system = ELO_System.from_storage(JSONStorage(path, snapshot_format=snapshot_format))
+    assert league(elo_system) == expected
+    elo_system.close()
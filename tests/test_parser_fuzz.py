@@ -0,0 +1,144 @@
+import random
+import re
+
+import pytest
+
+import commands
+from commands import ParseError
+
+MENTION = r"<(@[A-Z0-9]*)(?:\|([a-z0-9._-]*))?>"
+MUTATION_CHARS = " -<>@|0123456789AUZairsportstandardpistolx\t\n"
+
+
+# Regex references for well-formed commands, as elo_bot matched them before the parser
+
+def reference_score_list(text):
+    match = re.fullmatch(rf"(?:<@[A-Z0-9]*>\s*)?((?i:air|sport|standard))(?:\s*(?i:pistol))?((?:\s*{MENTION}\s*\d+)*)\s*", text)
+    scores = re.findall(rf"{MENTION}\s*(\d+)", match.group(2))
+    return commands.ScoreList(match.group(1).lower(), [(f"<{player}>", int(score)) for player, _, score in scores])
+
+
+def reference_duel(text):
+    match = re.fullmatch(rf"(?:<@[A-Z0-9]*>\s*)?{MENTION}\s*(\d+)\s*-\s*(\d+)\s*{MENTION}", text)
+    playerA, _, scoreA, scoreB, playerB, _ = match.groups()
+    return commands.Duel(f"<{playerA}>", int(scoreA), int(scoreB), f"<{playerB}>")
+
+
+def reference_tournament(text):
+    name = re.match(r"\s*([\w-]+)", text)
+    players = re.findall(MENTION, text)
+    return commands.TournamentStart(name.group(1) if name else "default", [(f"<{player}>", username) for player, username in players])
+
+
+def random_space(rng):
+    return rng.choice(["", " ", " ", "  ", "\t"])
+
+
+def random_id(rng):
+    return "U" + "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789") for _ in range(rng.randint(1, 10)))
+
+
+def random_mention(rng, user_id=None):
+    user_id = user_id or random_id(rng)
+    if rng.random() < 0.5:
+        return f"<@{user_id}|{rng.choice(['ann', 'bob.smith', 'c_d', 'e-f'])}>"
+    return f"<@{user_id}>"
+
+
+def random_event(rng):
+    event = rng.choice(["air", "sport", "standard"])
+    event = rng.choice([event, event.upper(), event.capitalize()])
+    if rng.random() < 0.5:
+        event += random_space(rng) + rng.choice(["pistol", "Pistol"])
+    return event
+
+
+def bot_mention(rng):
+    # Slash commands don't have one, mentions of the bot start with it
+    return f"<@{random_id(rng)}> " if rng.random() < 0.5 else ""
+
+
+def generate_score_list(rng, bot=None):
+    parts = [random_event(rng)]
+    for _ in range(rng.randint(0, 12)):
+        parts += [random_mention(rng), str(rng.randint(0, 654))]
+    return (bot if bot is not None else bot_mention(rng)) + " ".join(parts)
+
+
+def generate_duel(rng, bot=None):
+    playerA, playerB = random_id(rng), random_id(rng)
+    while playerB == playerA:
+        playerB = random_id(rng)
+    return "".join([
+        bot if bot is not None else bot_mention(rng), random_mention(rng, playerA), random_space(rng) or " ",
+        str(rng.randint(0, 20)), random_space(rng), "-", random_space(rng), str(rng.randint(0, 20)),
+        random_space(rng) or " ", random_mention(rng, playerB)
+    ])
+
+
+def generate_tournament(rng):
+    parts = [rng.choice(["spring-open", "league_2", "Finals"])] if rng.random() < 0.5 else []
+    user_ids = {random_id(rng) for _ in range(rng.randint(1, 16))}
+    return " ".join(parts + [random_mention(rng, user_id) for user_id in user_ids])
+
+
+def mutate(rng, text):
+    chars = list(text)
+    for _ in range(rng.randint(1, 3)):
+        pos = rng.randint(0, len(chars))
+        action = rng.random()
+        if action < 0.4:
+            chars.insert(pos, rng.choice(MUTATION_CHARS))
+        elif action < 0.7 and pos < len(chars):
+            del chars[pos]
+        elif pos < len(chars):
+            chars[pos] = rng.choice(MUTATION_CHARS)
+    return "".join(chars)
+
+
+CASES = [
+    # (generator, parser, reference)
+    (generate_score_list, commands.parse_score_list, reference_score_list),
+    (generate_duel, commands.parse_duel, reference_duel),
+    (generate_tournament, commands.parse_tournament, reference_tournament)
+]
+
+
+@pytest.mark.parametrize("generate, parse, reference", CASES)
+@pytest.mark.parametrize("seed", range(3))
+def test_parser_matches_the_regex_reference(generate, parse, reference, seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        text = generate(rng)
+        assert parse(text) == reference(text), text
+
+
+@pytest.mark.parametrize("generate, parse, reference", CASES)
+@pytest.mark.parametrize("seed", range(3))
+def test_mutated_commands_parse_or_point_into_the_text(generate, parse, reference, seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        text = mutate(rng, generate(rng))
+        try:
+            parse(text)
+        except ParseError as e:
+            assert 0 <= e.pos <= len(text), text
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_mentions_parse_as_score_lists_or_duels(seed):
+    rng = random.Random(seed)
+    for _ in range(500):
+        bot = f"<@{random_id(rng)}> "
+        if rng.random() < 0.5:
+            text = generate_score_list(rng, bot)
+            expected = reference_score_list(text)
+            if not expected.scores:
+                # A mention needs at least one score
+                with pytest.raises(ParseError):
+                    commands.parse_mention(text)
+                continue
+        else:
+            text = generate_duel(rng, bot)
+            expected = reference_duel(text)
+        assert commands.parse_mention(text) == expected, text
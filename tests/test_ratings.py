@@ -0,0 +1,51 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from elo_system import ELO_System
+from ratings import PlackettLuceEngine, make_engine
+
+
+def play_duels(elo_system, num_duels=300, seed=0):
+    # A few duels a day over a few months, so Glicko-2 closes rating periods along the way and
+    # some players sit periods out
+    rng = random.Random(seed)
+    players = [f"<@U{k}>" for k in range(12)]
+    for k in range(num_duels):
+        playerA, playerB = rng.sample(players, 2)
+        day = (date(2024, 1, 1) + timedelta(days=k // 3)).isoformat()
+        elo_system.challenge_match(playerA, rng.randint(0, 10), playerB, rng.randint(0, 10), day)
+
+
+@pytest.mark.parametrize("engine", ["elo", "glicko2"])
+def test_recompute_matches_live_ratings(engine):
+    elo_system = ELO_System({}, {}, engine=make_engine(engine))
+    play_duels(elo_system)
+    live = {player: (info["elo"], info["W"], info["L"]) for player, info in elo_system.records.items()}
+
+    elo_system.recompute_ratings(day="2024-06-01")
+    for player, info in elo_system.records.items():
+        elo, wins, losses = live[player]
+        assert info["elo"] == pytest.approx(elo, abs=1e-6)
+        assert (info["W"], info["L"]) == (wins, losses)
+
+
+def test_plackett_luce_ranks_by_score():
+    elo_system = ELO_System({}, {}, engine=PlackettLuceEngine())
+    elo_system.record_scores("air", [("<@U1>", 570), ("<@U2>", 550), ("<@U3>", 530), ("<@U4>", 510)], "2024-03-02")
+    elos = [elo_system.records[f"<@U{k}>"]["elo"] for k in range(1, 5)]
+    assert elos == sorted(elos, reverse=True)
+    assert elos[0] > ELO_System.BASE_ELO > elos[-1]
+
+    # The winner of a duel gains what the loser gives up, more so for an upset
+    _, _, (deltaA, deltaB), _ = elo_system.challenge_match("<@U4>", 6, "<@U1>", 2, "2024-03-03")
+    assert deltaA > 0 > deltaB
+    _, _, (favourite_delta, _), _ = elo_system.challenge_match("<@U2>", 6, "<@U3>", 2, "2024-03-03")
+    assert deltaA > favourite_delta > 0
+
+
+def test_plackett_luce_cant_recompute_from_duels():
+    elo_system = ELO_System({}, {}, engine=PlackettLuceEngine())
+    with pytest.raises(ValueError):
+        elo_system.recompute_ratings()
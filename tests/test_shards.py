@@ -0,0 +1,123 @@
+import threading
+
+import elo_bot
+from elo_system import ELO_System
+from shards import ShardManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_shards_in_use_are_not_evicted(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("time.monotonic", clock)
+    closed = []
+
+    def open_shard(team_id, channel_id):
+        elo_system = ELO_System({}, {})
+        monkeypatch.setattr(elo_system, "close", lambda: closed.append((team_id, channel_id)))
+        return elo_system
+
+    shards = ShardManager(open_shard, idle_timeout=10, evict_interval=0)
+    with shards.use("T1", "C1") as elo_system:
+        shards.get("T1", "C2")
+        clock.now = 100
+        shards.evict_idle()
+        assert closed == [("T1", "C2")]
+        elo_system.record_scores("air", [("<@U1>", 550)])
+        # Idle again from when the block ended
+    clock.now = 105
+    shards.evict_idle()
+    assert closed == [("T1", "C2")]
+    clock.now = 110
+    shards.evict_idle()
+    assert closed == [("T1", "C2"), ("T1", "C1")]
+
+
+def test_streaming_export_holds_the_league(monkeypatch, tmp_path):
+    monkeypatch.setattr(elo_bot, "ELO_ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(elo_bot, "ELO_STATE_DIR", str(tmp_path))
+    monkeypatch.setattr(elo_bot, "shards", ShardManager(elo_bot.open_shard, idle_timeout=0, evict_interval=0))
+    with elo_bot.shards.use("T1", "C9") as elo_system:
+        for k in range(3000):
+            elo_system.record_scores("air", [(f"<@U{k}>", 500 + k % 100)], "2024-03-02")
+
+    client = elo_bot.app.test_client()
+    response = client.get("/export?team_id=T1&channel_id=C9&format=csv", headers={"Authorization": "Bearer secret"}, buffered=False)
+    chunks = response.response
+    first = next(chunks)
+    # Another request's eviction pass while the export is still streaming
+    elo_bot.shards.get("T1", "C10")
+    assert ("T1", "C9") in elo_bot.shards._shards
+    body = first + b"".join(chunks)
+    response.close()
+    assert body.count(b"\nscore,") == 3000
+    elo_bot.shards.evict_idle()
+    assert ("T1", "C9") not in elo_bot.shards._shards
+    elo_bot.shards.close()
+
+
+def test_shards_load_outside_the_lock():
+    opened = []
+    release = threading.Event()
+
+    def open_shard(team_id, channel_id):
+        opened.append((team_id, channel_id))
+        if channel_id == "SLOW":
+            release.wait(5)
+        return ELO_System({}, {})
+
+    shards = ShardManager(open_shard)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(shards.get("T1", "SLOW"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # Other shards load while the slow one is still being opened
+    assert shards.get("T1", "C1") is not None
+    assert ("T1", "SLOW") not in shards._shards
+    release.set()
+    for thread in threads:
+        thread.join()
+    # Opened once, every caller got the same league
+    assert opened.count(("T1", "SLOW")) == 1
+    assert len(results) == 4 and all(elo_system is results[0] for elo_system in results)
+
+
+def test_shard_reopens_after_its_checkpoint(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("time.monotonic", clock)
+    events = []
+    checkpointing = threading.Event()
+    release = threading.Event()
+
+    def open_shard(team_id, channel_id):
+        events.append("open")
+        elo_system = ELO_System({}, {})
+
+        def checkpoint():
+            checkpointing.set()
+            release.wait(5)
+            events.append("checkpoint")
+        monkeypatch.setattr(elo_system, "checkpoint", checkpoint)
+        return elo_system
+
+    shards = ShardManager(open_shard, idle_timeout=10, evict_interval=0)
+    shards.get("T1", "C1")
+    clock.now = 100
+    evicting = threading.Thread(target=shards.evict_idle)
+    evicting.start()
+    checkpointing.wait(5)
+    # Waits for the checkpoint rather than opening the files it's still writing
+    getting = threading.Thread(target=shards.get, args=("T1", "C1"))
+    getting.start()
+    getting.join(0.2)
+    assert getting.is_alive() and events == ["open"]
+    release.set()
+    evicting.join()
+    getting.join()
+    assert events == ["open", "checkpoint", "open"]
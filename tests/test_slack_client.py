@@ -0,0 +1,36 @@
+import requests
+
+from fake_slack import FakeSlackServer
+from slack_client import SlackClient
+
+
+def test_retried_upload_sends_the_whole_file(tmp_path):
+    filepath = tmp_path / "graph.png"
+    filepath.write_bytes(b"\x89PNG" + bytes(range(256)) * 64)
+    # Every second call is rate limited, which lands on the upload itself
+    with FakeSlackServer(rate_limit_every=2) as server:
+        client = SlackClient("xoxb-test", base_url=server.url)
+        client._upload_image("C1", str(filepath))
+        client.close()
+    uploads = [body for path, body in server.calls if path.startswith("/upload/")]
+    assert len(uploads) == 1
+    assert filepath.read_bytes() in uploads[0]
+
+
+def test_timeouts_are_retried(monkeypatch):
+    client = SlackClient("xoxb-test", base_url="http://slack.invalid/api", max_retries=2)
+    attempts = []
+    response = requests.Response()
+    response.status_code = 200
+
+    def request(*args, **kwargs):
+        attempts.append(kwargs)
+        if len(attempts) < 3:
+            raise requests.ReadTimeout()
+        return response
+
+    monkeypatch.setattr(client.session, "request", request)
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    assert client._request("POST", "http://slack.invalid/api/chat.postMessage", "chat.postMessage") is response
+    assert len(attempts) == 3
+    client.close()
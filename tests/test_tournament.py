@@ -0,0 +1,181 @@
+import copy
+import random
+
+import pytest
+
+import commands
+from elo_system import ELO_System
+from tournament import DoubleElimination, Swiss, Tournament, load
+
+
+def bfs_record_result(bracket, winner_id, winner_score, loser_id, loser_score):
+    # The search the pending-match index replaced, returns the (round, match) slot the winner advanced to
+    queue = [(len(bracket)-1, 0)]
+    while len(queue) > 0:
+        round_idx, match_idx = queue.pop(0)
+
+        if round_idx - 1 < 0:
+            continue
+
+        lower_player = bracket[round_idx-1][match_idx*2]
+        upper_player = bracket[round_idx-1][match_idx*2 + 1]
+
+        queue.extend([(round_idx-1, match_idx*2), (round_idx-1, match_idx*2+1)])
+        if not lower_player or not upper_player:
+            continue
+        if lower_player["score"] is not None or upper_player["score"] is not None:
+            continue
+
+        if lower_player["id"] == winner_id and upper_player["id"] == loser_id:
+            lower_player["score"], upper_player["score"] = winner_score, loser_score
+        elif lower_player["id"] == loser_id and upper_player["id"] == winner_id:
+            lower_player["score"], upper_player["score"] = loser_score, winner_score
+        else:
+            continue
+        bracket[round_idx][match_idx] = {"id": winner_id, "score": None}
+        return (round_idx, match_idx)
+    return None
+
+
+def pending_pairs(bracket):
+    pairs = []
+    for round_idx in range(1, len(bracket)):
+        for match_idx in range(len(bracket[round_idx])):
+            lower_player = bracket[round_idx-1][match_idx*2]
+            upper_player = bracket[round_idx-1][match_idx*2 + 1]
+            if lower_player and upper_player and lower_player["score"] is None and upper_player["score"] is None:
+                pairs.append((lower_player["id"], upper_player["id"]))
+    return pairs
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_pending_index_matches_bfs(seed):
+    rng = random.Random(seed)
+    players = [f"<@U{i}>" for i in range(rng.randint(2, 70))]
+    if rng.random() < 0.5:
+        tournament = Tournament.create(players)
+    else:
+        tournament = Tournament.create_seeded(players)
+    expected = copy.deepcopy(tournament.bracket)
+
+    while True:
+        pairs = pending_pairs(expected)
+        if not pairs:
+            break
+        if rng.random() < 0.7:
+            winner_id, loser_id = rng.choice(pairs)
+        else:
+            # Players who may not have a match with each other, or aren't in the bracket at all
+            winner_id, loser_id = rng.sample(players + ["<@UOUTSIDE>"], 2)
+        if rng.random() < 0.5:
+            winner_id, loser_id = loser_id, winner_id
+        winner_score, loser_score = rng.randint(0, 20), rng.randint(0, 20)
+
+        assert tournament._record_result(winner_id, winner_score, loser_id, loser_score) == \
+            bfs_record_result(expected, winner_id, winner_score, loser_id, loser_score)
+        assert tournament.bracket == expected
+
+        # Reloading from the saved state rebuilds the same index
+        if rng.random() < 0.1:
+            tournament = Tournament(copy.deepcopy(tournament.state))
+
+    assert not tournament._pending_matches
+    assert expected[-1][0] is not None
+
+
+def double_pending_pairs(tournament):
+    return [tuple(pair) for pair in list(tournament.winners._pending_matches) + list(tournament._pending_matches)]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_double_elimination_plays_to_a_champion(seed):
+    rng = random.Random(seed)
+    # Sizes that aren't a power of two leave byes, which drop into the losers bracket too
+    players = [f"<@U{i}>" for i in range(rng.randint(2, 40))]
+    tournament = DoubleElimination.create(players)
+    losses = dict.fromkeys(players, 0)
+    played = 0
+    while True:
+        pairs = double_pending_pairs(tournament)
+        if not pairs:
+            break
+        for pair in pairs:
+            # Nobody plays on after their second loss
+            assert all(losses[player] < 2 for player in pair)
+        winner_id, loser_id = rng.sample(rng.choice(pairs), 2)
+        assert tournament.record_result(winner_id, rng.randint(5, 10), loser_id, rng.randint(0, 4))
+        losses[loser_id] += 1
+        played += 1
+        assert tournament.state["champion"] is None or not double_pending_pairs(tournament)
+        if rng.random() < 0.1:
+            tournament = load(copy.deepcopy(tournament.state))
+
+    champion = tournament.state["champion"]
+    assert champion in players and losses[champion] <= 1
+    # Everyone else is out after two losses, bar the loser of the final if it was their first
+    once_beaten = [player for player in players if player != champion and losses[player] == 1]
+    assert len(once_beaten) <= 1 and all(losses[player] == 2 for player in players if player not in once_beaten + [champion])
+    assert played == sum(losses.values())
+
+
+def test_double_elimination_bye_drops_play_out():
+    # 5 players in an 8 slot bracket, the top three seeds get a first round bye
+    tournament = DoubleElimination.create([f"<@U{i}>" for i in range(5)])
+    assert sorted(map(sorted, double_pending_pairs(tournament))) == [["<@U1>", "<@U2>"], ["<@U3>", "<@U4>"]]
+    tournament.record_result("<@U3>", 6, "<@U4>", 2)
+    # The loser meets one of the byes in the losers bracket and moves on without a match
+    assert tournament.state["losers"][0][0] == [{"id": None, "score": None}, {"id": "<@U4>", "score": None}]
+    assert tournament.state["losers"][1][0][0] == {"id": "<@U4>", "score": None}
+    assert all("<@U4>" not in pair for pair in double_pending_pairs(tournament))
+
+
+def swiss_pairs(tournament):
+    return [frozenset(match["players"]) for matches in tournament.state["rounds"] for match in matches if match["players"][1]]
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_swiss_never_pairs_a_rematch(seed):
+    rng = random.Random(seed)
+    players = [f"<@U{i}>" for i in range(rng.randint(2, 30))]
+    num_rounds = rng.randint(1, max(len(players) // 2, 1))
+    tournament = Swiss.create(players, num_rounds)
+    while tournament._pending_matches:
+        playerA, playerB = rng.choice(list(tournament._pending_matches))
+        scoreA, scoreB = rng.randint(0, 10), rng.randint(0, 10)
+        # Swiss takes draws
+        assert tournament.record_result(playerA, scoreA, playerB, scoreB)
+        if rng.random() < 0.1:
+            tournament = load(copy.deepcopy(tournament.state))
+
+    assert len(tournament.state["rounds"]) == num_rounds
+    pairs = swiss_pairs(tournament)
+    assert len(pairs) == len(set(pairs))
+    byes = [match["players"][0] for matches in tournament.state["rounds"] for match in matches if not match["players"][1]]
+    assert len(byes) == len(set(byes)) == (num_rounds if len(players) % 2 else 0)
+    # A point per match and bye, split on a draw
+    assert sum(points for _, points, _ in tournament.standings()) == len(pairs) + len(byes)
+
+
+def test_players_listed_twice():
+    with pytest.raises(commands.ParseError) as e:
+        commands.parse_tournament("--swiss <@U1|ann> <@U2|bob> <@U1|ann>")
+    assert e.value.pos == len("--swiss <@U1|ann> <@U2|bob> ")
+
+    # Entries logged before the parser checked
+    elo_system = ELO_System({}, {})
+    elo_system.start_tournament([("<@U1>", "ann"), ("<@U2>", "bob"), ("<@U1>", "ann")], name="cup", format="swiss", rounds=1)
+    assert elo_system.tournaments["cup"].state["rounds"] == [[{"players": ["<@U1>", "<@U2>"], "scores": None}]]
+    with pytest.raises(ValueError):
+        elo_system.start_tournament([("<@U1>", "ann"), ("<@U1>", "ann")], name="cup", format="double")
+
+
+def test_swiss_draws_are_recorded():
+    elo_system = ELO_System({}, {})
+    elo_system.start_tournament([("<@U1>", "ann"), ("<@U2>", "bob")], name="cup", format="swiss", rounds=2)
+    assert elo_system.challenge_match("<@U1>", 5, "<@U2>", 5)[3] == "cup"
+    assert [points for _, points, _ in elo_system.tournaments["cup"].standings()] == [0.5, 0.5]
+
+    # Elimination matches wait for a winner
+    elo_system.start_tournament([("<@U3>", "cid"), ("<@U4>", "dan")], name="ko", format="seeded")
+    assert elo_system.challenge_match("<@U3>", 5, "<@U4>", 5)[3] is None
+    assert elo_system.challenge_match("<@U3>", 6, "<@U4>", 5)[3] == "ko"
@@ -0,0 +1,83 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from player import EVENTS, ScoreHistory
+from windowed import EventWindow, WindowIndex
+
+START = date(2024, 1, 1)
+
+
+def random_rows(rng, num_rows):
+    # (ISO date, event, score) rows in random order, several on some days
+    return [((START + timedelta(days=rng.randint(0, 60))).isoformat(), rng.choice(EVENTS), rng.randint(100, 654)) for _ in range(num_rows)]
+
+
+def brute_force(rows, event, since, until):
+    # The leaderboard over every row, ties broken by player id
+    in_window = {}
+    for player, day, row_event, score in rows:
+        if row_event == event and (since is None or day >= since) and (until is None or day <= until):
+            in_window.setdefault(player, []).append(score)
+    by_best = sorted(((player, max(scores)) for player, scores in in_window.items()), key=lambda row: (-row[1], row[0]))
+    by_avg = sorted(((player, sum(scores) / len(scores)) for player, scores in in_window.items()), key=lambda row: (-row[1], row[0]))
+    return by_best, by_avg
+
+
+def random_windows(rng, count):
+    yield None, None
+    for _ in range(count):
+        first, last = sorted(rng.sample(range(-5, 66), 2))
+        since, until = (START + timedelta(days=first)).isoformat(), (START + timedelta(days=last)).isoformat()
+        yield rng.choice([since, None]), rng.choice([until, until, None])
+
+
+def assert_leaderboards_match(index, rows, rng):
+    for event in EVENTS:
+        for since, until in random_windows(rng, 30):
+            by_best, by_avg = index.leaderboard(event, since, until)
+            expected_best, expected_avg = brute_force(rows, event, since, until)
+            assert by_best == expected_best
+            assert [player for player, _ in by_avg] == [player for player, _ in expected_avg]
+            assert [avg for _, avg in by_avg] == pytest.approx([avg for _, avg in expected_avg])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_built_and_added_windows_match_brute_force(seed):
+    rng = random.Random(seed)
+    histories = {f"<@U{k}>": random_rows(rng, rng.randint(0, 80)) for k in range(8)}
+    rows = [(player, *row) for player, player_rows in histories.items() for row in player_rows]
+
+    built = WindowIndex.from_histories((player, ScoreHistory(player_rows)) for player, player_rows in histories.items())
+    assert_leaderboards_match(built, rows, rng)
+
+    # Added a score at a time: in date order, then backdated scores on top of that
+    added = WindowIndex()
+    in_order = sorted(rows, key=lambda row: row[1])
+    for player, day, event, score in in_order[:len(in_order) // 2]:
+        added.add(player, day, event, score)
+    rest = in_order[len(in_order) // 2:]
+    rng.shuffle(rest)
+    for player, day, event, score in rest:
+        added.add(player, day, event, score)
+    assert_leaderboards_match(added, rows, rng)
+
+    # Both ways give the same arrays
+    for event in EVENTS:
+        for player, window in built.windows[event].items():
+            other = added.windows[event][player]
+            assert (window.days, window.counts, window.sums, window.best) == (other.days, other.counts, other.sums, other.best)
+
+
+def test_event_window_same_day_scores():
+    window = EventWindow()
+    for score in [540, 560, 530]:
+        window.add(100, score)
+    window.add(102, 500)
+    window.add(101, 590)
+    assert len(window) == 5
+    assert window.window() == (5, 2720, 590)
+    assert window.window(100, 100) == (3, 1630, 560)
+    assert window.window(102) == (1, 500, 500)
+    assert window.window(103) is None
@@ -0,0 +1,103 @@
+from array import array
+from datetime import date
+
+# Most recent rating changes kept as they are
+RAW_POINTS = 256
+# Older changes are kept as per-day buckets, merged pairwise once there are more than this
+MAX_BUCKETS = 512
+
+
+class RatingSeries:
+    '''
+    A player's rating after every change, oldest first.
+
+    The latest RAW_POINTS changes are kept exactly. Older ones are folded
+    into one (low, high, last) bucket per day, and once there are more than
+    MAX_BUCKETS buckets the oldest half is merged pairwise. A player's
+    history stays bounded however much they play, and recent history keeps
+    full detail.
+    '''
+    __slots__ = ("dates", "ratings", "bucket_dates", "lows", "highs", "lasts")
+
+    def __init__(self):
+        self.dates = array("i") # day ordinals
+        self.ratings = array("d")
+        self.bucket_dates = array("i") # first day each bucket covers
+        self.lows = array("d")
+        self.highs = array("d")
+        self.lasts = array("d")
+
+    def from_state(state):
+        # The JSON form written by to_state
+        series = RatingSeries()
+        for day, rating in state.get("points", []):
+            series.dates.append(date.fromisoformat(day).toordinal())
+            series.ratings.append(rating)
+        for day, low, high, last in state.get("buckets", []):
+            series.bucket_dates.append(date.fromisoformat(day).toordinal())
+            series.lows.append(low)
+            series.highs.append(high)
+            series.lasts.append(last)
+        return series
+
+    def to_state(self):
+        return {
+            "points": [[date.fromordinal(day).isoformat(), rating] for day, rating in zip(self.dates, self.ratings)],
+            "buckets": [
+                [date.fromordinal(day).isoformat(), low, high, last]
+                for day, low, high, last in zip(self.bucket_dates, self.lows, self.highs, self.lasts)
+            ]
+        }
+
+    def __len__(self):
+        return len(self.dates) + len(self.bucket_dates)
+
+    def add(self, day, rating):
+        '''
+        Appends the rating a player reached on the ISO date day
+        '''
+        self.dates.append(date.fromisoformat(day).toordinal())
+        self.ratings.append(rating)
+        if len(self.dates) > RAW_POINTS:
+            self._fold(RAW_POINTS // 2)
+
+    def _fold(self, count):
+        # Moves the oldest count points into the day buckets
+        for day, rating in zip(self.dates[:count], self.ratings[:count]):
+            if self.bucket_dates and self.bucket_dates[-1] == day:
+                self.lows[-1] = min(self.lows[-1], rating)
+                self.highs[-1] = max(self.highs[-1], rating)
+                self.lasts[-1] = rating
+            else:
+                self.bucket_dates.append(day)
+                self.lows.append(rating)
+                self.highs.append(rating)
+                self.lasts.append(rating)
+        del self.dates[:count]
+        del self.ratings[:count]
+
+        if len(self.bucket_dates) > MAX_BUCKETS:
+            half = len(self.bucket_dates) // 4 * 2
+            self.lows[:half] = array("d", map(min, self.lows[0:half:2], self.lows[1:half:2]))
+            self.highs[:half] = array("d", map(max, self.highs[0:half:2], self.highs[1:half:2]))
+            self.lasts[:half] = self.lasts[1:half:2]
+            self.bucket_dates[:half] = self.bucket_dates[0:half:2]
+
+    def latest(self, count):
+        '''
+        Returns up to count of the newest samples as (ISO date, low, high, last)
+        tuples, oldest first. Exact points have low == high == last.
+        '''
+        num_points = min(count, len(self.dates))
+        num_buckets = min(count - num_points, len(self.bucket_dates))
+        samples = []
+        for k in range(len(self.bucket_dates) - num_buckets, len(self.bucket_dates)):
+            samples.append((self.bucket_dates[k], self.lows[k], self.highs[k], self.lasts[k]))
+        for k in range(len(self.dates) - num_points, len(self.dates)):
+            samples.append((self.dates[k], self.ratings[k], self.ratings[k], self.ratings[k]))
+
+        days = {}
+        for day, *_ in samples:
+            if day not in days:
+                days[day] = date.fromordinal(day).isoformat()
+        return [(days[day], low, high, last) for day, low, high, last in samples]
@@ -0,0 +1,514 @@
+import math
+
+# "single" shuffles players into the bracket, the other formats seed them by elo
+FORMATS = ["single", "seeded", "double", "swiss"]
+# Placeholder slot for a player who doesn't exist, whoever meets it advances without playing
+BYE = {"id": None, "score": None}
+
+
+def seed_positions(size):
+    '''
+    Returns the seeds (0 is the best) in bracket order for a bracket of size
+    slots, a power of two: 1 meets size in the first round and the top seeds
+    can only meet in the last rounds
+    '''
+    positions = [0]
+    while len(positions) < size:
+        num_slots = len(positions) * 2
+        positions = [p for seed in positions for p in (seed, num_slots - 1 - seed)]
+    return positions
+
+
+def _player_name(records, player_id):
+    return records[player_id]["name"] or player_id
+
+
+def _slot_label(records, slot):
+    if not slot:
+        return (None, None)
+    if slot["id"] is None:
+        return ("bye", None)
+    return (_player_name(records, slot["id"]), slot["score"])
+
+
+class Tournament:
+    '''
+    Single elimination bracket. state is the JSON-serializable dict that gets
+    persisted, {"bracket": bracket} where bracket[r] lists the (player_id, score)
+    slots of round r and adjacent slots 2i and 2i+1 are matched up. Seeded
+    brackets also have "format": "seeded".
+    '''
+
+    def __init__(self, state):
+        self.state = state
+        self._build_pending_matches()
+
+    @property
+    def bracket(self):
+        return self.state["bracket"]
+
+    def create(id_list):
+        '''
+        Builds a bracket with byes for the players in id_list, in bracket order
+        '''
+        num_players = len(id_list)
+        num_rounds = math.ceil(math.log2(num_players) + 1)
+
+        # bfs down bracket and split players evenly to create bracket with byes
+        bracket = [[None] * (2 ** r) for r in range(num_rounds-1, -1, -1)]
+        queue = [(num_rounds-1, num_players, 0, 0)]
+        while len(queue) > 0:
+            round_idx, remaining_players, player_idx, bracket_idx = queue.pop(0)
+
+            if remaining_players == 1:
+                bracket[round_idx][bracket_idx] = {"id": id_list[player_idx], "score": None}
+                continue
+
+            num_players_to_bot = math.floor(remaining_players/2)
+            queue.append((round_idx-1, remaining_players - num_players_to_bot, num_players_to_bot + player_idx, 2 * bracket_idx + 1))
+            queue.append((round_idx-1, num_players_to_bot,                     player_idx,                      2 * bracket_idx))
+
+        return Tournament({"bracket": bracket})
+
+    def create_seeded(seeds):
+        '''
+        Builds a bracket for the players in seeds, best first. Seeds are placed
+        with seed_positions and the top seeds get the byes.
+        '''
+        num_rounds = math.ceil(math.log2(len(seeds)) + 1)
+        size = 2 ** (num_rounds - 1)
+        bracket = [[None] * (2 ** r) for r in range(num_rounds-1, -1, -1)]
+        slots = [seeds[seed] if seed < len(seeds) else None for seed in seed_positions(size)]
+        for idx in range(0, size, 2):
+            lower_player, upper_player = slots[idx], slots[idx + 1]
+            if lower_player and upper_player:
+                bracket[0][idx] = {"id": lower_player, "score": None}
+                bracket[0][idx + 1] = {"id": upper_player, "score": None}
+            else:
+                # A bye, the player starts in the second round
+                bracket[1][idx // 2] = {"id": lower_player or upper_player, "score": None}
+        return Tournament({"format": "seeded", "bracket": bracket})
+
+    def _index_match_if_ready(self, round_idx, match_idx):
+        # Adds the match feeding bracket[round_idx][match_idx] to the pending index once both players are known
+        bracket = self.bracket
+        if round_idx < 1 or round_idx >= len(bracket):
+            return
+
+        lower_player = bracket[round_idx-1][match_idx*2]
+        upper_player = bracket[round_idx-1][match_idx*2 + 1]
+        if not lower_player or not upper_player:
+            return
+        if lower_player["score"] is None and upper_player["score"] is None:
+            self._pending_matches[frozenset((lower_player["id"], upper_player["id"]))] = (round_idx, match_idx)
+
+    def _build_pending_matches(self):
+        '''
+        Indexes the unplayed matches by their unordered pair of players,
+        pointing to the (round, match) slot the winner advances to
+        '''
+        self._pending_matches = {}
+        bracket = self.bracket
+        for round_idx in range(1, len(bracket)):
+            for match_idx in range(len(bracket[round_idx])):
+                self._index_match_if_ready(round_idx, match_idx)
+
+    def players(self):
+        return {slot["id"] for round_players in self.bracket for slot in round_players if slot}
+
+    def record_result(self, winner_id, winner_score, loser_id, loser_score):
+        '''
+        Records the result if the two players have a pending match.
+        Returns True if a match was found
+        '''
+        return self._record_result(winner_id, winner_score, loser_id, loser_score) is not None
+
+    def _record_result(self, winner_id, winner_score, loser_id, loser_score):
+        # Returns the (round, match) slot the winner advanced to, or None
+        match = self._pending_matches.pop(frozenset((winner_id, loser_id)), None)
+        if not match:
+            return None
+
+        bracket = self.bracket
+        round_idx, match_idx = match
+        lower_player = bracket[round_idx-1][match_idx*2]
+        upper_player = bracket[round_idx-1][match_idx*2 + 1]
+
+        if lower_player["id"] == winner_id:
+            lower_player["score"] = winner_score
+            upper_player["score"] = loser_score
+        else:
+            lower_player["score"] = loser_score
+            upper_player["score"] = winner_score
+        bracket[round_idx][match_idx] = {"id": winner_id, "score": None}
+
+        # The winner's next match becomes pending once their opponent is decided too
+        self._index_match_if_ready(round_idx + 1, match_idx // 2)
+        return match
+
+    def to_matrix(self, records):
+        '''
+        Returns the bracket as (name, score) slots for graphics.generate_bracket_image
+        '''
+        output_bracket = []
+        for round_players in self.bracket:
+            output_bracket.append([])
+            for slot in round_players:
+                if not slot:
+                    output_bracket[-1].append((None, None))
+                else:
+                    output_bracket[-1].append((_player_name(records, slot["id"]), slot["score"]))
+        return output_bracket
+
+
+class DoubleElimination:
+    '''
+    Double elimination: a seeded winners bracket, a losers bracket that
+    players drop into after their first loss, and a grand final between the
+    winners of both (a single match, the bracket isn't reset if the losers
+    bracket player wins it).
+
+    state is {"format": "double", "bracket": winners bracket as in Tournament,
+    "losers": rounds of [slot, slot] matches, "final": [slot, slot],
+    "champion": player_id or None}. A slot is None until its player is known.
+    Losers bracket rounds alternate between pairing the previous round's
+    winners with players dropping from the winners bracket, and pairing the
+    previous round's winners with each other.
+    '''
+
+    def __init__(self, state):
+        self.state = state
+        # Shares state["bracket"], results in the winners bracket go straight to the state
+        self.winners = Tournament(state)
+        self._build_pending_matches()
+
+    @property
+    def bracket(self):
+        return self.state["bracket"]
+
+    def create(seeds):
+        '''
+        Builds the brackets for the players in seeds, best first
+        '''
+        bracket = Tournament.create_seeded(seeds).bracket
+        size = len(bracket[0])
+        num_rounds = len(bracket) - 1
+        state = {
+            "format": "double",
+            "bracket": bracket,
+            # Two losers rounds per winners round after the first, halving every other round
+            "losers": [[[None, None] for _ in range(size // 2 ** (r // 2 + 2))] for r in range(2 * num_rounds - 2)],
+            "final": [None, None],
+            "champion": None
+        }
+        tournament = DoubleElimination(state)
+        # Byes in the first round send a bye down to the losers bracket too
+        for match_idx in range(size // 2):
+            if not bracket[0][2 * match_idx] and not bracket[0][2 * match_idx + 1]:
+                tournament._drop(1, match_idx, dict(BYE))
+        return tournament
+
+    def _match(self, location):
+        if location[0] == "final":
+            return self.state["final"]
+        _, round_idx, match_idx = location
+        return self.state["losers"][round_idx][match_idx]
+
+    def _build_pending_matches(self):
+        # Unplayed losers bracket and final matches by their unordered pair of players
+        self._pending_matches = {}
+        locations = [("final",)]
+        for round_idx, matches in enumerate(self.state["losers"]):
+            locations += [("losers", round_idx, match_idx) for match_idx in range(len(matches))]
+        for location in locations:
+            lower_player, upper_player = self._match(location)
+            if lower_player and upper_player and lower_player["id"] and upper_player["id"] and lower_player["score"] is None and upper_player["score"] is None:
+                self._pending_matches[frozenset((lower_player["id"], upper_player["id"]))] = location
+
+    def _place(self, location, slot_idx, slot):
+        # Puts a player (or a bye) into a match, and plays it out right away if the other side is a bye
+        match = self._match(location)
+        match[slot_idx] = slot
+        lower_player, upper_player = match
+        if not lower_player or not upper_player:
+            return
+        if lower_player["id"] and upper_player["id"]:
+            self._pending_matches[frozenset((lower_player["id"], upper_player["id"]))] = location
+        else:
+            self._advance(location, lower_player["id"] or upper_player["id"])
+
+    def _drop(self, round_idx, match_idx, slot):
+        # Sends the loser of the winners bracket match feeding bracket[round_idx][match_idx] to the losers bracket
+        losers = self.state["losers"]
+        if not losers:
+            self._place(("final",), 1, slot)
+        elif round_idx == 1:
+            self._place(("losers", 0, match_idx // 2), match_idx % 2, slot)
+        else:
+            # Dropped players are fed in reverse order so early rematches are avoided
+            losers_round = losers[2 * round_idx - 3]
+            self._place(("losers", 2 * round_idx - 3, len(losers_round) - 1 - match_idx), 1, slot)
+
+    def _advance(self, location, winner_id):
+        # winner_id is None when a bye "won" against another bye
+        slot = {"id": winner_id, "score": None}
+        if location[0] == "final":
+            self.state["champion"] = winner_id
+            return
+        _, round_idx, match_idx = location
+        if round_idx == len(self.state["losers"]) - 1:
+            self._place(("final",), 1, slot)
+        elif round_idx % 2 == 0:
+            self._place(("losers", round_idx + 1, match_idx), 0, slot)
+        else:
+            self._place(("losers", round_idx + 1, match_idx // 2), match_idx % 2, slot)
+
+    def players(self):
+        return self.winners.players()
+
+    def record_result(self, winner_id, winner_score, loser_id, loser_score):
+        '''
+        Records the result if the two players have a pending match in either
+        bracket or the final. Returns True if a match was found
+        '''
+        match = self.winners._record_result(winner_id, winner_score, loser_id, loser_score)
+        if match:
+            round_idx, match_idx = match
+            self._drop(round_idx, match_idx, {"id": loser_id, "score": None})
+            if round_idx == len(self.bracket) - 1:
+                self._place(("final",), 0, {"id": winner_id, "score": None})
+            return True
+
+        location = self._pending_matches.pop(frozenset((winner_id, loser_id)), None)
+        if not location:
+            return False
+        for slot in self._match(location):
+            slot["score"] = winner_score if slot["id"] == winner_id else loser_score
+        self._advance(location, winner_id)
+        return True
+
+    def to_matrix(self, records):
+        '''
+        Returns the winners bracket as in Tournament.to_matrix and the losers
+        bracket and final as rounds of [(name, score), (name, score)] matches
+        '''
+        champion = self.state["champion"]
+        return {
+            "format": "double",
+            "winners": self.winners.to_matrix(records),
+            "losers": [[[_slot_label(records, slot) for slot in match] for match in matches] for matches in self.state["losers"]],
+            "final": [_slot_label(records, slot) for slot in self.state["final"]],
+            "champion": _player_name(records, champion) if champion else None
+        }
+
+
+def _pairing_candidates(remaining, points, played):
+    '''
+    Yields the opponents for remaining[0] that they haven't played yet, best
+    first: their own score group with the top half meeting the bottom half,
+    nearest to that pairing first, then the lower groups in rank order
+    '''
+    top = remaining[0]
+    group_size = 1
+    while group_size < len(remaining) and points[remaining[group_size]] == points[top]:
+        group_size += 1
+    target = group_size // 2
+    group = sorted(range(1, group_size), key=lambda idx: (abs(idx - target), idx < target))
+    already_played = played.get(top, ())
+    for idx in group + list(range(group_size, len(remaining))):
+        if remaining[idx] not in already_played:
+            yield remaining[idx]
+
+
+def pair_players(ranked, points, played, max_steps=100000):
+    '''
+    Pairs up ranked (an even number of players, best first) with a depth
+    first search over _pairing_candidates, backtracking when the players left
+    can't be paired without a rematch. Without conflicts this is a single pass.
+
+    points maps players to their points, played maps players to the set of
+    players they've met. Returns a list of (player, opponent) pairs, or None if
+    there's no pairing without rematches or the search took more than max_steps.
+    '''
+    pairs = []
+    stack = [(ranked, _pairing_candidates(ranked, points, played))]
+    steps = 0
+    while stack:
+        remaining, candidates = stack[-1]
+        if not remaining:
+            return pairs
+        opponent = next(candidates, None)
+        if opponent is None:
+            # Dead end, undo the pairing that led here
+            stack.pop()
+            if pairs:
+                pairs.pop()
+            continue
+        steps += 1
+        if steps > max_steps:
+            return None
+        pairs.append((remaining[0], opponent))
+        rest = [player for player in remaining[1:] if player != opponent]
+        stack.append((rest, _pairing_candidates(rest, points, played)))
+    return None
+
+
+class Swiss:
+    '''
+    Swiss system: nobody is eliminated, every round pairs players on equal or
+    close points who haven't met yet. A win or a bye is worth a point.
+
+    state is {"format": "swiss", "players": player ids by seed, "num_rounds": n,
+    "rounds": [[match, ...], ...]} where a match is {"players": [a, b],
+    "scores": [score_a, score_b] or None} and b is None for a bye. The next
+    round is paired once every match in the current one has a result.
+    '''
+
+    def __init__(self, state):
+        self.state = state
+        self._build_pending_matches()
+
+    def create(seeds, num_rounds=None):
+        '''
+        Pairs the first round for the players in seeds, best first. num_rounds
+        defaults to enough rounds to leave a single unbeaten player.
+        '''
+        num_rounds = num_rounds or max(math.ceil(math.log2(len(seeds))), 1)
+        tournament = Swiss({"format": "swiss", "players": list(seeds), "num_rounds": num_rounds, "rounds": []})
+        tournament._pair_next_round()
+        return tournament
+
+    def _build_pending_matches(self):
+        # Only the current round can have unplayed matches
+        self._pending_matches = {}
+        rounds = self.state["rounds"]
+        for match_idx, match in enumerate(rounds[-1] if rounds else []):
+            playerA, playerB = match["players"]
+            if playerB and match["scores"] is None:
+                self._pending_matches[frozenset((playerA, playerB))] = match_idx
+
+    def standings(self):
+        '''
+        Returns [(player, points, buchholz)] best first, buchholz (the sum of
+        the opponents' points) breaking ties before the seeds do
+        '''
+        players = self.state["players"]
+        points = dict.fromkeys(players, 0.0)
+        opponents = {player: [] for player in players}
+        for matches in self.state["rounds"]:
+            for match in matches:
+                playerA, playerB = match["players"]
+                if not playerB:
+                    points[playerA] += 1
+                    continue
+                opponents[playerA].append(playerB)
+                opponents[playerB].append(playerA)
+                if match["scores"] is not None:
+                    scoreA, scoreB = match["scores"]
+                    points[playerA] += 1 if scoreA > scoreB else 0.5 if scoreA == scoreB else 0
+                    points[playerB] += 1 if scoreB > scoreA else 0.5 if scoreA == scoreB else 0
+        seed = {player: idx for idx, player in enumerate(players)}
+        buchholz = {player: sum(points[opponent] for opponent in opponents[player]) for player in players}
+        ranked = sorted(players, key=lambda player: (-points[player], -buchholz[player], seed[player]))
+        return [(player, points[player], buchholz[player]) for player in ranked]
+
+    def _pair_next_round(self):
+        players = self.state["players"]
+        seed = {player: idx for idx, player in enumerate(players)}
+        points = {player: player_points for player, player_points, _ in self.standings()}
+        played = {}
+        had_bye = set()
+        for matches in self.state["rounds"]:
+            for match in matches:
+                playerA, playerB = match["players"]
+                if not playerB:
+                    had_bye.add(playerA)
+                    continue
+                played.setdefault(playerA, set()).add(playerB)
+                played.setdefault(playerB, set()).add(playerA)
+
+        # Pairing order is points then seed
+        ranked = sorted(players, key=lambda player: (-points[player], seed[player]))
+        bye = None
+        if len(ranked) % 2:
+            # The lowest ranked player who hasn't had a bye yet sits out
+            bye = next((player for player in reversed(ranked) if player not in had_bye), ranked[-1])
+            ranked.remove(bye)
+
+        pairs = pair_players(ranked, points, played)
+        if pairs is None:
+            # Everyone has met everyone they could, allow rematches
+            pairs = pair_players(ranked, points, {})
+
+        matches = [{"players": [playerA, playerB], "scores": None} for playerA, playerB in pairs]
+        if bye:
+            matches.append({"players": [bye, None], "scores": None})
+        self.state["rounds"].append(matches)
+        self._build_pending_matches()
+
+    def players(self):
+        return set(self.state["players"])
+
+    def record_result(self, winner_id, winner_score, loser_id, loser_score):
+        '''
+        Records the result if the two players are paired in the current
+        round, and pairs the next round once it's complete.
+        Returns True if a match was found
+        '''
+        match_idx = self._pending_matches.pop(frozenset((winner_id, loser_id)), None)
+        if match_idx is None:
+            return False
+        match = self.state["rounds"][-1][match_idx]
+        match["scores"] = [winner_score, loser_score] if match["players"][0] == winner_id else [loser_score, winner_score]
+        if not self._pending_matches and len(self.state["rounds"]) < self.state["num_rounds"]:
+            self._pair_next_round()
+        return True
+
+    def to_matrix(self, records):
+        '''
+        Returns the rounds as lists of [(name, score), (name, score)] matches,
+        with ("bye", None) for a bye, and the standings as (name, points) pairs
+        '''
+        rounds = []
+        for matches in self.state["rounds"]:
+            rounds.append([])
+            for match in matches:
+                scores = match["scores"] or [None, None]
+                rounds[-1].append([
+                    (_player_name(records, player), score) if player else ("bye", None)
+                    for player, score in zip(match["players"], scores)
+                ])
+        return {
+            "format": "swiss",
+            "num_rounds": self.state["num_rounds"],
+            "rounds": rounds,
+            "standings": [(_player_name(records, player), points) for player, points, _ in self.standings()]
+        }
+
+
+def create(format, id_list, num_rounds=None):
+    '''
+    Builds a tournament of the given format (see FORMATS) for the players in
+    id_list, in bracket order for "single" and best first for the others.
+    num_rounds only applies to Swiss.
+    '''
+    if format not in FORMATS:
+        raise ValueError(f"Unknown tournament format {format}")
+    if format == "single":
+        return Tournament.create(id_list)
+    if len(id_list) < 2:
+        raise ValueError(f"A {format} tournament needs at least 2 players")
+    if format == "seeded":
+        return Tournament.create_seeded(id_list)
+    if format == "double":
+        return DoubleElimination.create(id_list)
+    return Swiss.create(id_list, num_rounds)
+
+
+def load(state):
+    # States from before formats existed are single elimination brackets
+    if state.get("format") == "double":
+        return DoubleElimination(state)
+    if state.get("format") == "swiss":
+        return Swiss(state)
+    return Tournament(state)
@@ -10,6 +10,13 @@ def read_json_file(filepath):
     except json.JSONDecodeError:
         return {}
 
-def write_json_file(data, filepath):
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=4)
\ No newline at end of file
+
+def write_json_file_atomic(data, filepath):
+    # Write to a temp file and rename over the target so a crash mid-write
+    # never leaves a truncated state file behind
+    tmp_filepath = f"{filepath}.tmp"
+    with open(tmp_filepath, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filepath, filepath)
@@ -0,0 +1,206 @@
+'''
+Score aggregates over a window of days, for leaderboards of the last 30 days
+or a season without scanning every player's history.
+
+Each player's scores in an event are kept by the distinct days they shot:
+prefix sums of the count and total of the scores up to each day, and a
+sparse table of the best score over every power-of-two run of days. A window
+is found with two binary searches over the days, after which its count,
+total and best are O(1).
+'''
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+import numpy as np
+
+from player import EVENTS
+
+
+class EventWindow:
+    '''
+    One player's scores in one event. Scores on the latest day or a later one
+    are added in O(log days), an earlier day rebuilds the arrays.
+    '''
+    __slots__ = ("days", "counts", "sums", "best")
+
+    def __init__(self):
+        self.days = array("i") # distinct day ordinals, ascending
+        self.counts = array("q", [0]) # counts[k]: number of scores on days[:k]
+        self.sums = array("q", [0]) # sums[k]: total of the scores on days[:k]
+        self.best = [array("i")] # best[j][k]: best score on days[k:k + 2**j]
+
+    def from_columns(days, day_counts, day_sums, day_best):
+        # One entry per distinct day, ascending
+        window = EventWindow()
+        window.days = array("i", days)
+        window.counts = array("q", itertools.accumulate(day_counts, initial=0))
+        window.sums = array("q", itertools.accumulate(day_sums, initial=0))
+        window.best = [array("i", day_best)]
+        width = 1
+        while width * 2 <= len(window.days):
+            previous = window.best[-1]
+            window.best.append(array("i", map(max, previous[:-width], previous[width:])))
+            width *= 2
+        return window
+
+    def __len__(self):
+        return self.counts[-1]
+
+    def add(self, day, score):
+        '''
+        Adds a score shot on the day ordinal day
+        '''
+        days, best = self.days, self.best
+        if days and day < days[-1]:
+            self._insert(day, score)
+            return
+
+        if days and day == days[-1]:
+            self.counts[-1] += 1
+            self.sums[-1] += score
+            if score <= best[0][-1]:
+                return
+            best[0][-1] = score
+            append = False
+        else:
+            days.append(day)
+            self.counts.append(self.counts[-1] + 1)
+            self.sums.append(self.sums[-1] + score)
+            best[0].append(score)
+            append = True
+
+        # The last day is covered by one entry of each level, the last one
+        num_days = len(days)
+        level, width = 1, 2
+        while width <= num_days:
+            if level == len(best):
+                best.append(array("i"))
+            value = max(best[level - 1][num_days - width], best[level - 1][num_days - width // 2])
+            if append:
+                best[level].append(value)
+            else:
+                best[level][num_days - width] = value
+            level, width = level + 1, width * 2
+
+    def _insert(self, day, score):
+        # A backdated score, rebuild from the per-day columns
+        days = list(self.days)
+        day_counts = [b - a for a, b in zip(self.counts, self.counts[1:])]
+        day_sums = [b - a for a, b in zip(self.sums, self.sums[1:])]
+        day_best = list(self.best[0])
+        idx = bisect_left(days, day)
+        if idx < len(days) and days[idx] == day:
+            day_counts[idx] += 1
+            day_sums[idx] += score
+            day_best[idx] = max(day_best[idx], score)
+        else:
+            days.insert(idx, day)
+            day_counts.insert(idx, 1)
+            day_sums.insert(idx, score)
+            day_best.insert(idx, score)
+        window = EventWindow.from_columns(days, day_counts, day_sums, day_best)
+        self.days, self.counts, self.sums, self.best = window.days, window.counts, window.sums, window.best
+
+    def window(self, first=None, last=None):
+        '''
+        Returns (count, total, best) of the scores shot from day ordinal first
+        through last, either end open if None, or None if there are none
+        '''
+        lo = bisect_left(self.days, first) if first is not None else 0
+        hi = bisect_right(self.days, last) if last is not None else len(self.days)
+        if lo >= hi:
+            return None
+        level = (hi - lo).bit_length() - 1
+        best = self.best[level]
+        return self.counts[hi] - self.counts[lo], self.sums[hi] - self.sums[lo], max(best[lo], best[hi - (1 << level)])
+
+
+class WindowIndex:
+    '''
+    EventWindows for every player and event
+    '''
+
+    def __init__(self):
+        self.windows = {event: {} for event in EVENTS} # event -> player -> EventWindow
+
+    def from_histories(histories):
+        '''
+        Builds the index from (player, ScoreHistory) pairs in a few vectorized
+        passes: every score is sorted by (player, event, day), the days are
+        reduced to per-day count, total and best, and the sparse tables are
+        built over all players at once
+        '''
+        index = WindowIndex()
+        players, columns = [], []
+        for player, history in histories:
+            if len(history):
+                players.append(player)
+                columns.append((history.dates, history.events, history.scores))
+        if not players:
+            return index
+
+        lengths = [len(dates) for dates, _, _ in columns]
+        owner = np.repeat(np.arange(len(players), dtype=np.int64), lengths)
+        days = np.concatenate([np.frombuffer(dates, dtype=np.int32) for dates, _, _ in columns])
+        events = np.concatenate([np.frombuffer(events, dtype=np.int8) for _, events, _ in columns])
+        scores = np.concatenate([np.frombuffer(scores, dtype=scores.typecode).astype(np.int64) for _, _, scores in columns])
+
+        group = owner * len(EVENTS) + events
+        order = np.lexsort((days, group))
+        group, days, scores = group[order], days[order], scores[order]
+
+        # One row per (player, event, day)
+        new_day = np.ones(len(days), dtype=bool)
+        new_day[1:] = (group[1:] != group[:-1]) | (days[1:] != days[:-1])
+        starts = np.flatnonzero(new_day)
+        day_group, days = group[starts], days[starts]
+        day_counts = np.diff(np.append(starts, len(order)))
+        day_sums = np.add.reduceat(scores, starts)
+        day_best = np.maximum.reduceat(scores, starts).astype(np.int32)
+
+        # Levels run across group boundaries, entries that straddle one are never read
+        group_starts = np.flatnonzero(np.r_[True, day_group[1:] != day_group[:-1]])
+        group_ends = np.r_[group_starts[1:], len(day_group)]
+        levels = [day_best]
+        width = 1
+        while width * 2 <= (group_ends - group_starts).max():
+            levels.append(np.maximum(levels[-1][:-width], levels[-1][width:]))
+            width *= 2
+        count_sums = np.r_[0, np.cumsum(day_counts)]
+        score_sums = np.r_[0, np.cumsum(day_sums)]
+
+        for g, lo, hi in zip(day_group[group_starts].tolist(), group_starts.tolist(), group_ends.tolist()):
+            window = EventWindow()
+            window.days = array("i", days[lo:hi].tobytes())
+            window.counts = array("q", (count_sums[lo:hi + 1] - count_sums[lo]).tobytes())
+            window.sums = array("q", (score_sums[lo:hi + 1] - score_sums[lo]).tobytes())
+            window.best = [array("i", levels[level][lo:hi - (1 << level) + 1].tobytes()) for level in range((hi - lo).bit_length())]
+            player, event = divmod(g, len(EVENTS))
+            index.windows[EVENTS[event]][players[player]] = window
+        return index
+
+    def add(self, player, day, event, score):
+        # day is an ISO date
+        self.windows[event].setdefault(player, EventWindow()).add(date.fromisoformat(day).toordinal(), score)
+
+    def leaderboard(self, event, since=None, until=None):
+        '''
+        Returns ([(player, best)], [(player, average)]), both highest first, over
+        the scores in event shot from the ISO date since through until, either
+        end open if None. Players without scores in the window aren't ranked.
+        '''
+        first = date.fromisoformat(since).toordinal() if since else None
+        last = date.fromisoformat(until).toordinal() if until else None
+        by_best, by_avg = [], []
+        for player, window in self.windows[event].items():
+            aggregates = window.window(first, last)
+            if aggregates:
+                count, total, best = aggregates
+                by_best.append((player, best))
+                by_avg.append((player, total / count))
+        # Ties are broken by player id like LeaderboardIndex
+        by_best.sort(key=lambda row: (-row[1], row[0]))
+        by_avg.sort(key=lambda row: (-row[1], row[0]))
+        return by_best, by_avg